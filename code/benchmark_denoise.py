@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Denoise benchmark and equivalence check: retnet.Model.denoise against the skimage implementation it replaced.
+
+Both implementations run on the same frames, either frames of a box or generated frames (noise with
+bright objects of every size around the 100 pixel cut). The script reports the time per frame of each
+and exits with status 1 if any output differs.
+
+    python3 code/benchmark_denoise.py
+    python3 code/benchmark_denoise.py --box /app/data/1234 --frames 50
+    python3 code/benchmark_denoise.py --height 3000 --width 4000 --frames 20 --color
+"""
+
+import sys
+import time
+import argparse
+import numpy as np
+sys.path.append('/app/')
+
+
+def denoise_reference(image):
+    """
+    The skimage implementation Model.denoise replaced, kept as the reference output.
+
+    Grayscale frames are thresholded as they are, which is what skimage.color.rgb2gray did with 2-D input
+    before it stopped accepting it.
+    """
+    from skimage import color, morphology
+    grayscale = image if image.ndim == 2 else color.rgb2gray(image)
+    binarized = np.where(grayscale > np.mean(grayscale), 1, 0)
+    processed = morphology.remove_small_objects(binarized.astype(bool), min_size=100, connectivity=1).astype(int)
+    # black out pixels
+    mask_x, mask_y = np.where(processed == 0)
+    image[mask_x, mask_y] = 0
+    return image
+
+
+def generate_frames(count, height, width, color=False, seed=0):
+    """:return: (count, height, width[, 3]) uint8 frames of noise with bright rectangles and lines of random size"""
+    import cv2
+    rng = np.random.default_rng(seed)
+    frames = rng.normal(60, 15, size=(count, height, width)).clip(0, 255).astype(np.uint8)
+    for frame in frames:
+        for _ in range(200):
+            x, y = int(rng.integers(0, width)), int(rng.integers(0, height))
+            w, h = (int(v) for v in rng.integers(1, 25, size=2))
+            cv2.rectangle(frame, (x, y), (x + w, y + h), int(rng.integers(120, 255)), -1)
+        for _ in range(20):
+            points = rng.integers(0, [width, height], size=(2, 2))
+            cv2.line(frame, tuple(int(v) for v in points[0]), tuple(int(v) for v in points[1]), int(rng.integers(120, 255)), 3)
+    if color:
+        frames = np.stack([cv2.cvtColor(f, cv2.COLOR_GRAY2BGR) for f in frames])
+        frames[..., 0] = frames[..., 0] // 2
+    return frames
+
+
+def load_frames(path, count):
+    import src.myutilities.box as box
+    b = box.Box(path)
+    indices = np.linspace(0, len(b.images) - 1, count).astype(int)
+    frames = np.stack([np.array(b.images[i]) for i in indices])
+    b.close()
+    return frames
+
+
+def time_per_frame(func, frames):
+    """:return: (seconds per frame, outputs) for func applied to copies of frames"""
+    inputs = [frame.copy() for frame in frames]
+    start = time.perf_counter()
+    outputs = [func(frame) for frame in inputs]
+    return (time.perf_counter() - start) / len(frames), outputs
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark Model.denoise and check it matches the skimage implementation.')
+    parser.add_argument('--box', type=str, default=None, help='take frames from this box instead of generating them')
+    parser.add_argument('--frames', type=int, default=10, help='number of frames (default: 10)')
+    parser.add_argument('--height', type=int, default=1500, help='height of generated frames (default: 1500)')
+    parser.add_argument('--width', type=int, default=2000, help='width of generated frames (default: 2000)')
+    parser.add_argument('--color', action='store_true', help='generate 3-channel frames')
+    args = parser.parse_args()
+
+    from src.retnet.model import Model
+
+    if args.box:
+        frames = load_frames(args.box, args.frames)
+    else:
+        frames = generate_frames(args.frames, args.height, args.width, color=args.color)
+    print(f"{len(frames)} frames of shape {frames.shape[1:]}")
+
+    reference_time, reference = time_per_frame(denoise_reference, frames)
+    denoise_time, denoised = time_per_frame(Model.denoise, frames)
+    stack = frames.copy()
+    start = time.perf_counter()
+    Model.denoise_stack(stack)
+    stack_time = (time.perf_counter() - start) / len(frames)
+
+    mismatches = [i for i in range(len(frames)) if not (np.array_equal(reference[i], denoised[i]) and np.array_equal(reference[i], stack[i]))]
+    print(f"skimage reference: {1000 * reference_time:8.1f} ms/frame")
+    print(f"Model.denoise:     {1000 * denoise_time:8.1f} ms/frame ({reference_time / denoise_time:.1f}x)")
+    print(f"Model.denoise_stack: {1000 * stack_time:6.1f} ms/frame ({reference_time / stack_time:.1f}x)")
+    if mismatches:
+        print(f"Output differs from the reference on frames {mismatches}")
+        sys.exit(1)
+    print("Output identical to the reference on every frame.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Seed detection benchmark: latency and recall of the seed model at several inference scales.
+
+Frame 0 of each box is cropped to the detection band Box.init_seeds uses and run through the seed model
+at every requested inference scale. The detections at the largest scale are the reference: recall at a
+scale is the fraction of reference seeds matched by a detection with an IoU of at least --iou.
+
+    python3 code/benchmark_detection.py /app/data/1234 /app/data/1235 --scales 1.0 0.75 0.5 0.35
+
+Boxes are directories of images, raw frame stacks or videos, as for tracking.
+"""
+
+import sys
+import time
+import argparse
+import numpy as np
+sys.path.append('/app/')
+
+SEED_MODEL_PATH = "/app/models/SeedInference.h5"
+
+
+def iou(a, b):
+    """:return: intersection over union of two (x1, x2, y1, y2) boxes"""
+    w = min(a[1], b[1]) - max(a[0], b[0])
+    h = min(a[3], b[3]) - max(a[2], b[2])
+    if w <= 0 or h <= 0:
+        return 0.0
+    inter = w * h
+    return inter / ((a[1] - a[0]) * (a[3] - a[2]) + (b[1] - b[0]) * (b[3] - b[2]) - inter)
+
+
+def recall(reference, found, threshold):
+    """:return: fraction of reference boxes matched by a found box with IoU >= threshold"""
+    if not reference:
+        return 1.0
+    return sum(any(iou(r, f) >= threshold for f in found) for r in reference) / len(reference)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark seed detection latency and recall against inference scale.')
+    parser.add_argument('boxes', nargs='+', help='box paths to take frame 0 from')
+    parser.add_argument('--scales', type=float, nargs='+', default=[1.0, 0.75, 0.5, 0.35],
+                        help='inference scales to measure (default: 1.0 0.75 0.5 0.35)')
+    parser.add_argument('--model', type=str, default=SEED_MODEL_PATH,
+                        help='seed model file (default: ' + SEED_MODEL_PATH + ')')
+    parser.add_argument('--cutoff', type=float, default=0.3,
+                        help='confidence cutoff, as set by Box.init_seeds (default: 0.3)')
+    parser.add_argument('--iou', type=float, default=0.5,
+                        help='IoU needed for a detection to match a reference seed (default: 0.5)')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='timed runs per frame and scale, the fastest is reported (default: 3)')
+    args = parser.parse_args()
+
+    import src.myutilities.box as box
+    import src.retnet.model as model
+
+    frames = []
+    for path in args.boxes:
+        b = box.Box(path)
+        frame = np.array(b.images[0])
+        b.close()
+        height, width = frame.shape
+        startx = width // 2 - 1000
+        frames.append((path, frame, (startx, startx + 2000, 0, height)))
+
+    seed_model = model.SeedModel(args.model)
+    seed_model._confidence_cutoff = args.cutoff
+    scales = sorted(args.scales, reverse=True)
+    seed_model.inference_scale = scales[0]
+    seed_model.warm_up()
+
+    results = {scale: {"seconds": [], "recall": [], "seeds": []} for scale in scales}
+    reference = {}
+    for scale in scales:
+        seed_model.inference_scale = scale
+        for path, frame, region in frames:
+            timings = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                seeds, _ = seed_model.detect(image_arr=frame, region=region, sort=True)
+                timings.append(time.perf_counter() - start)
+            found = [(s.x1, s.x2, s.y1, s.y2) for s in seeds]
+            reference.setdefault(path, found)
+            results[scale]["seconds"].append(min(timings))
+            results[scale]["recall"].append(recall(reference[path], found, args.iou))
+            results[scale]["seeds"].append(len(found))
+
+    print(f"{'scale':>6} {'ms/frame':>10} {'seeds':>7} {'recall':>7}")
+    for scale in scales:
+        r = results[scale]
+        print(f"{scale:6.2f} {1000 * np.mean(r['seconds']):10.1f} {np.mean(r['seeds']):7.2f} {np.mean(r['recall']):7.3f}")
+
+if __name__ == "__main__":
+    main()
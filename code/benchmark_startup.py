@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Startup benchmark: how long importing the entry points takes, measured with python -X importtime.
+
+Each target is imported in a fresh interpreter. The script reports the wall time of the import, the
+cumulative import time python records for it, and the slowest modules, so heavy imports that creep
+back into startup (TensorFlow, plantcv, skimage, matplotlib) are easy to spot.
+
+    python3 code/benchmark_startup.py
+    python3 code/benchmark_startup.py --budget 1.0 --top 15
+
+With --budget the script exits with status 1 if any target takes longer than that many seconds.
+"""
+
+import os
+import sys
+import time
+import argparse
+import subprocess
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# name -> statement run in the fresh interpreter
+TARGETS = {
+    "track_env_setup": "from env_setup import track_env_setup",
+    "box": "import src.myutilities.box",
+    "unspool_core": "import unspool_core",
+}
+
+HEAVY_MODULES = ("tensorflow", "keras", "keras_retinanet", "plantcv", "skimage", "matplotlib")
+
+
+def parse_importtime(stderr):
+    """
+    :param stderr: stderr of python -X importtime
+    :return: list of (self microseconds, cumulative microseconds, nesting depth, module name). Depth 0 is a top level import
+    """
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3:
+            continue
+        # the module column is indented by one space, plus two per level of nesting
+        name = fields[2].rstrip()
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        rows.append((int(fields[0]), int(fields[1]), depth, name.strip()))
+    return rows
+
+
+def measure(statement):
+    """
+    Import in a fresh interpreter.
+
+    Returns
+    -------
+    tuple
+        (wall seconds, list of importtime rows, return code, stderr)
+    """
+    env = dict(os.environ)
+    paths = [REPO_ROOT, os.path.join(REPO_ROOT, "src"), os.path.join(REPO_ROOT, "code")]
+    env["PYTHONPATH"] = os.pathsep.join(paths + [env.get("PYTHONPATH", "")])
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", statement],
+                            capture_output=True, text=True, cwd=REPO_ROOT, env=env)
+    wall = time.perf_counter() - start
+    return wall, parse_importtime(result.stderr), result.returncode, result.stderr
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark import time of the tracking and unspooling entry points.')
+    parser.add_argument('--budget', type=float, default=None,
+                        help='Fail if any target takes longer than this many seconds to import')
+    parser.add_argument('--top', type=int, default=10,
+                        help='Number of slowest modules to list per target (default: 10)')
+    parser.add_argument('--targets', nargs='*', default=list(TARGETS),
+                        help='Targets to measure (default: all of ' + ', '.join(TARGETS) + ')')
+    args = parser.parse_args()
+
+    over_budget = []
+    for name in args.targets:
+        wall, rows, returncode, stderr = measure(TARGETS[name])
+        print(f"== {name}: {wall:.3f} s wall")
+        if returncode != 0:
+            print("   import failed:")
+            print("   " + stderr.strip().splitlines()[-1] if stderr.strip() else "   (no output)")
+            over_budget.append(name)
+            continue
+        # the cumulative time of a top level import already includes everything it imports
+        cumulative = sum(c for _, c, depth, _ in rows if depth == 0)
+        print(f"   cumulative import time: {cumulative / 1e6:.3f} s over {len(rows)} modules")
+        heavy = sorted({module.split(".")[0] for _, _, _, module in rows} & set(HEAVY_MODULES))
+        print(f"   heavy modules imported: {', '.join(heavy) if heavy else 'none'}")
+        for self_us, cumulative_us, _, module in sorted(rows, key=lambda r: r[0], reverse=True)[:args.top]:
+            print(f"   {self_us / 1e3:9.1f} ms self {cumulative_us / 1e3:9.1f} ms cumulative  {module}")
+        if args.budget is not None and wall > args.budget:
+            over_budget.append(name)
+
+    if over_budget:
+        print("Over budget or failed: " + ", ".join(over_budget))
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+Benchmark and accuracy suite for the tracking hot paths, on synthetic boxes with known root tips.
+
+A synthetic box (see src/myutilities/synthetic.py) is generated and run through each stage:
+
+    load_images   Box.__init__ on a directory of PNG frames, until every frame is decoded
+    load_stack    Box.__init__ on a raw frame stack
+    germination   germination.detect_germination_regions on all seeds, error in frames against the truth
+    tip_trace_*   Seed.tip_trace_pcv from the true germination point, per backend, error in pixels
+    parity        fraction of traced points on which the plantcv and opencv backends agree
+    render        Seed.make_video of every traced seed
+    denoise       Model.denoise over the whole stack
+
+For each stage it reports frames per second, peak memory growth (peak RSS during the stage over
+RSS at its start, see instrument.StageTimer) and, where there is a ground truth, the error. Results are compared with a
+stored baseline: a stage regresses when its frames per second drops by more than --tolerance, or when
+its error grows by more than --error_tolerance. The script exits with status 1 on any regression.
+
+    python3 code/benchmark_tracking.py --update-baseline     # record the baseline on this machine
+    python3 code/benchmark_tracking.py                       # compare against it
+    python3 code/benchmark_tracking.py --frames 600 --height 2000 --width 3000 --seeds 5
+
+Baselines hold timings, so they are only meaningful on the machine they were recorded on.
+"""
+
+import os
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+import numpy as np
+sys.path.append('/app/')
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+
+
+def tip_errors(seed, truth):
+    """:return: distances in pixels between the traced tips of seed and the true tips, frame by frame"""
+    traced = np.array(seed.tip_coords_pcv[1:], dtype=float)
+    # tip_coords_pcv[i] for i >= 1 is the tip in frame germination_frame + i - 1
+    expected = truth.tips[seed.germination_frame:seed.germination_frame + len(traced)]
+    return np.linalg.norm(traced - expected, axis=1)
+
+
+def make_seeds(b, synthetic_box):
+    """:return: a Seed per synthetic seed, germinated at its true germination frame and point"""
+    import src.myutilities.box as box
+    from src.myutilities.image import Image
+    seeds = []
+    for number, truth in enumerate(synthetic_box.seeds, 1):
+        image = Image(b.images[0])
+        image.set_crop(*truth.region)
+        seed = box.Seed(image, b._qr_number, number)
+        seed.germination_frame = truth.germination_frame
+        seed.germination_x, seed.germination_y = (int(round(v)) for v in truth.tips[truth.germination_frame])
+        seed.germination_indicator = True
+        seeds.append(seed)
+    return seeds
+
+
+def run_suite(args, workdir):
+    import src.myutilities.box as box
+    from src.myutilities import synthetic, germination
+    from src.myutilities.instrument import StageTimer
+    from src.retnet.model import Model
+
+    print(f"Generating {args.frames} frames of {args.height}x{args.width} with {args.seeds} seeds")
+    synthetic_box = synthetic.generate_box(frames=args.frames, height=args.height, width=args.width,
+                                           seeds=args.seeds, random_state=args.random_state)
+    synthetic.write_images(synthetic_box, os.path.join(workdir, "images"))
+    synthetic.write_stack(synthetic_box, os.path.join(workdir, "stack"))
+    timer = StageTimer()
+    results = {}
+
+    def finish(name, record, **extra):
+        results[name] = {"fps": record["frames"] / max(record["wall_s"], 1e-9),
+                         "peak_rss_delta_mb": record["peak_rss_delta_mb"], **extra}
+
+    with timer.stage("load_images", args.frames) as record:
+        b = box.Box(os.path.join(workdir, "images"), scratch_dir=workdir)
+        b.images.wait()
+    b.close()
+    finish("load_images", record)
+
+    with timer.stage("load_stack", args.frames) as record:
+        b = box.Box(os.path.join(workdir, "stack"))
+        frames = np.asarray(b.images[:])
+    finish("load_stack", record)
+
+    with timer.stage("germination", args.frames * args.seeds) as record:
+        estimates = germination.detect_germination_regions(b.images, [truth.region for truth in synthetic_box.seeds])
+    errors = [abs(e.frame - t.germination_frame) if e.frame is not None else args.frames
+              for e, t in zip(estimates, synthetic_box.seeds)]
+    finish("germination", record, error=float(np.mean(errors)), max_error=float(np.max(errors)))
+
+    traced = {}
+    backends = ["opencv"] + (["plantcv"] if args.plantcv else [])
+    for backend in backends:
+        seeds = make_seeds(b, synthetic_box)
+        with timer.stage(f"tip_trace_{backend}") as record:
+            for seed in seeds:
+                seed.tip_trace_pcv(b.images, tot_length=len(b.images), backend=backend)
+                record["frames"] += len(seed.tip_coords_pcv) - 1
+        errors = np.concatenate([tip_errors(seed, truth) for seed, truth in zip(seeds, synthetic_box.seeds)])
+        lost = sum(len(seed.tip_coords_pcv) - 1 < args.frames - truth.germination_frame for seed, truth in zip(seeds, synthetic_box.seeds))
+        finish(f"tip_trace_{backend}", record, error=float(errors.mean()), max_error=float(errors.max()), lost=int(lost))
+        traced[backend] = seeds
+
+    if len(traced) == 2:
+        agree = total = 0
+        for a, p in zip(traced["opencv"], traced["plantcv"]):
+            n = min(len(a.tip_coords_pcv), len(p.tip_coords_pcv))
+            agree += sum(a.tip_coords_pcv[i] == p.tip_coords_pcv[i] for i in range(n))
+            total += max(len(a.tip_coords_pcv), len(p.tip_coords_pcv))
+        results["parity"] = {"agreement": agree / max(total, 1)}
+
+    with timer.stage("render") as record:
+        for seed in traced["opencv"]:
+            seed.make_video(b.images, os.path.join(workdir, f"seed{seed.seed_number}.mp4"))
+            record["frames"] += len(seed.tip_coords_pcv)
+    finish("render", record)
+
+    stack = np.array(frames)
+    b.close()
+    with timer.stage("denoise", len(stack)) as record:
+        Model.denoise_stack(stack)
+    finish("denoise", record)
+    return results
+
+
+def compare(results, baseline, tolerance, error_tolerance):
+    """:return: list of regression messages"""
+    regressions = []
+    for stage, result in results.items():
+        reference = baseline.get(stage)
+        if reference is None:
+            continue
+        if "fps" in reference and result["fps"] < reference["fps"] * (1 - tolerance):
+            regressions.append(f"{stage}: {result['fps']:.1f} frames/s, baseline {reference['fps']:.1f}")
+        if "error" in reference and result["error"] > reference["error"] + error_tolerance:
+            regressions.append(f"{stage}: error {result['error']:.2f}, baseline {reference['error']:.2f}")
+        if "lost" in reference and result["lost"] > reference["lost"]:
+            regressions.append(f"{stage}: {result['lost']} seeds lost, baseline {reference['lost']}")
+        if "agreement" in reference and result["agreement"] < reference["agreement"]:
+            regressions.append(f"{stage}: agreement {result['agreement']:.3f}, baseline {reference['agreement']:.3f}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the tracking hot paths on synthetic boxes and check for regressions.')
+    parser.add_argument('--frames', type=int, default=300, help='frames per box (default: 300)')
+    parser.add_argument('--height', type=int, default=1000, help='frame height (default: 1000)')
+    parser.add_argument('--width', type=int, default=1500, help='frame width (default: 1500)')
+    parser.add_argument('--seeds', type=int, default=3, help='seeds per box (default: 3)')
+    parser.add_argument('--random_state', type=int, default=0, help='seed of the box generator (default: 0)')
+    parser.add_argument('--no-plantcv', dest='plantcv', action='store_false', help='skip the plantcv backend and the parity check')
+    parser.add_argument('--baseline', type=str, default=DEFAULT_BASELINE, help='baseline file (default: code/benchmark_baseline.json)')
+    parser.add_argument('--update-baseline', action='store_true', help='write the results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed relative drop in frames per second (default: 0.2)')
+    parser.add_argument('--error_tolerance', type=float, default=0.5, help='allowed growth of the error (default: 0.5)')
+    parser.add_argument('--workdir', type=str, default=None, help='directory for the generated data (default: a temporary directory)')
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="benchmark_tracking_")
+    try:
+        results = run_suite(args, workdir)
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"{'stage':<18} {'frames/s':>10} {'peak MB':>8} {'error':>8} {'max err':>8}")
+    for stage, r in results.items():
+        print(f"{stage:<18} {r.get('fps', float('nan')):10.1f} {r.get('peak_rss_delta_mb') if r.get('peak_rss_delta_mb') is not None else float('nan'):8.0f} "
+              f"{r.get('error', r.get('agreement', float('nan'))):8.2f} {r.get('max_error', float('nan')):8.2f}")
+
+    settings = {k: getattr(args, k) for k in ("frames", "height", "width", "seeds", "random_state")}
+    if args.update_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump({"settings": settings, "results": results}, f, indent=4)
+        print("Baseline written to " + args.baseline)
+        return
+    if not os.path.exists(args.baseline):
+        print("No baseline at " + args.baseline + ", run with --update-baseline to record one.")
+        return
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline["settings"] != settings:
+        print("Baseline was recorded with different settings " + json.dumps(baseline["settings"]) + ", not comparing.")
+        return
+    regressions = compare(results, baseline["results"], args.tolerance, args.error_tolerance)
+    for message in regressions:
+        print("REGRESSION " + message)
+    if regressions:
+        sys.exit(1)
+    print("No regressions against the baseline.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+"""
+One-time conversion of the per-seed tip coordinate CSV files into the columnar tip store.
+
+Every {qr_number}_{count}.csv in --csv_dir (with its _skipped.csv flags, if any) is appended to the store
+as one trajectory, see src/myutilities/results.py. The CSV files do not record the germination frame, so
+converted rows hold the point index in their frame column and carry the RELATIVE_FRAME flag. Converting
+the same file again replaces its trajectory rather than duplicating it.
+
+    python3 code/convert_tip_csvs.py --csv_dir /app/results/tip_coordinates --store /app/results/tip_store
+"""
+
+import sys
+import time
+import argparse
+sys.path.append('/app/')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert tip coordinate CSV files into the columnar tip store.')
+    parser.add_argument('--csv_dir', type=str, default='/app/results/tip_coordinates',
+                        help='directory of the {qr_number}_{count}.csv files (default: /app/results/tip_coordinates)')
+    parser.add_argument('--store', type=str, default='/app/results/tip_store',
+                        help='tip store directory, created if needed (default: /app/results/tip_store)')
+    parser.add_argument('--compact', action='store_true',
+                        help='drop replaced trajectories from the store after converting')
+    args = parser.parse_args()
+
+    from src.myutilities.results import TipStore, convert_csv_dir
+
+    start = time.time()
+    store = TipStore(args.store)
+    converted = convert_csv_dir(args.csv_dir, store)
+    if args.compact:
+        store.compact()
+    print(f"Converted {converted} trajectories into {args.store} in {time.time() - start:.1f} s "
+          f"({len(store.experiments())} experiments in the store).")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""
+Script for tracking many boxes without any interactive input.
+
+The seed regions, germination frames and germination points of every box come from a manifest, written
+by hand, from an earlier interactive session, or from Box.to_dict / Seed.to_dict. Each box is loaded,
+tip traced, rendered and exported to CSV in its own worker process, several boxes at a time, and a
+summary of per-stage timings and failures is written at the end.
+
+Manifest format (json):
+
+    {
+        "settings": {"tip_trace_length": 384, "tip_trace_threshold_multiplier": 1.5, ...},
+        "boxes": [
+            {
+                "path": "/app/data/1234",
+                "seeds": [
+                    {"x1": 100, "x2": 300, "y1": 200, "y2": 450, "seed_number": 1,
+                     "germination_frame": 812, "germination_x": 210, "germination_y": 400},
+                    ...
+                ]
+            },
+            ...
+        ]
+    }
+
+"settings" is optional and overrides the command line defaults for every box. A seed without
+"germination_frame" or a germination point, or marked "germination_indicator": false or
+"germination_not_found": true as Seed.to_dict writes it, is treated as not germinated, and a seed with "curling_start_frame" is cut at
+that frame when saved, as in Box.validate_save_tracking.
+"""
+
+import os
+import sys
+import json
+import time
+import resource
+import argparse
+import traceback
+import multiprocessing
+import multiprocessing.connection
+sys.path.append('/app/')
+
+SETTINGS = {
+    "tip_trace_length": 384,
+    "tip_trace_threshold_multiplier": 1.5,
+    "tip_trace_bound_radius": 30,
+    "tip_trace_backend": "opencv",
+    "single_pass": True,
+    "skip_threshold": None,
+    "frame_cache": "/app/results/.frame_cache",
+    "tip_store": "/app/results/tip_store"
+}
+
+
+def limit_memory(max_bytes):
+    """
+    Cap the memory a worker process may allocate.
+
+    RLIMIT_DATA is used rather than RLIMIT_AS because it counts heap and anonymous mappings but not the
+    file-backed memmaps of frame stacks, which can be far larger than RAM without costing any.
+    """
+    if max_bytes:
+        resource.setrlimit(resource.RLIMIT_DATA, (max_bytes, max_bytes))
+
+
+def track_box(entry, settings):
+    """
+    Load, tip trace, render and export one box from its manifest entry.
+
+    Returns
+    -------
+    dict
+        summary record of the box: qr number, per-stage seconds, seeds saved and the error if one occurred
+    """
+    # imported in the worker so the parent process stays light
+    import src.myutilities.box as box
+    from src.myutilities.image import Image
+    from src.myutilities.framecache import FrameCache
+    from src.myutilities.results import TipStore
+
+    record = {"path": entry["path"], "stages": {}, "seeds_saved": 0, "error": None}
+    b = None
+    try:
+        start = time.time()
+        cache = FrameCache(settings["frame_cache"]) if settings.get("frame_cache") else None
+        save_path = entry.get("save_path")
+        b = box.Box(entry["path"], save_path or "/app/data/", frame_cache=cache)
+        if save_path and os.path.basename(os.path.normpath(save_path)) == b._qr_number:
+            # save paths from Box.to_dict already end in the qr number, which __init__ appends again
+            b._save_path = os.path.normpath(save_path)
+        record["qr_number"] = b._qr_number
+        for count, seed_dct in enumerate(entry["seeds"], 1):
+            image = Image(b.images[0])
+            image.set_crop(seed_dct["x1"], seed_dct["x2"], seed_dct["y1"], seed_dct["y2"])
+            seed = box.Seed(image, b._qr_number, seed_dct.get("seed_number", count))
+            # Seed.to_dict writes seeds that did not germinate with germination_frame 0 and no germination point
+            germinated = seed_dct.get("germination_indicator", seed_dct.get("germination_frame") is not None)
+            seed.germination_not_found = bool(seed_dct.get("germination_not_found", False))
+            if germinated and not seed.germination_not_found and seed_dct.get("germination_x") is not None and seed_dct.get("germination_y") is not None:
+                seed.germination_frame = int(seed_dct["germination_frame"])
+                seed.germination_x = int(seed_dct["germination_x"])
+                seed.germination_y = int(seed_dct["germination_y"])
+                seed.germination_indicator = True
+            seed.curling_start_frame = seed_dct.get("curling_start_frame")
+            b.seeds.append(seed)
+        record["frames"] = len(b.images)
+        record["stages"]["load"] = time.time() - start
+
+        start = time.time()
+        b.tip_trace_pcv(length=settings["tip_trace_length"],
+                        threshold_multiplier=settings["tip_trace_threshold_multiplier"],
+                        bound_radius=settings["tip_trace_bound_radius"],
+                        backend=settings["tip_trace_backend"],
+                        single_pass=settings["single_pass"],
+                        skip_threshold=settings["skip_threshold"])
+        record["stages"]["tip_trace_and_render"] = time.time() - start
+
+        start = time.time()
+        store = TipStore(settings["tip_store"]) if settings.get("tip_store") else None
+        for count, seed in enumerate(b.seeds, 1):
+            if seed.germination_indicator and len(seed.tip_coords_pcv) > 1:
+                b.save_seed_tracking(seed, count, store=store)
+                record["seeds_saved"] += 1
+                record["frames_skipped"] = record.get("frames_skipped", 0) + seed.frames_skipped
+        record["stages"]["save"] = time.time() - start
+    except Exception as e:
+        record["error"] = f"{type(e).__name__}: {e}"
+        record["traceback"] = traceback.format_exc()
+    finally:
+        if b is not None:
+            b.close()
+    return record
+
+
+def run_box(entry, settings, max_bytes, connection):
+    """Worker process: track one box and send its record back through connection."""
+    limit_memory(max_bytes)
+    connection.send(track_box(entry, settings))
+    connection.close()
+
+
+def track_boxes(boxes, settings, workers, max_bytes, report):
+    """
+    Track boxes in worker processes, one process per box and at most workers at a time.
+
+    A worker that dies without sending its record, e.g. killed for running out of memory, only fails its
+    own box: its exit code is recorded as the error and the other boxes carry on.
+
+    Parameters
+    ----------
+    report : callable
+        called with each record as its box finishes
+
+    Returns
+    -------
+    list
+        the record of every box, in the order they finished
+    """
+    pending = list(boxes)
+    running = {}
+    received = {}
+    records = []
+    while pending or running:
+        while pending and len(running) < workers:
+            entry = pending.pop(0)
+            receiver, sender = multiprocessing.Pipe(duplex=False)
+            process = multiprocessing.Process(target=run_box, args=(entry, settings, max_bytes, sender))
+            process.start()
+            sender.close()
+            running[process] = (entry, receiver)
+        ready = multiprocessing.connection.wait([p.sentinel for p in running] + [r for _, r in running.values()])
+        for process, (entry, receiver) in list(running.items()):
+            # read the record as soon as it is sent, so a large one cannot block the worker from exiting
+            if process not in received and receiver.poll():
+                try:
+                    received[process] = receiver.recv()
+                except EOFError:
+                    received[process] = None
+            if process.sentinel not in ready:
+                continue
+            process.join()
+            receiver.close()
+            del running[process]
+            record = received.pop(process, None)
+            if record is None:
+                if process.exitcode < 0:
+                    error = f"worker killed by signal {-process.exitcode}, e.g. for running out of memory"
+                else:
+                    error = f"worker exited with code {process.exitcode}"
+                record = {"path": entry["path"], "stages": {}, "seeds_saved": 0, "error": error}
+            records.append(record)
+            report(record)
+    return records
+
+
+def report(record):
+    if record["error"]:
+        print(f"Failed: {record['path']} ({record['error']})")
+    else:
+        stages = ", ".join(f"{k} {v:.1f} s" for k, v in record["stages"].items())
+        print(f"Finished: {record['path']} ({record['seeds_saved']} seeds saved; {stages})")
+
+
+def read_manifest(path):
+    with open(path) as f:
+        manifest = json.load(f)
+    if isinstance(manifest, list):
+        manifest = {"boxes": manifest}
+    return manifest
+
+
+def main():
+    """
+    Main function to track every box of a manifest and write a summary.
+    """
+    parser = argparse.ArgumentParser(description='Track boxes from a manifest without interactive input.')
+    parser.add_argument('--manifest', type=str, required=True,
+                        help='json manifest of boxes, seed regions and germination points')
+    parser.add_argument('--summary', type=str, default=None,
+                        help='where to write the json summary (default: /app/results/batch_summary_<time>.json)')
+    parser.add_argument('--workers', type=int, default=2,
+                        help='Number of boxes tracked concurrently (default: 2)')
+    parser.add_argument('--max_memory_gb', type=float, default=None,
+                        help='Memory limit of each worker process in GB (default: no limit)')
+    parser.add_argument('--backend', type=str, default=None, choices=['plantcv', 'opencv'],
+                        help='Tip detection backend (default: opencv)')
+    args = parser.parse_args()
+
+    manifest = read_manifest(args.manifest)
+    settings = dict(SETTINGS)
+    settings.update(manifest.get("settings", {}))
+    if args.backend is not None:
+        settings["tip_trace_backend"] = args.backend
+    boxes = manifest["boxes"]
+    max_bytes = int(args.max_memory_gb * 1024 ** 3) if args.max_memory_gb else None
+    summary_path = args.summary or f"/app/results/batch_summary_{int(time.time())}.json"
+
+    print(f"Tracking {len(boxes)} boxes with {args.workers} workers.")
+    start = time.time()
+    records = track_boxes(boxes, settings, args.workers, max_bytes, report)
+
+    failures = [r for r in records if r["error"]]
+    summary = {
+        "manifest": os.path.abspath(args.manifest),
+        "settings": settings,
+        "workers": args.workers,
+        "max_memory_gb": args.max_memory_gb,
+        "seconds": time.time() - start,
+        "boxes": len(records),
+        "failures": len(failures),
+        "records": sorted(records, key=lambda r: r["path"])
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(summary_path)), exist_ok=True)
+    with open(summary_path, "w") as f:
+        json.dump(summary, f, indent=4)
+    print(f"Tracked {len(records) - len(failures)} of {len(records)} boxes in {summary['seconds']:.1f} s. Summary: {summary_path}")
+    if failures:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
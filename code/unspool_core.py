@@ -2,18 +2,108 @@
 """
 Script for unspooling videos into image sequences.
 Refactored from transfer_unspool_stabilize.ipynb.
+
+Videos are unspooled by a pool of concurrent ffmpeg jobs. Each job writes into a temporary directory
+next to its final output and renames it into place only once ffmpeg has finished and the output has
+been checked, so an interrupted run never leaves a half-written experiment behind. Finished videos are
+recorded in a manifest in the output directory, and a rerun skips everything the manifest lists.
 """
 
 import os
-import gc
 import sys
+import json
+import time
+import shutil
 import argparse
-from matplotlib import pyplot as plt
+import concurrent.futures
 sys.path.append('/app/')
 
 # Import local modules
 from src.myutilities.util import listdir_nohidden, unspool_video
-import src.retnet.model as model
+import src.myutilities.io as io
+
+MANIFEST_FILENAME = ".unspool_manifest.json"
+TMP_PREFIX = ".tmp_"
+
+
+def read_manifest(output_path):
+    """
+    Read the completion manifest of an output directory.
+
+    Returns
+    -------
+    dict
+        video name -> record of the finished job. Empty if there is no manifest yet.
+    """
+    try:
+        with open(os.path.join(output_path, MANIFEST_FILENAME)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_manifest(output_path, manifest):
+    """Atomically replace the completion manifest of an output directory."""
+    path = os.path.join(output_path, MANIFEST_FILENAME)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=4, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+
+def count_frames(unspool_path):
+    """
+    :param unspool_path: directory written by unspool_video
+    :return: number of frames in it, whether stored as PNGs or as a raw frame stack
+    """
+    if io.is_stack(unspool_path):
+        meta = io.read_stack_metadata(unspool_path)
+        expected = meta["count"] * meta["height"] * meta["width"]
+        if os.path.getsize(os.path.join(unspool_path, io.STACK_FILENAME)) != expected:
+            return 0
+        return meta["count"]
+    return len([f for f in listdir_nohidden(unspool_path) if f.endswith(".png")])
+
+
+def unspool_job(video_path, unspool_path, stack, threads):
+    """
+    Unspool one video into a temporary directory, verify it and move it into place.
+
+    Returns
+    -------
+    dict
+        manifest record of the job
+
+    Raises
+    ------
+    subprocess.CalledProcessError
+        if ffmpeg failed
+    IOError
+        if ffmpeg produced no frames
+    """
+    start = time.time()
+    tmp_path = os.path.join(os.path.dirname(unspool_path), TMP_PREFIX + os.path.basename(unspool_path))
+    if os.path.exists(tmp_path):
+        # left over from an interrupted run
+        shutil.rmtree(tmp_path)
+    stat = os.stat(video_path)
+    try:
+        unspool_video(video_path, tmp_path, remove=False, stack=stack, threads=threads)
+        frames = count_frames(tmp_path)
+        if frames == 0:
+            raise IOError("ffmpeg produced no frames for " + video_path)
+        os.rename(tmp_path, unspool_path)
+    except BaseException:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+    return {
+        "source": video_path,
+        "source_size": stat.st_size,
+        "source_mtime": stat.st_mtime,
+        "frames": frames,
+        "format": "stack" if stack else "png",
+        "seconds": round(time.time() - start, 3)
+    }
+
 
 def main():
     """
@@ -21,44 +111,83 @@ def main():
     """
     # Set up argument parser
     parser = argparse.ArgumentParser(description='Unspool videos into image sequences.')
-    parser.add_argument('--input_path', type=str, required=True, 
+    parser.add_argument('--input_path', type=str, required=True,
                         help='Directory containing input videos to process')
-    parser.add_argument('--output_path', type=str, required=True, 
+    parser.add_argument('--output_path', type=str, required=True,
                         help='Directory where processed image sequences will be saved')
+    parser.add_argument('--stack', action='store_true',
+                        help='Write each video as a single raw uint8 frame stack instead of one PNG per frame')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of videos unspooled concurrently (default: 1)')
+    parser.add_argument('--threads', type=int, default=None,
+                        help='Maximum number of threads for each ffmpeg job (default: ffmpeg decides)')
+    parser.add_argument('--keep', action='store_true',
+                        help='Keep the source videos instead of deleting them after a verified unspool')
     args = parser.parse_args()
-    
+
     # Get input and output paths from arguments
     input_path = args.input_path
     output_path = args.output_path
-    
+
     # Check if input directory exists
     if not os.path.exists(input_path):
         print(f"Error: Input directory '{input_path}' not found.")
         sys.exit(1)
-    
+
     # Create output directory if it doesn't exist
     if not os.path.exists(output_path):
         os.makedirs(output_path)
         print(f"Created output directory: {output_path}")
-    
+
     # Get list of videos to process
     video_list = listdir_nohidden(input_path)
-    
+
     print(f"Found {len(video_list)} videos to process.")
-    
+
+    manifest = read_manifest(output_path)
+    jobs = {}
     for video_file in video_list:
-        print(f"Processing: {video_file}")
         video_path = os.path.join(input_path, video_file)
-        
+
         # Create output directory based on video filename without extension
         video_name = os.path.splitext(video_file)[0]
         unspool_path = os.path.join(output_path, video_name)
-        
-        # Unspool the video into a sequence of images
-        # Remove the original video file after processing
-        unspool_video(video_path, unspool_path, remove=True)
-        
+
+        if video_name in manifest and os.path.isdir(unspool_path):
+            print(f"Skipping {video_file}: already unspooled.")
+            continue
+        if os.path.exists(unspool_path):
+            print(f"Skipping {video_file}: {unspool_path} exists but is not in the manifest. Remove it to unspool again.")
+            continue
+        jobs[video_name] = (video_path, unspool_path)
+
+    failures = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.workers) as executor:
+        futures = {}
+        for video_name, (video_path, unspool_path) in jobs.items():
+            print(f"Processing: {os.path.basename(video_path)}")
+            futures[executor.submit(unspool_job, video_path, unspool_path, args.stack, args.threads)] = video_name
+        for future in concurrent.futures.as_completed(futures):
+            video_name = futures[future]
+            video_path = jobs[video_name][0]
+            try:
+                record = future.result()
+            except Exception as e:
+                # any failure of one video, e.g. ffmpeg, probe parsing or the stack check, leaves the rest of the batch running
+                print(f"Failed: {os.path.basename(video_path)} ({type(e).__name__}: {e}). The video was kept.")
+                failures.append(video_name)
+                continue
+            manifest[video_name] = record
+            write_manifest(output_path, manifest)
+            # Remove the original video file only once its output has been verified
+            if not args.keep:
+                os.remove(video_path)
+            print(f"Finished: {os.path.basename(video_path)} ({record['frames']} frames in {record['seconds']} s)")
+
+    if failures:
+        print(f"Finished with {len(failures)} failed videos: {', '.join(failures)}")
+        sys.exit(1)
     print("Finished processing all videos.")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,15 +1,35 @@
 import sys
 import os
-from matplotlib import pyplot as plt
+import functools
 import src.myutilities.box as box
 import src.myutilities.util as util
 import src.retnet.model as model
+from src.myutilities.video import is_video
+from src.myutilities.framecache import FrameCache
+from src.retnet.cache import DetectionCache
+from src.myutilities.instrument import StageTimer
+from src.myutilities.results import TipStore
+from src.myutilities.checkpoint import Checkpoint, STAGES
+from src.myutilities import display
 import gc
-seed_model_obj = model.SeedModel("/app/models/SeedInference.h5")
 
-plt.rcParams['figure.figsize'] = [10, 10]
+# matplotlib and the seed model (TensorFlow) are only loaded once they are needed
+plt = util.LazyModule("matplotlib.pyplot")
+SEED_MODEL_PATH = "/app/models/SeedInference.h5"
+
 data_dir = '/app/data'
 results_dir = '/app/results'
+frame_cache = FrameCache(os.path.join(results_dir, ".frame_cache"))
+detection_cache = DetectionCache(os.path.join(results_dir, ".detection_cache"))
+tip_store = TipStore(os.path.join(results_dir, "tip_store"))
+
+@functools.lru_cache(maxsize=None)
+def get_seed_model(model_path=SEED_MODEL_PATH):
+    """
+    Return the seed detection model, creating it on the first call and reusing it afterwards.
+    The keras weights themselves are only loaded by the first detection.
+    """
+    return model.SeedModel(model_path)
 
 def seed_localization_and_tip_tracking(
     data_path,
@@ -18,7 +38,18 @@ def seed_localization_and_tip_tracking(
     tip_trace_threshold_multiplier=1.5,
     tip_trace_bound_radius=30,
     save_tip_sample=False,
-    automatic=False
+    automatic=False,
+    tip_trace_backend="plantcv",
+    single_pass=False,
+    skip_threshold=None,
+    use_detection_cache=True,
+    clear_detection_cache=False,
+    inference_scale=1.0,
+    germination_min_confidence=0.5,
+    timing_dir=os.path.join(results_dir, "timings"),
+    checkpoint_dir=os.path.join(results_dir, "checkpoints"),
+    resume=True,
+    display_pixels=1000000
 ):
     """
     Function to localize seeds and track root tips with specified parameters.
@@ -30,9 +61,27 @@ def seed_localization_and_tip_tracking(
     - tip_trace_threshold_multiplier (float): Threshold multiplier for tip tracing.
     - tip_trace_bound_radius (int): Bound radius for tip tracing.
     - save_tip_sample (bool): Whether to save tip samples.
-    - automatic (bool): Whether to run in automatic mode.
+    - automatic (bool): Whether to run in automatic mode. Germination frames are then found automatically, with a manual search only for low-confidence seeds.
+    - tip_trace_backend (str): "plantcv" or the faster "opencv" tip detector for tip tracing.
+    - single_pass (bool): Whether to trace all seeds of a box in one pass over the frames.
+    - skip_threshold (float): Mean absolute gray-level change below which a frame reuses the previous tip. None disables skipping.
+    - use_detection_cache (bool): Whether to reuse cached seed detections for frames seen before. False always runs the model.
+    - clear_detection_cache (bool): Whether to delete every cached seed detection before tracking.
+    - inference_scale (float): Scale of the image seed detection runs on, relative to the RetinaNet default resize. Smaller is faster. See code/benchmark_detection.py.
+    - germination_min_confidence (float): Confidence below which an automatic germination proposal is checked by a manual search.
+    - timing_dir (str): Directory of the per-box stage timing reports, <qr_number>.jsonl. None disables them.
+    - checkpoint_dir (str): Directory of the per-box checkpoints, <qr_number>.json, saved after every stage and every answered seed.
+    - resume (bool): Whether to resume a box from its checkpoint. False discards the checkpoint and tracks the box from the start.
+    - display_pixels (int): Pixel budget of the images shown at each interactive step. Larger frames are shown downscaled, with axes in full-resolution pixels.
     """
-    box_list = util.listdir_nohidden(data_path)
+    # an experiment is either a directory of images / a frame stack, or a video that is read without unspooling
+    plt.rcParams['figure.figsize'] = [10, 10]
+    if display.DEFAULT.max_pixels != display_pixels:
+        display.DEFAULT.max_pixels = display_pixels
+    if clear_detection_cache:
+        detection_cache.clear()
+    box_list = [f for f in util.listdir_nohidden(data_path)
+                if os.path.isdir(os.path.join(data_path, f)) or is_video(os.path.join(data_path, f))]
     print("The following experiments are available for tracking:")
     print(box_list)
 
@@ -45,18 +94,55 @@ def seed_localization_and_tip_tracking(
                 print("Invalid character")
         if track == "y":
             box_path = os.path.join(data_path, expt)
-            b = box.Box(box_path)
-            b.init_seeds(seed_model_obj, automatic=automatic)
-            b.germination_detection(
-                save_tip_sample=save_tip_sample,
-                threshold_multiplier=germination_threshold_multiplier,
-                automatic=automatic
-            )
-            b.tip_trace_pcv(
-                length=tip_trace_length,
-                threshold_multiplier=tip_trace_threshold_multiplier,
-                bound_radius=tip_trace_bound_radius
-            )
-            b.validate_save_tracking()
+            qr_number = os.path.splitext(expt)[0] if is_video(box_path) else expt
+            report_path = os.path.join(timing_dir, f"{qr_number}.jsonl") if timing_dir else None
+            timer = StageTimer(report_path, qr_number=qr_number)
+            checkpoint = Checkpoint(os.path.join(checkpoint_dir, f"{qr_number}.json"))
+            if not resume:
+                checkpoint.clear()
+            if checkpoint.done(STAGES[-1]):
+                print(f"Box {qr_number} was already tracked and validated. Pass resume=False to track it again.")
+                continue
+            state = checkpoint.load()
+            with timer.stage("box_load") as record:
+                if state is not None:
+                    print(f"Resuming box {qr_number} after stage: {checkpoint.last_stage or 'none'}")
+                    b = box.Box.from_dict(state["box"], frame_cache=frame_cache)
+                else:
+                    b = box.Box(box_path, frame_cache=frame_cache)
+                record["frames"] = len(b.images)
+            if not checkpoint.done("seed_localization"):
+                seed_model = get_seed_model()
+                seed_model.inference_scale = inference_scale
+                with timer.stage("seed_detection", 1):
+                    b.init_seeds(seed_model, automatic=automatic,
+                                 detection_cache=detection_cache if use_detection_cache else None)
+                checkpoint.save(b, "seed_localization")
+            if not checkpoint.done("germination"):
+                with timer.stage("germination", len(b.images) * len(b.seeds)):
+                    b.germination_detection(
+                        save_tip_sample=save_tip_sample,
+                        threshold_multiplier=germination_threshold_multiplier,
+                        automatic=automatic,
+                        min_confidence=germination_min_confidence,
+                        on_seed=lambda seed: checkpoint.save(b)
+                    )
+                checkpoint.save(b, "germination")
+            if not checkpoint.done("tip_trace"):
+                b.tip_trace_pcv(
+                    length=tip_trace_length,
+                    threshold_multiplier=tip_trace_threshold_multiplier,
+                    bound_radius=tip_trace_bound_radius,
+                    backend=tip_trace_backend,
+                    single_pass=single_pass,
+                    skip_threshold=skip_threshold,
+                    timer=timer
+                )
+                checkpoint.save(b, "tip_trace")
+            with timer.stage("validation"):
+                b.validate_save_tracking(timer=timer, store=tip_store, on_seed=lambda seed: checkpoint.save(b))
+            checkpoint.save(b, "validation")
+            print(timer.summary())
+            b.close()
             del b
             gc.collect()
\ No newline at end of file
@@ -1,15 +1,31 @@
 import concurrent.futures
 import time
+import json
 from src.myutilities import util
 import src.myutilities.io as io
 import numpy as np
 import src.retnet.model as retnet
 import cv2
-from plantcv import plantcv as pcv
 import csv
 import os
-from matplotlib import pyplot as plt
 from src.myutilities.image import Image
+from src.myutilities.framestore import FrameStore
+from src.myutilities.framecache import FrameCache
+from src.myutilities.video import VideoFrames, is_video
+from src.myutilities import tips
+from src.myutilities import germination
+from src.myutilities.framesearch import FrameSearch
+from src.myutilities import framemap
+from src.myutilities import instrument
+from src.myutilities import display
+from src.myutilities.instrument import StageTimer
+from src.myutilities import results
+from src.myutilities.results import TipStore
+from src.myutilities.render import TraceOverlay
+from src.retnet.cache import DetectionCache
+
+# key frame interval of the QC videos, so re-tracking part of a trace re-encodes at most this many unchanged frames
+QC_VIDEO_GOP = 30
 
 class Box:
     """The box class defines the data derived from a single magenta box in an experiment.
@@ -21,39 +37,53 @@ class Box:
     a holder) ro where the neural net fails to find one or more seeds, there is a grid based manual seed location method.
     """
     
-    #This is the list where the raw images will be stored in memory. This will be quite large, which is why the call to the garbage collector is necessary between analysis of each box.
+    #This is the frame stack of the experiment. It is a FrameStore backed by a memory-mapped file, so only the frames in use are held in RAM. Call close() when done with a box to delete the backing file.
     images = []
     
-    def __init__(self, path, save_path = "/app/data/"):
+    def __init__(self, path, save_path = "/app/data/", scratch_dir : str = None, frame_cache : FrameCache = None):
         """
         Attributes
         ----------
         
         _path : str
-            argument. a string containing the full path of the directory containing the raw images the box is going to load into memory
+            argument. a string containing the full path of the directory containing the raw images (or the raw frame stack written by unspool_video with stack=True), or the full path of the experiment video, that the box is going to load
         _save_path : str
             argument. the directory where post-tracking data is stored. Defaults to QUANTIFICATION_OUT_PATH in the constants.py module
+        scratch_dir : str
+            argument. directory for the memory-mapped frame stack. Defaults to the system temporary directory
+        frame_cache : FrameCache
+            argument. on-disk cache of decoded frame stacks. When given, an image directory that was opened before is memory-mapped from the cache instead of being decoded again
         _qr_number : str
             the experiment number of the box, parsed from the full path, and kept as a string
         my_list : list
-            list of paths to all image files associated with this experiment
-        images : list
-            list of images in memory
+            list of paths to all image files associated with this experiment, when the experiment is stored as images
+        images : FrameStore or VideoFrames
+            lazily loaded stack of grayscale images. For image directories frames 0 and -1 are ready on return and the rest load in the background. For videos frames are decoded on demand
         seeds : list
             list of seed objects within the box
         """
         self._path = path 
         self._qr_number = os.path.basename(os.path.normpath(self._path))
+        if is_video(self._path):
+            self._qr_number = os.path.splitext(self._qr_number)[0]
         self._save_path = os.path.normpath(save_path) + f"/{self._qr_number}"
-        my_list = util.listdir_nohidden(self._path)
-        my_list = [os.path.join(self._path, l) for l in my_list]
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            all_images = executor.map(io.read_image_single_channel, my_list)
-        self.images = [img for img in all_images] # numpy array of images, grayscale mode
+        if is_video(self._path):
+            # read frames straight out of the video through a keyframe index, no unspooling needed
+            self.images = VideoFrames(self._path)
+        elif io.is_stack(self._path):
+            # unspooled straight to a raw stack, nothing to decode
+            self.images = FrameStore.from_stack(self._path)
+        else:
+            my_list = util.listdir_nohidden(self._path)
+            my_list = [os.path.join(self._path, l) for l in my_list]
+            if frame_cache is not None:
+                self.images = frame_cache.open(my_list)
+            else:
+                self.images = FrameStore(my_list, scratch_dir=scratch_dir) # memory-mapped stack of images, grayscale mode
         self.seeds = [] # Seed objects
     
         
-    def init_seeds(self, seed_model: retnet.SeedModel, automatic : bool = True):
+    def init_seeds(self, seed_model: retnet.SeedModel, automatic : bool = True, detection_cache : DetectionCache = None):
         """
         This method optionally runs automatic seed detection. It can also manually define regions of seeds. It then creates the appropriate number of seed objects associated with the respective box objects.
         
@@ -63,22 +93,22 @@ class Box:
             This is the trained retinanet model for detecting seeds in image
         automatic : bool
             true: attempt automatic seed detection. false: use manual seed detection.
+        detection_cache : DetectionCache
+            optional on-disk cache of seed detections. Detecting on a frame seen before with the same model file reads the result from the cache instead of running the model
         """
         
         seed_model._confidence_cutoff = .3
         #only run if "automatic mode" of seed detection is desired.
         if automatic:
-            initial_image = np.copy(self.images[0])
+            initial_image = self.images[0]
             y,x =  initial_image.shape
             startx = x//2-(1000)
-            initial_image[:,0:startx] = 0
-            initial_image[:,(startx+2000):x] = 0
-            seeds_full, scores = seed_model.detect(image_arr=cv2.cvtColor(initial_image, cv2.COLOR_GRAY2BGR),
-                                          sort=True)
+            # seeds are only searched for in the central 2000 px band, which is cropped out rather than masked
+            seeds_full, scores = seed_model.detect(image_arr=initial_image, region=(startx, startx + 2000, 0, y),
+                                          sort=True, cache=detection_cache)
             
-            disp = cv2.cvtColor(self.images[0], cv2.COLOR_GRAY2BGR)
-            plt.imshow(disp)
-            plt.show()
+            # frame 0 is shown through a downscaled proxy, with axes in full-resolution pixels
+            first = display.show(self.images[0], key = (self._qr_number, 0))
             
             while True:
                 print(len(scores))
@@ -101,6 +131,7 @@ class Box:
                     if ((seed.x1 > (.1 * np.shape(self.images[0])[1])) and (seed.x1 < (.9 * np.shape(self.images[0])[1]))):
                         self.seeds.append(Seed(seed, self._qr_number, count + 1))
 
+            disp = cv2.cvtColor(first.image, cv2.COLOR_GRAY2BGR)
             for s in self.seeds:
                 s.final_x1 = s.final_x1 - 50
                 s.final_x2 = s.final_x2 + 50
@@ -110,10 +141,12 @@ class Box:
                 s.x2 = s.x2 + 50
                 s.y1 = s.y1 - 50
                 s.y2 = s.y2 + 100
-                cv2.rectangle(disp,(s.final_x1, s.final_y1),(s.final_x2,s.final_y2),(255,0,0),5)
+                # the rectangle is drawn on the proxy, at its scale
+                corner1 = tuple(int(round(v)) for v in first.to_proxy(s.final_x1, s.final_y1))
+                corner2 = tuple(int(round(v)) for v in first.to_proxy(s.final_x2, s.final_y2))
+                cv2.rectangle(disp, corner1, corner2, (255,0,0), max(int(round(5 * first.scale)), 1))
 
-            plt.imshow(disp)
-            plt.show()
+            display.show(display.Proxy(disp, first.full_shape))
         
         
             while True:
@@ -142,8 +175,8 @@ class Box:
             last = cv2.line(last, (0, r), (np.shape(last)[1], r), (0, 255, 0), thickness=5) 
         
         disp = np.concatenate((first, last), axis = 1)
-        plt.imshow(disp)
-        plt.show()
+        # the axes of the proxy are in full-resolution pixels, so coordinates can be typed as read off them
+        display.show(disp, key = (self._qr_number, "grid"))
         
         while True:
             num_seeds = input("How many seeds are in this box?")
@@ -184,8 +217,7 @@ class Box:
 
                 germ_region = disp[int(top_y):int(bottom_y), int(left_x):int(right_x)]
 
-                plt.imshow(germ_region)
-                plt.show()
+                display.show(germ_region)
                 
                 while True:
                     cont = input("Does this look good (y) or do you need to redo (r).")
@@ -200,31 +232,172 @@ class Box:
          
 
 
-    def germination_detection(self, save_tip_sample : bool = False,  threshold_multiplier : float = 1.5, save_path : str = None, automatic : bool = True):
+    def germination_detection(self, save_tip_sample : bool = False,  threshold_multiplier : float = 1.5, save_path : str = None, automatic : bool = True, min_confidence : float = 0.5, panels : int = 6, on_seed = None):
+        """
+        Find the germination frame and point of every seed, see Seed.germination_detection.
+
+        Seeds already searched (germination_searched, e.g. restored from a checkpoint) are skipped. on_seed,
+        if given, is called with each seed once it has been searched, e.g. to save a checkpoint. With
+        automatic, the proposals of all seeds come from one pass over the frames, see
+        germination.detect_germination_regions.
+        """
         count = 1
         if save_path is None:
             save_path = self._save_path
+        pending = [seed for seed in self.seeds if not seed.germination_searched]
+        estimates = {}
+        if automatic and pending:
+            regions = [(seed.x1, seed.x2, seed.y1, seed.y2) for seed in pending]
+            proposals = germination.detect_germination_regions(self.images, regions, threshold_multiplier = threshold_multiplier)
+            estimates = {id(seed): estimate for seed, estimate in zip(pending, proposals)}
         for seed in self.seeds:
-            seed.germination_detection(self.images, count, save_path, threshold_multiplier = threshold_multiplier, automatic = automatic)
+            if not seed.germination_searched:
+                seed.germination_detection(self.images, count, save_path, threshold_multiplier = threshold_multiplier, save_tip_sample = save_tip_sample, automatic = automatic, min_confidence = min_confidence, panels = panels, estimate = estimates.get(id(seed)))
+                seed.germination_searched = True
+                if on_seed is not None:
+                    on_seed(seed)
             count += 1
 
     #Call to seed tip trace
     #seed.tip_trace_pcv(b.images, length = 250)
-    def tip_trace_pcv(self, length : int = None, threshold_multiplier : float = 1.5, bound_radius : int = 30):
+    def tip_trace_pcv(self, length : int = None, threshold_multiplier : float = 1.5, bound_radius : int = 30, backend : str = "plantcv", single_pass : bool = False, workers : int = None, skip_threshold : float = None, encoder_options : dict = None, timer : StageTimer = None):
+        """
+        Track the root tips of all germinated seeds and render a QC video for each.
+
+        With single_pass the frames are streamed once for the whole box (see tip_trace_single_pass) instead
+        of once per seed, which matters when frames are read from disk or from a video. skip_threshold turns
+        on change-detection frame skipping, see Seed.tip_trace_pcv.
+
+        QC videos are rendered by background threads, each feeding its own ffmpeg process, so rendering a
+        seed overlaps with tracking the next one. The method returns once every video is written.
+        encoder_options are passed on to io.VideoEncoder.
+
+        With a timer, the "tip_trace" stage covers tracking (and the rendering that overlaps it) and the
+        "video_render" stage the wait for rendering to finish afterwards. The video_render record also
+        carries render_busy_s, the summed wall time of every render.
+        """
         count = 1
         os.makedirs("/app/results/stabilized_videos_single_seed", exist_ok=True)
-        for seed in self.seeds:
-            if seed.germination_indicator:
-                seed.tip_trace_pcv(self.images, length = length, tot_length = len(self.images), threshold_multiplier = threshold_multiplier, bound_radius = bound_radius)
-                seed.make_video(self.images,  "/app/results/stabilized_videos_single_seed" + f"/{self._qr_number}_{count}.mp4", trace_tip=True)
-            count = count + 1
+        renders = []
+        render_seconds = []
+        with concurrent.futures.ThreadPoolExecutor() as render_executor:
+            with instrument.maybe_stage(timer, "tip_trace") as record:
+                if single_pass:
+                    self.tip_trace_single_pass(length = length, threshold_multiplier = threshold_multiplier, bound_radius = bound_radius, backend = backend, workers = workers, skip_threshold = skip_threshold)
+                for seed in self.seeds:
+                    if seed.germination_indicator:
+                        if not single_pass:
+                            seed.tip_trace_pcv(self.images, length = length, tot_length = len(self.images), threshold_multiplier = threshold_multiplier, bound_radius = bound_radius, backend = backend, skip_threshold = skip_threshold)
+                        renders.append(render_executor.submit(self._timed_render, render_seconds, seed.make_video, self.images, self.qc_video_path(count), trace_tip=True, **self.qc_encoder_options(encoder_options)))
+                        record["frames"] = record.get("frames", 0) + len(seed.tip_coords_pcv)
+                    count = count + 1
+            with instrument.maybe_stage(timer, "video_render") as record:
+                for render in renders:
+                    # re-raise rendering errors here, as they would have been raised without background rendering
+                    render.result()
+                record["frames"] = sum(len(seed.tip_coords_pcv) for seed in self.seeds if seed.germination_indicator)
+                record["render_busy_s"] = sum(render_seconds)
             #seed.tip_trace(self.images, tip_model, length=length, save_path=self._save_path)
             # TODO remove break
             # break
 
+    def retrace_seed(self, seed_number : int, frame : int, tip : tuple = None, length : int = None, threshold_multiplier : float = 1.5, bound_radius : int = 30, backend : str = "plantcv", skip_threshold : float = None, encoder_options : dict = None):
+        """
+        Track one seed again from a frame on, keeping its trace before it, and update only the affected part of its QC video.
+
+        See Seed.retrace_from for the parameters and Seed.update_video for the video. encoder_options must be
+        those tip_trace_pcv was given. The seed's validation answer is cleared, so validate_save_tracking asks
+        for it again.
+
+        :param seed_number: 1-based number of the seed in the box, as in the QC video and CSV file names
+        :return: the seed
+        """
+        seed = self.seeds[seed_number - 1]
+        previous_coords = np.array(seed.tip_coords_pcv)
+        first_point = seed.retrace_from(self.images, frame, tip = tip, length = length, tot_length = len(self.images), threshold_multiplier = threshold_multiplier, bound_radius = bound_radius, backend = backend, skip_threshold = skip_threshold)
+        seed.update_video(self.images, self.qc_video_path(seed_number), first_point, previous_coords, **self.qc_encoder_options(encoder_options))
+        return seed
+
+    def qc_video_path(self, seed_number : int):
+        """:return: path of the QC video of a seed, by its 1-based number in the box"""
+        return "/app/results/stabilized_videos_single_seed" + f"/{self._qr_number}_{seed_number}.mp4"
+
+    @staticmethod
+    def qc_encoder_options(encoder_options : dict = None):
+        """:return: encoder_options with the key frame interval of the QC videos unless it is given"""
+        return {"gop": QC_VIDEO_GOP, **(encoder_options or {})}
+
+    @staticmethod
+    def _timed_render(seconds : list, render, *args, **kwargs):
+        start = time.time()
+        try:
+            return render(*args, **kwargs)
+        finally:
+            seconds.append(time.time() - start)
+
+
+    def tip_trace_single_pass(self, length : int = None, threshold_multiplier : float = 1.5, bound_radius : int = 30, backend : str = "plantcv", workers : int = None, skip_threshold : float = None):
+        """
+        Track the root tips of all germinated seeds in one pass over the frames.
+
+        The pass covers the union of the tracking windows of the seeds. At each frame the tips of every seed
+        whose window contains the frame are advanced together, with their crops processed concurrently in a
+        thread pool. A seed whose trace fails drops out of the pass, as its own tip_trace_pcv loop would stop.
+
+        Parameters
+        ----------
+        length : int
+            number of frames to track per seed, from its germination frame. Default is to the end of the data
+        threshold_multiplier : float
+            tip threshold relative to the median of each crop
+        bound_radius : int
+            half size of the crop around the tip
+        backend : str
+            "plantcv" or "opencv", see Seed.tip_trace_pcv
+        workers : int
+            number of threads. Default is the ThreadPoolExecutor default
+        skip_threshold : float
+            change-detection frame skipping threshold, see Seed.tip_trace_pcv. Default is no skipping
+        """
+        tracked = [seed for seed in self.seeds if seed.germination_indicator]
+        if not tracked:
+            return
+        windows = []
+        detectors = []
+        for seed in tracked:
+            n = seed.start_trace(length, len(self.images), bound_radius)
+            windows.append((seed.germination_frame, seed.germination_frame + n))
+            # one detector per seed, so no buffers are shared between threads
+            detectors.append(seed.make_detector(backend))
+        start = min(w[0] for w in windows)
+        stop = max(w[1] for w in windows)
+        active = [True] * len(tracked)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            for frame_number, image in enumerate(self.images[start:stop], start):
+                futures = {}
+                for i, seed in enumerate(tracked):
+                    if active[i] and windows[i][0] <= frame_number < windows[i][1]:
+                        futures[i] = executor.submit(seed.trace_step, image, threshold_multiplier, bound_radius, detectors[i], skip_threshold)
+                for i, future in futures.items():
+                    try:
+                        future.result()
+                    except Exception as e:
+                        print(e)
+                        active[i] = False
+                if not any(active[i] and frame_number + 1 < windows[i][1] for i in range(len(tracked))):
+                    break
+        if skip_threshold is not None:
+            for seed in tracked:
+                seed.print_skip_report()
 
     def set_images(self, images):
         self.images = images
+
+    def close(self):
+        """Release the frame stack of this box and delete its backing file."""
+        if isinstance(self.images, (FrameStore, VideoFrames)):
+            self.images.close()
         
     def print_images(self):
         print(self.images)
@@ -243,23 +416,7 @@ class Box:
             # break
 
     def to_json(self):
-        # for x in range(len(self.images)):
-        #     self.images[x] = self.images[x].tolist()
-        #
-        #
-        # print(type(self.images[0]))
-        return json.dumps(self, default = self._serialize_json,
-                          sort_keys=True, indent=4)
-
-        pass
-
-    
-    # helper method
-    def _serialize_json(self):
-        return {
-            'path': self._path,
-            'qr_number': self._qr_number
-        }
+        return json.dumps(self.to_dict(), sort_keys=True, indent=4)
 
     # note can get rid of the qr_number since that is derived from path
     def to_dict(self):
@@ -275,8 +432,10 @@ class Box:
 
 
     @classmethod
-    def from_dict(cls, dct: dict):
-        box = cls(dct.get("path"), dct.get("save_path"))
+    def from_dict(cls, dct: dict, frame_cache : FrameCache = None):
+        # save_path is stored with the qr number appended, as __init__ builds it
+        save_path = dct.get("save_path")
+        box = cls(dct.get("path"), os.path.dirname(os.path.normpath(save_path)) if save_path else "/app/data/", frame_cache=frame_cache)
         # need to save seed_coordinates to avoid running init_seeds
         # running init_seeds would require passing seed_model
         seeds = dct.get("seeds")
@@ -292,22 +451,44 @@ class Box:
     #     if isinstance(obj, np.ndarray):
     #         return obj.tolist()
     #     return json.JSONEncoder.default(self, obj)
-    def denoise_all(self):
-        # 132 vs 30 seconds
+    def denoise_all(self, workers : int = None, chunk : int = 64, scratch_dir : str = None):
+        """
+        Replace the frame stack with a denoised copy, see retnet.Model.denoise.
+
+        Frames are processed by framemap.map_frames, which hands workers index ranges of shared memory-mapped
+        stacks instead of pickling frames. The previous stack is closed. The denoised stack is written next to
+        the current one unless scratch_dir is given ("shm" for /dev/shm, see framemap.map_frames).
+        """
         start = time.time()
-        with concurrent.futures.ProcessPoolExecutor() as executor:
-            images = executor.map(retnet.TipModel.denoise, self.images)
-        self.images = [shift for shift in images]
+        denoised = framemap.map_frames(retnet.Model.denoise, self.images, workers = workers, chunk = chunk, scratch_dir = scratch_dir)
+        self.images.close()
+        self.images = denoised
         print("time", time.time() - start)
 
         
-    def validate_save_tracking(self):
+    def validate_save_tracking(self, panels : int = 6, timer : StageTimer = None, store : TipStore = None, on_seed = None):
+        """
+        Show each traced seed for approval, optionally search for the frame its root starts curling, and save the approved traces.
+
+        panels is the number of frames shown per round of the curl search, see framesearch.FrameSearch.
+        With a timer, each save is recorded as a "csv_save" stage. With a store, approved traces are also
+        appended to it, see save_seed_tracking.
+
+        The answer for each seed is kept in Seed.validation ("saved" or "rejected") and seeds that already
+        have one, e.g. restored from a checkpoint, are skipped. on_seed, if given, is called with each seed
+        once it has been answered and saved.
+        """
         count = 0
         for s in self.seeds:
             count = count + 1
-            if(s.germination_indicator and not s.germination_not_found):
-                plt.imshow(s.final_trace_img)
-                plt.show()
+            if(s.germination_indicator and not s.germination_not_found and s.validation is None):
+                if s.final_trace_img is None:
+                    s.render_final_trace_img(self.images)
+                if s.final_trace_img is None:
+                    # e.g. resumed right after germination, or the tip was lost in the first frame
+                    print(f"Seed {count} has no tip trace to show.")
+                else:
+                    display.show(s.final_trace_img)
                 while True:
                     save1 = input("Does this look good enough to save? (y) or (n). If the root curled, press (c) to identify curl frame.")
                     save2 = input("Confirm: Does this look good enough to save? (y) or (n), or (c) to identify curl frame")
@@ -317,58 +498,75 @@ class Box:
                         print("Invalid response.")
                 if save1 == "y":
                     print("Saving coordinates.")
-                    os.makedirs("/app/results/tip_coordinates/", exist_ok=True)
-                    with open("/app/results/tip_coordinates/" + f"/{self._qr_number}_{count}" + ".csv", 'w') as myfile:
-                        wr = csv.writer(myfile, quoting=csv.QUOTE_ALL)
-                        wr.writerow(s.tip_coords_pcv)
-                        #do some other saving stuff
+                    with instrument.maybe_stage(timer, "csv_save", len(s.tip_coords_pcv)):
+                        self.save_seed_tracking(s, count, store = store)
+                    s.validation = "saved"
+                elif save1 == "n":
+                    s.validation = "rejected"
                 elif save1 =="c":
-                    first = 0
-                    last = len(self.images) - 1
-                    x_tip_coords = s.tip_coords_pcv[0:,0]
-                    y_tip_coords = s.tip_coords_pcv[0:,1]
-                    x1 = min(x_tip_coords) - 50
-                    x2 = max(x_tip_coords) + 50
-                    y1 = min(y_tip_coords) - 50
-                    y2 = max(y_tip_coords) + 50
-                    while True:
-                        mid = int((first + last)/2)
-                        # calculate crop boundaries for tip video
-
-                        plt.imshow(self.images[mid][y1:y2, x1:x2])
-                        plt.show()
-                        while True:
-                            direction = input("Does curling start (b)efore, (a)fter, (h)ere, do you need to (r)estart, or does it actually not curl (x)?")
-                            if direction == "b" or direction == "a" or direction == "h" or direction == "r" or direction == "x":
-                                break
-                            else:
-                                print("Invalid character")
-                        if direction == "h":
-                            direction = input("To confirm this as  curling frame, hit (h) again, or any other key to continue searching.")
-                            if direction == "h":
-                                s.curling_start_frame = mid
-                                break
-                        elif direction == "x":
-                            direction = input("To confirm root did not curl, hit (x) again, or any other key to continue searching.")
-                            if direction == "x":
-                                break
-                        elif direction == "r":
-                            first = 0
-                            last = len(self.images) - 1
-                        elif direction == "a":
-                            first = mid
-                        elif direction == "b":
-                            last = mid
-                            
+                    coords = np.asarray(s.tip_coords_pcv).reshape(-1, 2)
+                    if len(coords):
+                        x_tip_coords = coords[0:,0]
+                        y_tip_coords = coords[0:,1]
+                        # crop boundaries of the tip video
+                        x1 = min(x_tip_coords) - 50
+                        x2 = max(x_tip_coords) + 50
+                        y1 = min(y_tip_coords) - 50
+                        y2 = max(y_tip_coords) + 50
+                    else:
+                        x1, x2, y1, y2 = s.final_x1, s.final_x2, s.final_y1, s.final_y2
+                    curl = FrameSearch(self.images, (x1, x2, y1, y2), panels = panels).run("curling")
+                    if curl is not None:
+                        s.curling_start_frame = curl
                     print("Saving coordinates.")
-                    coords = s.tip_coords_pcv[:(s.curling_start_frame - s._tracking_start_frame)]
-                    coords[-1,0] = 100000
-                    coords[-1,1] = 100000
-                    with open("/app/results/tip_coordinates/" + f"/{self._qr_number}_{count}" + ".csv", 'w') as myfile:
-                        wr = csv.writer(myfile, quoting=csv.QUOTE_ALL)
-                        wr.writerow(coords)
-                        #do some other saving stuff
-                    
+                    with instrument.maybe_stage(timer, "csv_save", len(s.tip_coords_pcv)):
+                        self.save_seed_tracking(s, count, store = store)
+                    s.validation = "saved"
+                if on_seed is not None:
+                    on_seed(s)
+
+    def save_seed_tracking(self, seed, count : int, out_dir : str = "/app/results/tip_coordinates/", store : TipStore = None):
+        """
+        Write the tip coordinates of one seed to {out_dir}/{qr_number}_{count}.csv.
+
+        If a curling frame was identified for the seed, the trace is cut at that frame and its last point
+        is replaced by the curl sentinel (100000, 100000). If change-detection skipping reused tips, their
+        flags are written to {out_dir}/{qr_number}_{count}_skipped.csv.
+
+        With a store, the trace is also appended to it as per-frame records with curl, lost and skipped
+        flags, see results.TipStore.append_seed.
+
+        Parameters
+        ----------
+        seed : Seed
+            tracked seed
+        count : int
+            1-based position of the seed in the box, used in the file name
+        out_dir : str
+            directory of the coordinate files
+        store : TipStore
+            optional columnar store the trace is appended to as well
+        """
+        coords = np.array(seed.tip_coords_pcv)
+        if seed.curling_start_frame is not None:
+            coords = coords[:max(seed.curling_start_frame - seed._tracking_start_frame, 0)]
+            if len(coords):
+                coords[-1,0] = results.CURL_SENTINEL
+                coords[-1,1] = results.CURL_SENTINEL
+            else:
+                print(f"Warning: seed {count} curls at or before its germination frame, no tip coordinates to save")
+        os.makedirs(out_dir, exist_ok=True)
+        with open(out_dir + f"/{self._qr_number}_{count}" + ".csv", 'w') as myfile:
+            wr = csv.writer(myfile, quoting=csv.QUOTE_ALL)
+            wr.writerow(coords)
+            #do some other saving stuff
+        if seed.frames_skipped:
+            # which points change-detection skipping reused the previous tip for, one flag per point
+            with open(out_dir + f"/{self._qr_number}_{count}" + "_skipped.csv", 'w') as myfile:
+                wr = csv.writer(myfile, quoting=csv.QUOTE_ALL)
+                wr.writerow([int(flag) for flag in seed.tip_skipped[:len(coords)]])
+        if store is not None:
+            store.append_seed(seed, count)
 
 class Seed(Image):
 
@@ -381,6 +579,11 @@ class Seed(Image):
         self.germination_x = None
         self.germination_y = None
         self.tip_coords_pcv = []
+        self.tip_skipped = [] # per point of tip_coords_pcv, whether change-detection skipping reused the previous tip
+        self.trace_length = None # number of frames the last trace was asked to cover
+        self.germination_searched = False # whether the germination search has run, so a resumed session does not ask again
+        self.validation = None # answer of validate_save_tracking: "saved", "rejected" or None before it is asked
+        self.frames_skipped = 0
         self.tip_coords = []
         self.qr_number = qr_number
         self.seed_number = seed_number
@@ -406,60 +609,27 @@ class Seed(Image):
         else:
             raise ValueError("Set germination frame to int above 0")
 
-    def germination_detection(self, images, seed_number,  save_path : str, threshold_multiplier : float = 1.5, save_tip_sample: bool = False, automatic : bool = True):
-        if automatic:
-            pass
-            # NEED TO DEVELOP THIS. WAS NOT RELIABLE, AND WON'T RUN AS CURRENTLY WRITTEN.
-            # self._tracking_start_frame, self.germination_x, self.germination_y = \
-            #     myutilities.tip_tracer.germination_detection_init(self, images, c.TMP_SHOWCASE_PATH, seed_number)
-            # if save_tip_sample:
-            #     tip_corners = self.get_transform_crop_coords(self.germination_x - 30, self.germination_x + 30,
-            #                                                 self.germination_y - 30, self.germination_y + 30)
-            #     image = images[self._tracking_start_frame]
-            #     cv2.rectangle(image, (tip_corners.x1, tip_corners.y1), (tip_corners.x2, tip_corners.y2),
-            #                   c.COLOR_WHITE, c.MARKER_THICKNESS, cv2.LINE_AA)
-
-            #     io.save_image(io.to_pil(image), save_path + f"/germination_seed{seed_number}.png")
-        else:
+    def germination_detection(self, images, seed_number,  save_path : str, threshold_multiplier : float = 1.5, save_tip_sample: bool = False, automatic : bool = True, min_confidence : float = 0.5, panels : int = 6, estimate : germination.GerminationEstimate = None):
+        """
+        Find the germination frame and germination point of the seed.
+
+        With automatic, germination.detect_germination proposes both from the foreground area of the seed
+        crop over the whole stack. The proposal is accepted when its confidence is at least min_confidence,
+        and otherwise the manual search runs as it does without automatic. The manual search shows panels
+        frames per round, see framesearch.FrameSearch. estimate is a proposal computed already, e.g. for the
+        whole box by Box.germination_detection.
+        """
+        accepted = automatic and self.germination_detection_automatic(images, seed_number, save_path, threshold_multiplier = threshold_multiplier, save_tip_sample = save_tip_sample, min_confidence = min_confidence, estimate = estimate)
+        if not accepted:
             print("Finding germination frame for seed " + str(seed_number))
-            first = 0
-            last = len(images) - 1
-            while True:
-                mid = int((first + last)/2)
-                plt.imshow(images[mid][self.y1:self.y2, self.x1:self.x2])
-                plt.show()
-                while True:
-                    direction = input("Is germination (b)efore, (a)fter, (h)ere, do you need to (r)estart, or does it not germinate (x)?")
-                    if direction == "b" or direction == "a" or direction == "h" or direction == "r" or direction == "x":
-                        break
-                    else:
-                        print("Invalid character")
-                if direction == "h":
-                    direction = input("To confirm this as germination frame, hit (h) again, or any other key to continue searching.")
-                    if direction == "h":
-                        self.germination_indicator = True
-                        self._tracking_start_frame = mid
-                        break
-                elif direction == "x":
-                    direction = input("To confirm seed did not germinate, hit (x) again, or any other key to continue searching.")
-                    if direction == "x":
-                        break
-                elif direction == "r":
-                    first = 0
-                    last = len(images) - 1
-                elif direction == "a":
-                    first = mid
-                elif direction == "b":
-                    last = mid
+            frame = FrameSearch(images, (self.x1, self.x2, self.y1, self.y2), panels = panels).run("germination")
+            if frame is not None:
+                self.germination_indicator = True
+                self._tracking_start_frame = frame
                 
             if self.germination_indicator:                    
                 proposed = np.copy(images[self._tracking_start_frame][self.y1:self.y2, self.x1:self.x2])
-                threshold_light = pcv.threshold.binary(gray_img=proposed, threshold=np.median(images[mid])*threshold_multiplier , max_value=255, object_type='light')
-                binary_img = pcv.median_blur(gray_img=threshold_light, ksize=5)
-                fill_image = pcv.fill(bin_img=binary_img, size=10)
-                skeleton = pcv.morphology.skeletonize(mask=fill_image)
-                tips_img = pcv.morphology.find_tips(skel_img=skeleton, mask=fill_image)
-                locs = np.argwhere(tips_img > 0)
+                locs = tips.find_tips_plantcv(proposed, np.median(images[self._tracking_start_frame])*threshold_multiplier)
                              
                 
                 i = len(locs) - 1
@@ -471,8 +641,7 @@ class Seed(Image):
                     copy[(locs[i][0]-5):(locs[i][0]+6), (locs[i][1]+5)] = 255  # Right vertical line
                     copy[(locs[i][0]-5), (locs[i][1]-5):(locs[i][1]+6)] = 255  # Top horizontal line
                     copy[(locs[i][0]+5), (locs[i][1]-5):(locs[i][1]+6)] = 255  # Bottom horizontal line
-                    plt.imshow(copy)
-                    plt.show()
+                    display.show(copy)
                     while True:
                         response = input("Is this the germination point? (y) or (n)")
                         if response == "y" or response == "n":
@@ -502,17 +671,158 @@ class Seed(Image):
                 
                               
                           
-    def tip_trace_pcv(self, images_param, length : int = None, tot_length : int = None, threshold_multiplier : float = 1.5, bound_radius : int = 30):
+    def germination_detection_automatic(self, images, seed_number, save_path : str, threshold_multiplier : float = 1.5, save_tip_sample : bool = False, min_confidence : float = 0.5, estimate : germination.GerminationEstimate = None):
+        """
+        Accept the automatic germination proposal if its confidence is at least min_confidence.
+
+        The proposal is estimate, or computed for this seed alone if it is None.
+
+        Returns
+        -------
+        bool
+            True if the germination frame and point were set, False if the manual search is needed
+        """
+        if estimate is None:
+            estimate = germination.detect_germination(images, (self.x1, self.x2, self.y1, self.y2), threshold_multiplier = threshold_multiplier)
+        if estimate.frame is None:
+            print(f"Seed {seed_number}: no germination found automatically, switching to manual search")
+            return False
+        if len(estimate.candidates) == 0:
+            # only reachable with min_confidence <= 0, as a proposal without a tip candidate has no confidence
+            print(f"Seed {seed_number}: proposed germination at frame {estimate.frame} has no tip candidate, switching to manual search")
+            return False
+        if estimate.confidence < min_confidence:
+            print(f"Seed {seed_number}: proposed germination at frame {estimate.frame} with low confidence {estimate.confidence:.2f}, switching to manual search")
+            return False
+        print(f"Seed {seed_number}: germination at frame {estimate.frame} (confidence {estimate.confidence:.2f})")
+        self.germination_indicator = True
+        self._tracking_start_frame = estimate.frame
+        self.germination_x = int(estimate.candidates[0][1]) + self.x1
+        self.germination_y = int(estimate.candidates[0][0]) + self.y1
+        if save_tip_sample:
+            image = np.array(images[self._tracking_start_frame])
+            cv2.rectangle(image, (self.germination_x - 30, self.germination_y - 30), (self.germination_x + 30, self.germination_y + 30),
+                          255, 2, cv2.LINE_AA)
+            os.makedirs(save_path, exist_ok=True)
+            io.save_image(io.to_pil(image), save_path + f"/germination_seed{seed_number}.png")
+        return True
+
+    def tip_trace_pcv(self, images_param, length : int = None, tot_length : int = None, threshold_multiplier : float = 1.5, bound_radius : int = 30, backend : str = "plantcv", skip_threshold : float = None):
         """
         Method to start tracking the root tip from the identified point of germination saved in each seed object.
+
+        backend selects how tips are found in each crop: "plantcv" runs the plantcv function chain, "opencv"
+        runs tips.TipDetector, which has the same semantics on preallocated buffers and is much faster.
+
+        skip_threshold turns on change-detection frame skipping: a crop whose mean absolute difference from
+        the last processed crop is below skip_threshold gray levels keeps the previous tip position without
+        running the tip detection. Skipped frames are flagged in tip_skipped and counted in frames_skipped.
         """
+        detector = self.make_detector(backend)
         
        
         # preprocess is a tuple of parameters in a specific order ex. ("blur", "canny", "resize")
         # images = images_param.copy() # IMPORTANT BUG FIX, pass by reference, aka lists are mutable
         images = images_param
-        if length > tot_length - self.germination_frame:
-            print("Requested length is longer than there is data for this seed. Will track as many frames as possible.")
+        length = self.start_trace(length, tot_length, bound_radius)
+        self.trace_frames(images[self._tracking_start_frame:(self._tracking_start_frame + length)], threshold_multiplier, bound_radius, detector, skip_threshold)
+
+    def trace_frames(self, frames, threshold_multiplier : float = 1.5, bound_radius : int = 30, detector : tips.TipDetector = None, skip_threshold : float = None):
+        """Advance the tip trace over consecutive frames, until they run out or the tip is lost."""
+        try:
+            for image in frames:
+                self.trace_step(image, threshold_multiplier, bound_radius, detector, skip_threshold)
+        except Exception as e: print(e)
+        if skip_threshold is not None:
+            self.print_skip_report()
+
+    def retrace_from(self, images, frame : int, tip : tuple = None, length : int = None, tot_length : int = None, threshold_multiplier : float = 1.5, bound_radius : int = 30, backend : str = "plantcv", skip_threshold : float = None):
+        """
+        Track the tip again from a frame on, keeping the trace before it.
+
+        Use it when a trace drifts onto a lateral root or debris partway through. The points of the frames
+        before frame are kept and tracking restarts from the last of them, or from tip if it is given, with
+        the given parameters. The tracking window is placed from the kept trace alone, so the state a previous
+        trace left behind does not matter. A curling frame at or after frame and the validation answer are
+        cleared, as they were given for the old trace.
+
+        Parameters
+        ----------
+        images :
+            the frames of the box
+        frame : int
+            first frame to track again. Can be the frame after the last traced one, to continue a lost trace
+        tip : tuple
+            corrected (x, y) tip position in frame, in full-frame coordinates. Tracking then continues from the
+            next frame. Default is to track frame from the previous tip
+        length : int
+            number of frames to track from frame. Default ends the trace where the previous one was asked to
+            end, or at the last frame
+        tot_length : int
+            number of frames in images. Default is len(images)
+        threshold_multiplier, bound_radius, backend, skip_threshold :
+            see tip_trace_pcv
+
+        Returns
+        -------
+        int
+            index in tip_coords_pcv of the first point that changed, see update_video
+        """
+        detector = self.make_detector(backend)
+        point = frame - self._tracking_start_frame + 1
+        if point < 1 or point > len(self.tip_coords_pcv):
+            raise ValueError(f"Frame {frame} is not between the germination frame and the frame after the last traced one")
+        if tot_length is None:
+            tot_length = len(images)
+        if length is not None:
+            end = min(frame + length, tot_length)
+        elif self.trace_length is not None:
+            end = min(self._tracking_start_frame + self.trace_length, tot_length)
+        else:
+            end = tot_length
+
+        self.tip_coords_pcv = [[int(v) for v in p] for p in self.tip_coords_pcv[:point]]
+        self.tip_skipped = (list(self.tip_skipped) + [False] * point)[:point]
+        start = frame
+        if tip is not None:
+            self.tip_coords_pcv.append([int(tip[0]), int(tip[1])])
+            self.tip_skipped.append(False)
+            start = frame + 1
+        self.frames_skipped = sum(self.tip_skipped)
+        self.trace_length = end - self._tracking_start_frame
+        self.center_window(*self.tip_coords_pcv[-1], bound_radius)
+        self.trace_frames(images[start:end], threshold_multiplier, bound_radius, detector, skip_threshold)
+
+        if self.curling_start_frame is not None and self.curling_start_frame >= frame:
+            self.curling_start_frame = None
+        self.validation = None
+        self.final_trace_img = None
+        return point
+
+    def print_skip_report(self):
+        """Print how many traced frames change-detection skipping reused the previous tip for."""
+        traced = len(self.tip_coords_pcv) - 1
+        print(f"Seed {self.seed_number}: skipped {self.frames_skipped} of {traced} frames ({100 * self.frames_skipped / max(traced, 1):.1f}%)")
+
+    @staticmethod
+    def make_detector(backend : str = "plantcv"):
+        """Validate a tip tracing backend name and return the TipDetector it needs, or None for plantcv."""
+        if backend not in tips.BACKENDS:
+            raise ValueError("backend must be one of " + ", ".join(tips.BACKENDS))
+        return tips.TipDetector() if backend == "opencv" else None
+
+    def start_trace(self, length : int = None, tot_length : int = None, bound_radius : int = 30):
+        """
+        Reset the tip trace to the germination point before tracking.
+
+        Returns
+        -------
+        int
+            number of frames to track, starting at the germination frame
+        """
+        if length is None or length > tot_length - self.germination_frame:
+            if length is not None:
+                print("Requested length is longer than there is data for this seed. Will track as many frames as possible.")
             length = tot_length - self.germination_frame
             
         #coords = self.get_transform_crop_coords(x1=self.germination_x, y1=self.germination_y)
@@ -520,134 +830,145 @@ class Seed(Image):
 #         self.transform_crop_coords(-bound_radius, +bound_radius,-bound_radius, +bound_radius)
 #         self.germination_x = int((coords.x1 + coords.x2)/2)
 #         self.germination_y = int((coords.y1 + coords.y2)/2)
-        self.x1 = self.germination_x - bound_radius
-        self.x2 = self.germination_x + bound_radius
-        self.y1 = self.germination_y - bound_radius
-        self.y2 = self.germination_y + bound_radius
+        self.center_window(self.germination_x, self.germination_y, bound_radius)
         
-        tip_coords = []
-        tip_coords.append([self.germination_x, self.germination_y])
-        last_x = bound_radius
-        last_y = bound_radius
-        try:
-            count = 0
-            for image in images[self._tracking_start_frame:(self._tracking_start_frame + length)]:
-                image = image[self.y1:self.y2, self.x1:self.x2]
-
-                threshold_light = pcv.threshold.binary(gray_img=image, threshold=np.median(image)*threshold_multiplier, max_value=255, object_type='light') #try mean?
-                binary_img = pcv.median_blur(gray_img=threshold_light, ksize=5)
-                fill_image = pcv.fill(bin_img=binary_img, size=10)
-                skeleton = pcv.morphology.skeletonize(mask=fill_image)
-                tips_img = pcv.morphology.find_tips(skel_img=skeleton, mask=fill_image)
-                #tips_img = tips_img[20:-20, 20:-20]
-                locs = np.argwhere(tips_img > 0)
-                
-                #Here we take the index of the identified end-points and use np.linalg.norm to find the identified endpoint closest to the last identified tip.
-                #This solves a problem when roots grow somewhat horizontally and the old way of just choosing the bottom-most endpoint would fail because sometimes the 
-                #root starts to grow transiently upward as it circumnutates, which puts the actual tip above the endpoint found where the shootward section of the ro
-                x = locs[np.argmin([np.linalg.norm([last_y, last_x] - l) for l in locs])][1]
-                y = locs[np.argmin([np.linalg.norm([last_y, last_x] - l) for l in locs])][0]
-                
-                #old algorithm which fails when the root circumnutates while growing mostly horizontal
-#                 x = locs[np.argmax(locs, axis =0)[0]][1]
-#                 y = locs[np.argmax(locs, axis =0)[0]][0]
-                
+        self.trace_length = length
+        self.tip_coords_pcv = [[self.germination_x, self.germination_y]]
+        self.tip_skipped = [False]
+        self.frames_skipped = 0
+        return length
+
+    def center_window(self, x : int, y : int, bound_radius : int = 30):
+        """Center the tracking window on the tip (x, y), in full-frame coordinates, to trace from it."""
+        self.x1 = x - bound_radius
+        self.x2 = x + bound_radius
+        self.y1 = y - bound_radius
+        self.y2 = y + bound_radius
+        # last tip position within the crop, (row, column)
+        self._last_tip = (bound_radius, bound_radius)
+        # last processed frame cropped at the current window, for change-detection skipping
+        self._reference_crop = None
+
+    def trace_step(self, image, threshold_multiplier : float = 1.5, bound_radius : int = 30, detector : tips.TipDetector = None, skip_threshold : float = None):
+        """
+        Advance the tip trace by one frame. start_trace must have been called first.
 
-                #self.transform_crop_coords(x, x, y, y)
-                self.transform_crop_coords(x - bound_radius, x + bound_radius, y - bound_radius, y + bound_radius)
-                tip_coords.append([int((self.x2 + self.x1)/2), int((self.y2 + self.y1)/2)])
-                last_x = x
-                last_y = y
-                count = count + 1
-        except Exception as e: print(e)
-            
+        Parameters
+        ----------
+        image : np.ndarray
+            the full frame following the last traced one
+        detector : tips.TipDetector
+            detector of the opencv backend, or None to use plantcv
+        skip_threshold : float
+            if given, reuse the previous tip when the crop differs from the last processed crop by less than this mean absolute gray level
+
+        Raises
+        ------
+        ValueError
+            if no tip candidate is found, which ends the trace
+        """
+        full_image = image
+        image = image[self.y1:self.y2, self.x1:self.x2]
+
+        if skip_threshold is not None and self._reference_crop is not None and self._reference_crop.shape == image.shape:
+            if cv2.absdiff(image, self._reference_crop).mean() < skip_threshold:
+                # nearly identical to the last processed crop, the tip has not moved
+                self.tip_coords_pcv.append(list(self.tip_coords_pcv[-1]))
+                self.tip_skipped.append(True)
+                self.frames_skipped += 1
+                return
+
+        threshold = np.median(image)*threshold_multiplier #try mean?
+        if detector is not None:
+            locs = detector.find_tips(image, threshold)
+        else:
+            locs = tips.find_tips_plantcv(image, threshold)
         
-        #print(tip_coords)
-        self.tip_coords_pcv = tip_coords
+        #Here we take the index of the identified end-points and find the identified endpoint closest to the last identified tip.
+        #This solves a problem when roots grow somewhat horizontally and the old way of just choosing the bottom-most endpoint would fail because sometimes the 
+        #root starts to grow transiently upward as it circumnutates, which puts the actual tip above the endpoint found where the shootward section of the ro
+        tip = tips.nearest(locs, self._last_tip)
+        if tip is None:
+            raise ValueError("No root tip candidates found in frame " + str(self._tracking_start_frame + len(self.tip_coords_pcv) - 1))
+        y, x = int(tip[0]), int(tip[1])
         
-    def make_video(self, images, path: str, trace_tip: bool = True):
-
-        # pass by value immutable types, pass by reference mutable types
-        # images list is mutable and passed by reference so there is a need to copy the list in order to avoid overwriting
-
-        # convert to numpy object, this will keep self.images integrity
-        #frames = np.array(images)
-        frames = images.copy()
+        #old algorithm which fails when the root circumnutates while growing mostly horizontal
+#         x = locs[np.argmax(locs, axis =0)[0]][1]
+#         y = locs[np.argmax(locs, axis =0)[0]][0]
         
-        final_frames = []
 
-        frames = frames[(self._tracking_start_frame):(len(self.tip_coords_pcv) + self._tracking_start_frame - 1)]
+        #self.transform_crop_coords(x, x, y, y)
+        self.transform_crop_coords(x - bound_radius, x + bound_radius, y - bound_radius, y + bound_radius)
+        self.tip_coords_pcv.append([int((self.x2 + self.x1)/2), int((self.y2 + self.y1)/2)])
+        self.tip_skipped.append(False)
+        self._last_tip = (y, x)
+        if skip_threshold is not None:
+            self._reference_crop = np.copy(full_image[self.y1:self.y2, self.x1:self.x2])
         
-        #print(len(frames))
+    def make_video(self, images, path: str, trace_tip: bool = True, **encoder_options):
+        """
+        Render the QC video of the tip trace, streaming each composited frame to the encoder as it is produced.
+
+        The trajectory is drawn incrementally onto an overlay cropped to its bounds (see render.TraceOverlay),
+        so the source frames are never modified and memory stays constant whatever the trace length.
+        encoder_options (fps, codec, crf, preset, threads) are passed on to io.VideoEncoder.
+        """
+        frames = images[(self._tracking_start_frame):(len(self.tip_coords_pcv) + self._tracking_start_frame - 1)]
         
-        #This if statement should be before inner for loop below where cv2 places lines on images
         if trace_tip:
             self.tip_coords_pcv = np.asarray(self.tip_coords_pcv)
-            x_tip_coords = self.tip_coords_pcv[0:,0]
-            y_tip_coords = self.tip_coords_pcv[0:,1]
-
-            # calculate crop boundaries for tip video
-            x1 = min(x_tip_coords) - 50
-            x2 = max(x_tip_coords) + 50
-            y1 = min(y_tip_coords) - 50
-            y2 = max(y_tip_coords) + 50
-
-            if x1 < 0:
-                x1 = 0
-            if x2 < 0:
-                x2 = 0
-            if y1 < 0:
-                y1 = 0
-            if y2 < 0:
-                y2 = 0
-
-            for x in range(len(frames)):
-
-                frame = frames[x]
-                #ret,frame = cv2.threshold(frame,np.median(frame),255,cv2.THRESH_TOZERO)
-                original = np.copy(frame)
-                black = np.zeros_like(frame)
-                #frame = Pillow.fromarray(frame, "RGB")
-                # redraw lines in each frame, since base image is different
-                for y in range(0, x):
-                    #print(x)
-                    if self.tip_coords_pcv[y][0] != 10000:
-                        cv2.line(frame, (self.tip_coords_pcv[y][0], self.tip_coords_pcv[y][1]),
-                                 (self.tip_coords_pcv[y + 1][0], self.tip_coords_pcv[y + 1][1]),
-                                 (255, 0, 0), 3)
-
-                        cv2.line(black, (self.tip_coords_pcv[y][0], self.tip_coords_pcv[y][1]),
-                                 (self.tip_coords_pcv[y + 1][0], self.tip_coords_pcv[y + 1][1]),
-                                 (255, 0, 0), 3)
-                        
-                # crop image based on boundaries
-                original = original[y1:y2, x1:x2]
-                frame = frame[y1:y2, x1:x2]
-                black = black[y1:y2, x1:x2]
-
-                # cv2_videoWriter BGR color requirement
-                buffer = np.full(np.shape(original), 255, dtype=np.uint8)[:,1:3]
-                buffer = cv2.cvtColor(buffer, cv2.COLOR_GRAY2BGR)
-                original = cv2.cvtColor(original, cv2.COLOR_GRAY2BGR)
-                frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
-                black = cv2.cvtColor(black, cv2.COLOR_GRAY2BGR)
-                
-                complete = np.concatenate((original, buffer, frame, buffer, black), axis=1)
-                
-                final_frames.append(complete)
-                #print(len(final_frames))
-                #print(len(frames))
-
-            print("___FRAME SIZE___", "x1", x1, "y1", y1, "x2", x2, "y2", y2)
+            overlay = TraceOverlay(self.tip_coords_pcv)
+            print("___FRAME SIZE___", "x1", overlay.x1, "y1", overlay.y1, "x2", overlay.x2, "y2", overlay.y2)
             print("___PATH___", path)
-        
-        #save final frame for QC
-        self.final_trace_img = final_frames[-1]
-        
-        # print(np.shape(final_frames[0]))
-        io.make_video_cv2(final_frames, path)
+            io.encode_video(overlay.render(frames), path, **encoder_options)
+            #save final frame for QC
+            self.final_trace_img = overlay.last_frame
+        else:
+            io.encode_video(frames, path, **encoder_options)
 
+    def update_video(self, images, path : str, first_point : int, previous_coords, **encoder_options):
+        """
+        Update the QC video written by make_video after the trace changed from point first_point on, see retrace_from.
+
+        QC video frame x shows the trace up to point x, so frames before first_point are unchanged. When the
+        new trace fits in the region of the previous video, those frames are copied up to the last key frame
+        before first_point and only the rest is rendered and encoded (see io.splice_video). Otherwise, or
+        without a previous video, the whole video is rendered again. encoder_options must be those the video
+        was made with.
 
+        Parameters
+        ----------
+        path : str
+            the QC video
+        first_point : int
+            index of the first changed point of tip_coords_pcv, as retrace_from returns
+        previous_coords :
+            tip_coords_pcv the video was rendered from
+        """
+        self.tip_coords_pcv = np.asarray(self.tip_coords_pcv)
+        previous = TraceOverlay(previous_coords)
+        if not os.path.exists(path) or not previous.contains(self.tip_coords_pcv):
+            print("Rendering the whole video again: " + path)
+            self.make_video(images, path, trace_tip=True, **encoder_options)
+            return
+        start = io.keyframe_before(path, min(first_point, len(self.tip_coords_pcv) - 1))
+        overlay = TraceOverlay(self.tip_coords_pcv, bounds=previous.bounds)
+        frames = images[(self._tracking_start_frame + start):(len(self.tip_coords_pcv) + self._tracking_start_frame - 1)]
+        print(f"Rendering frames {start} to {len(self.tip_coords_pcv) - 2} of {path}")
+        io.splice_video(overlay.render(frames, start), path, start, **encoder_options)
+        self.final_trace_img = overlay.last_frame
+        if self.final_trace_img is None:
+            self.render_final_trace_img(images)
+
+    def render_final_trace_img(self, images):
+        """Render only the last QC video frame into final_trace_img, e.g. for a seed restored from a checkpoint."""
+        coords = np.asarray(self.tip_coords_pcv)
+        last = len(coords) - 2
+        if last < 0:
+            return None
+        overlay = TraceOverlay(coords)
+        self.final_trace_img = overlay.compose(images[self._tracking_start_frame + last], last).copy()
+        return self.final_trace_img
 
 
     def max_intensity_projection(self):
@@ -657,24 +978,28 @@ class Seed(Image):
         pass
 
     def to_dict(self):
+        """
+        :return: everything needed to recreate the seed without recomputing or re-asking anything: its region, germination, tip trace and validation
+        """
         tip_coords = self.tip_coords
         if isinstance(tip_coords, np.ndarray):
             tip_coords = tip_coords.tolist()
-        # print(type(tip_coords), type(tip_coords[0]), type(tip_coords[0][0]))
-        print(type(tip_coords))
-        if tip_coords:
-            print(type(tip_coords))
-            # print(tip_coords)
-            print(type(tip_coords[0]))
-            print(type(tip_coords[0][0]))
-        print(type(self._tracking_start_frame), type(self.germination_x), type(self.germination_y), type(self.qr_number), type(self.seed_number))
         tip_coords = [self.array_to_dict(i) for i in tip_coords]
 
         return {
-            "germination_frame":self._tracking_start_frame,
-            "germination_x": int(self.germination_x),
-            "germination_y": int(self.germination_y),
+            "germination_frame": int(self._tracking_start_frame),
+            "germination_x": None if self.germination_x is None else int(self.germination_x),
+            "germination_y": None if self.germination_y is None else int(self.germination_y),
+            "germination_indicator": bool(self.germination_indicator),
+            "germination_not_found": bool(self.germination_not_found),
+            "germination_searched": bool(self.germination_searched),
+            "curling_start_frame": None if self.curling_start_frame is None else int(self.curling_start_frame),
             "tip_coords": tip_coords,
+            "tip_coords_pcv": [[int(v) for v in point] for point in self.tip_coords_pcv],
+            "tip_skipped": [bool(v) for v in self.tip_skipped],
+            "frames_skipped": int(self.frames_skipped),
+            "trace_length": None if self.trace_length is None else int(self.trace_length),
+            "validation": self.validation,
             "qr_number": self.qr_number,
             "seed_number": self.seed_number,
             "x1": int(self.final_x1),
@@ -696,15 +1021,27 @@ class Seed(Image):
         mi = Image(image)
         mi.set_crop(dct.get("x1"), dct.get("x2"), dct.get("y1"), dct.get("y2"))
         seed = cls(mi, dct.get("qr_number"), dct.get("seed_number"))
-        seed._germination_frame = dct.get("germination_frame")
+        seed._tracking_start_frame = dct.get("germination_frame", 0)
         seed.germination_x = dct.get("germination_x")
         seed.germination_y = dct.get("germination_y")
+        seed.germination_indicator = dct.get("germination_indicator", False)
+        seed.germination_not_found = dct.get("germination_not_found", False)
+        seed.germination_searched = dct.get("germination_searched", False)
+        seed.curling_start_frame = dct.get("curling_start_frame")
 
         # convert array[map(array[])] back to array[array[]]
-        tip_coords_arr = dct.get("tip_coords")
+        tip_coords_arr = dct.get("tip_coords", [])
         tip_coords = [cls.dict_to_array(i) for i in tip_coords_arr]
         seed.tip_coords = tip_coords
 
+        tip_coords_pcv = dct.get("tip_coords_pcv", [])
+        # a finished trace is an array, as make_video leaves it
+        seed.tip_coords_pcv = np.asarray(tip_coords_pcv) if tip_coords_pcv else []
+        seed.tip_skipped = dct.get("tip_skipped", [])
+        seed.frames_skipped = dct.get("frames_skipped", 0)
+        seed.trace_length = dct.get("trace_length")
+        seed.validation = dct.get("validation")
+
         return seed
 
 
@@ -0,0 +1,94 @@
+"""
+Module for checkpointing the state of a box between the stages of an interactive tracking session
+
+"""
+
+import os
+import json
+import time
+import tempfile
+
+# stages of seed_localization_and_tip_tracking, in order
+STAGES = ("seed_localization", "germination", "tip_trace", "validation")
+
+
+class Checkpoint:
+    """The saved state of one box: the stages it has completed and Box.to_dict of the box after the last save.
+
+    The state is a JSON file that is replaced atomically (written to a temporary file in the same directory
+    and renamed over the old one), so a crash while saving leaves the previous checkpoint intact. Saving
+    with a stage marks that stage completed. Saving without one records progress within the current stage,
+    e.g. after each seed of the germination search, so no answer is lost.
+    """
+
+    def __init__(self, path : str):
+        """
+        Attributes
+        ----------
+
+        path : str
+            argument. the checkpoint file, e.g. /app/results/checkpoints/<qr_number>.json
+        completed : list
+            stages completed so far, in order
+        """
+        self.path = path
+        self.completed = []
+        state = self.load()
+        if state is not None:
+            self.completed = list(state.get("completed", []))
+
+    def load(self):
+        """:return: the saved state, a dict with "completed", "box" and "saved" (unix time), or None if there is none"""
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def done(self, stage : str):
+        """:return: whether stage has been completed"""
+        return stage in self.completed
+
+    @property
+    def last_stage(self):
+        """The last completed stage, or None."""
+        return self.completed[-1] if self.completed else None
+
+    def save(self, box, stage : str = None):
+        """
+        Save the state of the box.
+
+        Parameters
+        ----------
+        box : Box
+            the box, saved through Box.to_dict
+        stage : str
+            the stage just completed, one of STAGES. None saves progress within the current stage
+        """
+        if stage is not None:
+            if stage not in STAGES:
+                raise ValueError("stage must be one of " + ", ".join(STAGES))
+            if stage not in self.completed:
+                self.completed.append(stage)
+        state = {"completed": self.completed, "box": box.to_dict(), "saved": time.time()}
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(suffix=".json", dir=directory)
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(state, f, indent=4)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    def clear(self):
+        """Delete the checkpoint, to track the box again from the start."""
+        self.completed = []
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
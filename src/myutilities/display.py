@@ -0,0 +1,149 @@
+"""
+Module for showing frames in interactive plots through downscaled proxies
+
+"""
+
+import threading
+import collections
+import cv2
+import numpy as np
+from typing import NamedTuple
+from src.myutilities import util
+
+# matplotlib is only needed once something is shown
+plt = util.LazyModule("matplotlib.pyplot")
+
+
+class Proxy(NamedTuple):
+    """A downscaled image and the shape of the full-resolution image it stands for.
+
+    The image may be shared through the proxy cache, copy it before drawing on it.
+    """
+    image: np.ndarray
+    full_shape: tuple
+
+    @property
+    def scale(self):
+        """Proxy width over full-resolution width."""
+        return self.image.shape[1] / self.full_shape[1]
+
+    @property
+    def extent(self):
+        """matplotlib extent that puts the proxy over the full-resolution pixel grid."""
+        return (-0.5, self.full_shape[1] - 0.5, self.full_shape[0] - 0.5, -0.5)
+
+    def to_full(self, x, y):
+        """:return: full-resolution (x, y) of the proxy pixel (x, y)"""
+        return ((x + 0.5) * self.full_shape[1] / self.image.shape[1] - 0.5,
+                (y + 0.5) * self.full_shape[0] / self.image.shape[0] - 0.5)
+
+    def to_proxy(self, x, y):
+        """:return: proxy (x, y) of the full-resolution pixel (x, y)"""
+        return ((x + 0.5) * self.image.shape[1] / self.full_shape[1] - 0.5,
+                (y + 0.5) * self.image.shape[0] / self.full_shape[0] - 0.5)
+
+
+class ProxyDisplay:
+    """Shows images through downscaled proxies that fit a pixel budget.
+
+    Inline Jupyter plots send every image shown to the browser as a PNG, megabytes for a full-resolution
+    frame. Images with more than max_pixels pixels are resized with cv2.INTER_AREA to fit the budget before
+    they are shown, and plotted over their full-resolution extent, so the axis ticks, coordinates read off
+    them and clicked coordinates (event.xdata, event.ydata) are all full-resolution pixels. Proxies of
+    images shown with a key are kept in a small least-recently-used cache, so showing the same frame again
+    costs no resize.
+    """
+
+    def __init__(self, max_pixels : int = 1000000, cache_size : int = 16):
+        """
+        Attributes
+        ----------
+
+        max_pixels : int
+            argument. pixel budget of a proxy. Changing it empties the cache
+        cache_size : int
+            argument. number of keyed proxies kept
+        """
+        self._max_pixels = max_pixels
+        self.cache_size = cache_size
+        self._cache = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def max_pixels(self):
+        return self._max_pixels
+
+    @max_pixels.setter
+    def max_pixels(self, value : int):
+        with self._lock:
+            self._max_pixels = value
+            self._cache.clear()
+
+    def proxy(self, image : np.ndarray, key = None):
+        """
+        Downscale an image to the pixel budget, keeping its aspect ratio. Images within the budget are used as they are.
+
+        Parameters
+        ----------
+        image : np.ndarray
+            grayscale or color image
+        key : hashable
+            identifies the image content, e.g. (qr_number, frame). A proxy cached under the key is returned
+            without looking at image. None neither reads nor fills the cache
+
+        Returns
+        -------
+        Proxy
+        """
+        if key is not None:
+            with self._lock:
+                if key in self._cache:
+                    self._cache.move_to_end(key)
+                    return self._cache[key]
+        height, width = image.shape[:2]
+        scale = min(1.0, np.sqrt(self._max_pixels / max(height * width, 1)))
+        if scale < 1.0:
+            size = (max(int(width * scale), 1), max(int(height * scale), 1))
+            proxy = Proxy(cv2.resize(np.asarray(image), size, interpolation=cv2.INTER_AREA), (height, width))
+        else:
+            proxy = Proxy(np.asarray(image), (height, width))
+        if key is not None:
+            with self._lock:
+                self._cache[key] = proxy
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return proxy
+
+    def show(self, image, key = None, axis : bool = True, **imshow_options):
+        """
+        Show an image, or a Proxy as it is, with full-resolution axes.
+
+        imshow_options are passed on to plt.imshow.
+
+        :return: the Proxy shown
+        """
+        proxy = image if isinstance(image, Proxy) else self.proxy(image, key)
+        plt.imshow(proxy.image, extent=proxy.extent, **imshow_options)
+        if not axis:
+            plt.axis("off")
+        plt.show()
+        return proxy
+
+    def clear(self):
+        """Forget every cached proxy."""
+        with self._lock:
+            self._cache.clear()
+
+
+# the display used by every interactive step. Set DEFAULT.max_pixels to change the budget
+DEFAULT = ProxyDisplay()
+
+
+def proxy(image : np.ndarray, key = None):
+    """DEFAULT.proxy(image, key), see ProxyDisplay.proxy."""
+    return DEFAULT.proxy(image, key)
+
+
+def show(image, key = None, axis : bool = True, **imshow_options):
+    """DEFAULT.show(image, key, axis, **imshow_options), see ProxyDisplay.show."""
+    return DEFAULT.show(image, key, axis, **imshow_options)
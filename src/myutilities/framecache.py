@@ -0,0 +1,190 @@
+"""
+Module for the on-disk cache of decoded experiment frame stacks
+
+"""
+
+import os
+import time
+import shutil
+import hashlib
+import tempfile
+import threading
+import src.myutilities.io as io
+from src.myutilities.framestore import FrameStore
+
+# age after which a .tmp_ entry no session of this process is decoding into is deleted, e.g. one left by a killed session
+STALE_SECONDS = 6 * 3600
+
+
+class FrameCache:
+    """A size-capped, least-recently-used cache of decoded grayscale frame stacks, one per experiment directory.
+
+    Each entry is a raw frame stack directory (frames.u8 and frames.json, as written by io.unspool_video_stack)
+    named after a hash of the image file names, sizes and modification times of the experiment. Opening an
+    experiment whose entry exists memory-maps the stack and decodes nothing. Otherwise the frames are decoded
+    straight into a new entry, which is committed once the whole stack has been decoded. Entries are touched
+    when used and the least recently used ones are evicted whenever the cache grows past max_bytes.
+    """
+
+    def __init__(self, cache_dir : str = "/app/results/.frame_cache", max_bytes : int = 200 * 1024 ** 3):
+        """
+        Attributes
+        ----------
+
+        cache_dir : str
+            argument. directory holding the cache entries. Created if it does not exist
+        max_bytes : int
+            argument. total size the cache is trimmed back to after each new entry. Default is 200 GiB
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # .tmp_ entry directories being decoded into by this process, with their stores
+        self._pending = {}
+        os.makedirs(cache_dir, exist_ok=True)
+        self.sweep()
+
+    @staticmethod
+    def key(paths):
+        """
+        :param paths: full paths of the image files of an experiment, in frame order
+        :return: hex digest identifying the file list together with the size and modification time of every file
+        """
+        digest = hashlib.sha1()
+        for path in paths:
+            stat = os.stat(path)
+            digest.update(f"{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}\n".encode())
+        return digest.hexdigest()
+
+    def open(self, paths, **kwargs):
+        """
+        Open the frames of an experiment through the cache.
+
+        Parameters
+        ----------
+        paths : list
+            full paths of the image files, one per frame, in frame order
+        kwargs :
+            passed on to FrameStore when the stack has to be decoded
+
+        Returns
+        -------
+        FrameStore
+            memory-mapped stack of the experiment
+        """
+        key = self.key(paths)
+        entry = os.path.join(self.cache_dir, key)
+        if io.is_stack(entry):
+            self._touch(entry)
+            return FrameStore.from_stack(entry)
+
+        tmp_entry = tempfile.mkdtemp(prefix=".tmp_", dir=self.cache_dir)
+        try:
+            store = FrameStore(paths, file=os.path.join(tmp_entry, io.STACK_FILENAME),
+                               on_complete=lambda s: self._commit(s, tmp_entry, entry), **kwargs)
+        except BaseException:
+            shutil.rmtree(tmp_entry, ignore_errors=True)
+            raise
+        with self._lock:
+            # unless the stack was decoded and committed already
+            if not store.released:
+                self._pending[tmp_entry] = store
+        return store
+
+    def size(self):
+        """Total size in bytes of the committed entries."""
+        return sum(size for _, _, size in self._entries())
+
+    def clear(self):
+        """Delete every entry of the cache."""
+        with self._lock:
+            for name in os.listdir(self.cache_dir):
+                shutil.rmtree(os.path.join(self.cache_dir, name), ignore_errors=True)
+
+    def sweep(self, max_age : float = STALE_SECONDS):
+        """
+        Delete .tmp_ entry directories that will never be committed.
+
+        Those of this process are deleted once their store is closed, e.g. when a session was interrupted
+        before the whole stack was decoded. Others are deleted when untouched for max_age seconds, as they
+        were left by a session that was killed, and are never counted against max_bytes otherwise.
+        """
+        now = time.time()
+        with self._lock:
+            for tmp_entry, store in list(self._pending.items()):
+                if store.closed:
+                    shutil.rmtree(tmp_entry, ignore_errors=True)
+                    del self._pending[tmp_entry]
+            for name in os.listdir(self.cache_dir):
+                path = os.path.join(self.cache_dir, name)
+                if not name.startswith(".tmp_") or path in self._pending:
+                    continue
+                try:
+                    modified = max([os.stat(path).st_mtime] + [os.stat(os.path.join(path, f)).st_mtime for f in os.listdir(path)])
+                except OSError:
+                    continue
+                if now - modified > max_age:
+                    print("Deleting stale cache entry " + path)
+                    shutil.rmtree(path, ignore_errors=True)
+
+    def evict(self, keep : str = None):
+        """
+        Delete least recently used entries until the cache fits in max_bytes.
+
+        Parameters
+        ----------
+        keep : str
+            entry directory that must not be evicted, such as the one just added
+        """
+        self.sweep()
+        with self._lock:
+            entries = sorted(self._entries())
+            total = sum(size for _, _, size in entries)
+            for _, path, size in entries:
+                if total <= self.max_bytes:
+                    break
+                if path == keep:
+                    continue
+                print("Evicting cached frames " + path)
+                shutil.rmtree(path, ignore_errors=True)
+                total -= size
+
+    def _commit(self, store, tmp_entry, entry):
+        with self._lock:
+            self._pending.pop(tmp_entry, None)
+        count, height, width = store.shape
+        if count * height * width > self.max_bytes:
+            # too large to ever be kept. The open memmap stays valid after the directory is deleted
+            shutil.rmtree(tmp_entry, ignore_errors=True)
+            return
+        io.write_stack_metadata(tmp_entry, count, height, width)
+        try:
+            os.rename(tmp_entry, entry)
+        except OSError:
+            # another session committed the same experiment first, keep theirs
+            shutil.rmtree(tmp_entry, ignore_errors=True)
+            return
+        # the open memmap follows the renamed file, but it now belongs to the cache
+        store.release_file()
+        self._touch(entry)
+        self.evict(keep=entry)
+
+    def _entries(self):
+        """(last used, path, size in bytes) of every committed entry."""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name.startswith(".") or not io.is_stack(path):
+                continue
+            try:
+                entries.append((os.stat(path).st_mtime, path, os.path.getsize(os.path.join(path, io.STACK_FILENAME))))
+            except OSError:
+                continue
+        return entries
+
+    @staticmethod
+    def _touch(entry):
+        try:
+            os.utime(entry)
+        except OSError:
+            pass
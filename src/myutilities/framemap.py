@@ -0,0 +1,142 @@
+"""
+Module for applying a per-frame function to a whole frame stack in parallel without pickling frames
+
+"""
+
+import os
+import time
+import tempfile
+import concurrent.futures
+import numpy as np
+from src.myutilities.framestore import FrameStore
+
+
+# shared memory, for scratch_dir="shm". Containers often get a small /dev/shm (64 MB by default under Docker)
+SHM_DIR = "/dev/shm"
+
+
+def default_scratch_dir(images = None):
+    """
+    :param images: the source stack
+    :return: the directory of the backing file of images if it is a writable FrameStore, so scratch stacks go on the same disk, otherwise the system temporary directory
+    """
+    if isinstance(images, FrameStore) and images.file is not None:
+        directory = os.path.dirname(os.path.abspath(images.file))
+        if os.access(directory, os.W_OK):
+            return directory
+    return tempfile.gettempdir()
+
+
+def map_frames(func, images, out : FrameStore = None, in_place : bool = False, chunk : int = 64, workers : int = None,
+               progress : bool = True, scratch_dir : str = None):
+    """
+    Apply func to every frame of a stack in a pool of worker processes.
+
+    Frames never pass through pickling. The source stack is a memory-mapped file that every worker maps
+    itself: the backing file of a FrameStore, or for any other stack (VideoFrames, a list of arrays) a copy
+    written once to a scratch file on disk. Workers are handed index ranges of chunk
+    frames, read each frame from the map, call func on a private copy of it and write the result into the
+    output stack, which is another memory-mapped file.
+
+    Parameters
+    ----------
+    func : callable
+        takes a 2-D uint8 frame and returns the processed frame of the same shape, or None if it processed
+        the frame in place. It must be picklable, i.e. a module level function or a static method
+    images : FrameStore, VideoFrames, np.ndarray or list
+        the source stack. A FrameStore still loading in the background is waited for
+    out : FrameStore
+        optional output stack, written through its backing file. Default is a new temporary stack
+    in_place : bool
+        write the results back into the backing file of images, which must be a FrameStore. Use with care
+        on raw stacks written by unspooling, as their frames are overwritten
+    chunk : int
+        number of frames per task
+    workers : int
+        number of worker processes. Default is the ProcessPoolExecutor default, the number of CPUs
+    progress : bool
+        print progress every 10% of the stack
+    scratch_dir : str
+        directory of temporary stacks. Default is default_scratch_dir(images). "shm" puts them in /dev/shm,
+        which is faster but holds the whole stack in RAM and must be large enough for it
+
+    Returns
+    -------
+    FrameStore
+        the processed stack. A new temporary stack is deleted when the store is closed
+    """
+    if in_place and not isinstance(images, FrameStore):
+        raise ValueError("in_place needs a FrameStore source.")
+    if scratch_dir is None:
+        scratch_dir = default_scratch_dir(images)
+    elif scratch_dir == "shm":
+        scratch_dir = SHM_DIR
+    count = len(images)
+    temporary = None
+    if isinstance(images, FrameStore):
+        images.wait()
+        # writes through the memmap are in the page cache, which the workers' maps share, so no flush is needed
+        source, shape = images.file, images.shape
+    else:
+        temporary = source = _temporary_file(scratch_dir)
+        stack = None
+        for index, frame in enumerate(images):
+            if stack is None:
+                shape = (count,) + np.shape(frame)
+                stack = np.memmap(source, dtype=np.uint8, mode="w+", shape=shape)
+            stack[index] = frame
+        stack.flush()
+        del stack
+
+    if in_place:
+        result = images
+    elif out is not None:
+        if out.shape != shape:
+            raise ValueError("Output stack has shape " + str(out.shape) + ", expected " + str(shape))
+        result = out
+    else:
+        file = _temporary_file(scratch_dir)
+        np.memmap(file, dtype=np.uint8, mode="w+", shape=shape).flush()
+        result = FrameStore.from_file(file, shape, owns_file=True)
+
+    start = time.time()
+    done = 0
+    reported = 0
+    try:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(_map_range, func, source, result.file, shape, first, min(first + chunk, count))
+                       for first in range(0, count, chunk)]
+            for future in concurrent.futures.as_completed(futures):
+                done += future.result()
+                if progress and (done * 10 // count > reported or done == count):
+                    reported = done * 10 // count
+                    elapsed = time.time() - start
+                    print("Mapped {} of {} frames ({:.1f} frames/s)".format(done, count, done / max(elapsed, 1e-9)))
+    except BaseException:
+        if result is not images and result is not out:
+            result.close()
+        raise
+    finally:
+        if temporary is not None:
+            os.remove(temporary)
+    if in_place or out is not None:
+        result.invalidate()
+    return result
+
+
+def _temporary_file(scratch_dir):
+    fd, file = tempfile.mkstemp(suffix=".u8", dir=scratch_dir)
+    os.close(fd)
+    return file
+
+
+def _map_range(func, source, destination, shape, start, stop):
+    """Worker: apply func to frames start to stop - 1 of the source stack file and write them to the destination file."""
+    src = np.memmap(source, dtype=np.uint8, mode="r", shape=shape)
+    dst = np.memmap(destination, dtype=np.uint8, mode="r+", shape=shape)
+    for index in range(start, stop):
+        frame = np.array(src[index])
+        processed = func(frame)
+        dst[index] = frame if processed is None else processed
+    # no flush: the parent maps the same file and sees the writes through the page cache
+    return stop - start
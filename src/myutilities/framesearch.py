@@ -0,0 +1,151 @@
+"""
+Module for the interactive search of the frame where an event (germination, curling) first shows
+
+"""
+
+import cv2
+import numpy as np
+import concurrent.futures
+from src.myutilities import util
+from src.myutilities import display
+
+# matplotlib is only needed once something is shown
+plt = util.LazyModule("matplotlib.pyplot")
+
+
+class FrameSearch:
+    """Interactive search over a frame stack for the first frame showing an event, several frames per round.
+
+    Each round shows a contact sheet of `panels` crops spread evenly over the frames still in question, and
+    the operator answers with the number of the first panel where the event has happened. That cuts the
+    search interval by a factor of panels + 1 per round instead of 2, so a few thousand frames take about
+    3 rounds with 6 panels instead of 12. While the operator looks at a sheet, the crops of every sheet
+    that can follow it are read in the background, so the next sheet shows without waiting on the stack.
+
+    The event is assumed to persist: once it has happened, it shows in every later frame.
+    """
+
+    def __init__(self, images, region, panels : int = 6, workers : int = 4, panel_width : int = 300):
+        """
+        Attributes
+        ----------
+
+        images : FrameStore, VideoFrames or np.ndarray
+            argument. the frame stack to search
+        region : tuple
+            argument. (x1, x2, y1, y2) of the crop shown, in frame pixels. Clipped to the frame
+        panels : int
+            argument. number of frames shown per round
+        workers : int
+            argument. number of threads reading crops ahead of the operator
+        panel_width : int
+            argument. crops are resized to this width on the contact sheet
+        """
+        self.images = images
+        x1, x2, y1, y2 = region
+        self.region = (max(int(x1), 0), int(x2), max(int(y1), 0), int(y2))
+        self.panels = panels
+        self.workers = workers
+        self.panel_width = panel_width
+        self._crops = {}
+        self._executor = None
+
+    def run(self, event : str = "germination"):
+        """
+        Search for the first frame showing the event.
+
+        Parameters
+        ----------
+        event : str
+            name of the event, used in the prompts
+
+        Returns
+        -------
+        int or None
+            the first frame showing the event, or None if the operator confirmed it does not happen
+        """
+        last_frame = len(self.images) - 1
+        # the event frame e is in (lo, hi]
+        lo, hi = -1, last_frame
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as self._executor:
+            while True:
+                frames = self.sample(lo, hi)
+                self.prefetch(frames)
+                for following in self.following(lo, hi, frames):
+                    self.prefetch(self.sample(*following))
+                self.show(frames)
+                while True:
+                    answer = input(f"Enter the number of the first panel showing {event} (1-{len(frames)}), "
+                                   f"(a) if it happens after the last panel, (r) to restart, or (x) if there is no {event}.")
+                    if answer in ("a", "r", "x") or (answer.isdigit() and 1 <= int(answer) <= len(frames)):
+                        break
+                    print("Invalid character")
+                if answer == "x":
+                    answer = input(f"To confirm there is no {event}, hit (x) again, or any other key to continue searching.")
+                    if answer == "x":
+                        return None
+                    continue
+                if answer == "r":
+                    lo, hi = -1, last_frame
+                    continue
+                if answer == "a":
+                    if frames[-1] == hi:
+                        # every frame up to hi was shown without the event, so look past it
+                        if hi == last_frame:
+                            print(f"There are no frames after frame {hi}. Press (x) if there is no {event}.")
+                            continue
+                        lo, hi = hi, last_frame
+                    else:
+                        lo = frames[-1]
+                    continue
+                index = int(answer) - 1
+                lo, hi = (frames[index - 1] if index > 0 else lo), frames[index]
+                if hi - lo == 1:
+                    answer = input(f"{event.capitalize()} first shows at frame {hi}. To confirm, hit (h), or any other key to restart the search.")
+                    if answer == "h":
+                        return hi
+                    lo, hi = -1, last_frame
+
+    def sample(self, lo : int, hi : int):
+        """:return: the frames shown for the interval (lo, hi], every frame if there are no more than panels"""
+        if hi - lo <= self.panels:
+            return list(range(lo + 1, hi + 1))
+        return sorted({lo + int(round((hi - lo) * j / (self.panels + 1))) for j in range(1, self.panels + 1)})
+
+    @staticmethod
+    def following(lo : int, hi : int, frames : list):
+        """:return: every interval the search can move to from the sheet of frames over (lo, hi]"""
+        bounds = [lo] + list(frames)
+        intervals = [(bounds[j], bounds[j + 1]) for j in range(len(frames)) if bounds[j + 1] - bounds[j] > 1]
+        if frames[-1] < hi:
+            intervals.append((frames[-1], hi))
+        return intervals
+
+    def prefetch(self, frames):
+        """Start reading the crops of frames in the background."""
+        for frame in frames:
+            if frame not in self._crops:
+                self._crops[frame] = self._executor.submit(self.crop, frame)
+
+    def crop(self, frame : int):
+        x1, x2, y1, y2 = self.region
+        return np.array(self.images[frame][y1:y2, x1:x2])
+
+    def sheet(self, frames):
+        """:return: the crops of frames side by side, each labelled with its panel number and frame number"""
+        tiles = []
+        for number, frame in enumerate(frames, 1):
+            crop = self._crops[frame].result()
+            height = max(int(round(crop.shape[0] * self.panel_width / max(crop.shape[1], 1))), 1)
+            tile = cv2.resize(crop, (self.panel_width, height), interpolation=cv2.INTER_AREA)
+            cv2.putText(tile, f"{number}: {frame}", (5, 25), cv2.FONT_HERSHEY_SIMPLEX, 0.8, 255, 2)
+            tiles.append(tile)
+        height = max(t.shape[0] for t in tiles)
+        sheet = np.zeros((height, len(tiles) * (self.panel_width + 4) - 4), dtype=tiles[0].dtype)
+        for j, tile in enumerate(tiles):
+            sheet[:tile.shape[0], j * (self.panel_width + 4):j * (self.panel_width + 4) + self.panel_width] = tile
+        return sheet
+
+    def show(self, frames):
+        plt.figure(figsize=(4 * len(frames), 4))
+        display.show(self.sheet(frames), axis=False)
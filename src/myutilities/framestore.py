@@ -0,0 +1,273 @@
+"""
+Module for holding the frames of an experiment as one contiguous, lazily loaded uint8 stack
+
+"""
+
+import os
+import tempfile
+import threading
+import concurrent.futures
+from collections import OrderedDict
+import numpy as np
+import src.myutilities.io as io
+
+
+class FrameStore:
+    """A grayscale frame stack backed by np.memmap that stands in for the old list of images.
+
+    The store can be indexed (including negative indices), sliced and iterated like the list Box used
+    to hold, but frames are decoded into the memory-mapped stack on demand. Loading happens in stages:
+    the frames in ``preload`` (by default the first and last, which is all init_seeds needs) are decoded
+    before the constructor returns, and the rest of the stack is decoded by a background thread. A frame
+    that is requested before the background thread reaches it is decoded immediately. Single frames are
+    additionally kept in a small least-recently-used window in RAM so the back and forth access of the
+    bisect loops does not go back to disk.
+
+    A stack that already exists on disk, such as one written by io.unspool_video_stack, is opened with
+    from_stack and needs no decoding at all.
+
+    Frames handed out by the store are read-only views or copies. Copy them before drawing on them.
+    """
+
+    def __init__(self, paths, scratch_dir : str = None, window : int = 32, preload = (0, -1), background : bool = True, workers : int = None,
+                 file : str = None, on_complete = None):
+        """
+        Attributes
+        ----------
+
+        shape : tuple
+            (number of frames, height, width) of the stack
+        _paths : list
+            argument. full paths of the image files, one per frame, in frame order
+        _file : str
+            argument. path of the file backing the memmap. For stacks decoded from images it defaults to a temporary file in scratch_dir (the system temporary directory by default). close() removes it unless it has been handed over, see release_file()
+        _window_size : int
+            argument. number of single frames kept in RAM for random access
+        _workers : int
+            argument. number of decoding threads used for staged and background loading
+        _on_complete : callable
+            argument. called with the store once every frame has been decoded, e.g. by FrameCache to commit the stack
+        """
+        self._paths = list(paths)
+        if len(self._paths) == 0:
+            raise ValueError("FrameStore needs at least one image path.")
+        first = io.read_image_single_channel(self._paths[0])
+        if first is None:
+            raise IOError("Could not read image " + self._paths[0])
+        self.shape = (len(self._paths),) + first.shape
+        self._window_size = window
+        self._workers = workers
+        self._window = OrderedDict()
+        self._lock = threading.Lock()
+        self._loaded = np.zeros(len(self._paths), dtype=bool)
+        self._background = None
+        self._closed = False
+        self._owns_file = True
+        self._on_complete = on_complete
+
+        if file is None:
+            fd, file = tempfile.mkstemp(suffix=".u8", dir=scratch_dir)
+            os.close(fd)
+        self._file = file
+        self._attach(np.memmap(self._file, dtype=np.uint8, mode="w+", shape=self.shape))
+
+        self._store(0, first)
+        self.load(preload)
+        if background:
+            self._background = threading.Thread(target=self.load, daemon=True)
+            self._background.start()
+
+    @classmethod
+    def from_stack(cls, path : str, window : int = 32):
+        """
+        Open a raw frame stack directory (frames.u8 and frames.json) read-only, without decoding.
+
+        Parameters
+        ----------
+        path : str
+            directory holding the stack
+        window : int
+            number of single frames kept in RAM for random access
+        """
+        meta = io.read_stack_metadata(path)
+        return cls.from_file(os.path.join(path, io.STACK_FILENAME), (meta["count"], meta["height"], meta["width"]),
+                             window=window)
+
+    @classmethod
+    def from_file(cls, file : str, shape : tuple, window : int = 32, owns_file : bool = False):
+        """
+        Open a raw uint8 stack file of the given shape read-only, without decoding.
+
+        Parameters
+        ----------
+        file : str
+            path of the stack file
+        shape : tuple
+            (number of frames, height, width) of the stack
+        window : int
+            number of single frames kept in RAM for random access
+        owns_file : bool
+            whether close() deletes the file, as for a temporary stack written by framemap.map_frames
+        """
+        store = cls.__new__(cls)
+        store._paths = None
+        store.shape = tuple(shape)
+        store._window_size = window
+        store._workers = None
+        store._window = OrderedDict()
+        store._lock = threading.Lock()
+        store._loaded = np.ones(store.shape[0], dtype=bool)
+        store._background = None
+        store._closed = False
+        store._owns_file = owns_file
+        store._on_complete = None
+        store._file = file
+        store._attach(np.memmap(store._file, dtype=np.uint8, mode="r", shape=store.shape))
+        return store
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        self._check_open()
+        if isinstance(key, slice):
+            indices = range(*key.indices(len(self)))
+            self.load(indices)
+            return self._view[key]
+        index = self._normalize(key)
+        with self._lock:
+            frame = self._window.get(index)
+            if frame is not None:
+                self._window.move_to_end(index)
+                return frame
+        self._load_one(index)
+        frame = np.array(self._stack[index])
+        frame.flags.writeable = False
+        with self._lock:
+            self._window[index] = frame
+            while len(self._window) > self._window_size:
+                self._window.popitem(last=False)
+        return frame
+
+    def __iter__(self):
+        # sequential reads go straight to the memmap so they do not flush the random access window
+        for index in range(len(self)):
+            self._check_open()
+            self._load_one(index)
+            yield self._view[index]
+
+    def __del__(self):
+        self.close()
+
+    @property
+    def file(self):
+        """Path of the file backing the stack."""
+        return self._file
+
+    @property
+    def loaded(self):
+        """Number of frames decoded into the stack so far."""
+        return int(np.count_nonzero(self._loaded))
+
+    def load(self, indices = None):
+        """
+        Decode frames into the stack, skipping any that are already loaded.
+
+        Parameters
+        ----------
+        indices : iterable
+            frame indices to decode. Negative indices count from the end. Default is every frame.
+        """
+        if indices is None:
+            indices = range(len(self))
+        missing = [i for i in (self._normalize(i) for i in indices) if not self._loaded[i]]
+        if len(missing) == 1:
+            self._load_one(missing[0])
+        elif len(missing) > 1:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self._workers) as executor:
+                for _ in executor.map(self._load_one, missing):
+                    if self._closed:
+                        break
+        self._check_complete()
+
+    def wait(self):
+        """Block until the background loader has decoded the whole stack."""
+        if self._background is not None:
+            self._background.join()
+        self.load()
+
+    def invalidate(self):
+        """Forget the frames held in the random access window, after the backing file was written to from elsewhere."""
+        with self._lock:
+            self._window.clear()
+
+    @property
+    def closed(self):
+        """Whether close() has been called."""
+        return getattr(self, "_closed", True)
+
+    @property
+    def released(self):
+        """Whether the backing file has been handed over, see release_file()."""
+        return not self._owns_file
+
+    def release_file(self):
+        """Hand the backing file over to the caller, so close() no longer deletes it. Returns its path."""
+        self._owns_file = False
+        return self._file
+
+    def close(self):
+        """Stop using the stack and delete its backing file."""
+        if getattr(self, "_closed", True):
+            return
+        self._closed = True
+        self._window.clear()
+        if self._background is not None and self._background is not threading.current_thread():
+            self._background.join()
+        self._view = None
+        self._stack = None
+        if self._owns_file:
+            try:
+                os.remove(self._file)
+            except OSError:
+                pass
+
+    def _check_open(self):
+        if self.closed:
+            raise ValueError("FrameStore is closed")
+
+    def _check_complete(self):
+        with self._lock:
+            if self._on_complete is None or self._closed or not self._loaded.all():
+                return
+            on_complete = self._on_complete
+            self._on_complete = None
+        self._stack.flush()
+        on_complete(self)
+
+    def _attach(self, stack):
+        self._stack = stack
+        self._view = np.asarray(stack).view()
+        self._view.flags.writeable = False
+
+    def _normalize(self, index):
+        index = int(index)
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("frame index out of range")
+        return index
+
+    def _load_one(self, index):
+        if self._loaded[index] or self._closed:
+            return
+        frame = io.read_image_single_channel(self._paths[index])
+        if frame is None:
+            raise IOError("Could not read image " + self._paths[index])
+        self._store(index, frame)
+
+    def _store(self, index, frame):
+        if frame.shape != self.shape[1:]:
+            raise ValueError("Frame " + self._paths[index] + " has shape " + str(frame.shape) + ", expected " + str(self.shape[1:]))
+        self._stack[index] = frame
+        self._loaded[index] = True
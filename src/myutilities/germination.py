@@ -0,0 +1,167 @@
+"""
+Module for automatic germination detection from the foreground area of a seed crop over time
+
+"""
+
+import cv2
+import numpy as np
+from typing import NamedTuple
+from src.myutilities.tips import TipDetector
+
+
+class GerminationEstimate(NamedTuple):
+    """Result of detect_germination and detect_germination_regions.
+
+    frame is the proposed germination frame, or None if the foreground never grew. candidates are the
+    skeleton endpoints of the crop at that frame, (row, column) in crop coordinates, most likely germination
+    point first. confidence is between 0 and 1. area is the foreground area of every frame.
+    """
+    frame: int
+    candidates: np.ndarray
+    confidence: float
+    area: np.ndarray
+
+
+def foreground_areas(images, regions, threshold_multiplier : float = 1.5, median_stride : int = 16, keep_frames : int = 0):
+    """
+    Count the foreground pixels of several crops in every frame, in one pass over the stack.
+
+    Frames are read one at a time, in order, so a video is decoded once for all the crops and nothing but
+    the current frame is held. A pixel is foreground when it is brighter than threshold_multiplier times
+    the median of its frame, the threshold the manual germination search and the tip tracing use. The
+    median is taken over every median_stride-th row and column of the frame, which gives the same value to
+    within a gray level at a fraction of the cost.
+
+    Parameters
+    ----------
+    images : FrameStore, VideoFrames or np.ndarray
+        the frame stack of the box
+    regions : list
+        (x1, x2, y1, y2) of each crop in frame pixels
+    keep_frames : int
+        number of leading frames whose crops are kept and returned, e.g. the baseline of detect_germination
+
+    Returns
+    -------
+    np.ndarray
+        foreground pixel count of every crop in every frame, shape (len(regions), frames)
+    list
+        per crop, its first keep_frames crops stacked as (keep_frames, height, width), or None if keep_frames is 0
+    """
+    areas = np.zeros((len(regions), len(images)), dtype=np.int64)
+    kept = [[] for _ in regions]
+    for index, frame in enumerate(images):
+        frame = np.asarray(frame)
+        threshold = np.median(frame[::median_stride, ::median_stride]) * threshold_multiplier
+        for r, (x1, x2, y1, y2) in enumerate(regions):
+            crop = frame[y1:y2, x1:x2]
+            areas[r, index] = np.count_nonzero(crop > threshold)
+            if index < keep_frames:
+                kept[r].append(np.array(crop))
+    return areas, [np.stack(crops) if crops else None for crops in kept]
+
+
+def foreground_area(images, region, threshold_multiplier : float = 1.5, median_stride : int = 16):
+    """
+    Count the foreground pixels of one crop in every frame, see foreground_areas.
+
+    Returns
+    -------
+    np.ndarray
+        foreground pixel count of the crop, one per frame
+    """
+    return foreground_areas(images, [region], threshold_multiplier, median_stride)[0][0]
+
+
+def detect_germination(images, region, threshold_multiplier : float = 1.5, baseline_frames : int = 30,
+                       persistence : int = 5, k_sigma : float = 6, min_growth : int = 30, tip_radius : int = 10):
+    """
+    Propose the germination frame and germination point of one seed, see detect_germination_regions.
+
+    Returns
+    -------
+    GerminationEstimate
+    """
+    return detect_germination_regions(images, [region], threshold_multiplier, baseline_frames, persistence, k_sigma,
+                                      min_growth, tip_radius)[0]
+
+
+def detect_germination_regions(images, regions, threshold_multiplier : float = 1.5, baseline_frames : int = 30,
+                               persistence : int = 5, k_sigma : float = 6, min_growth : int = 30, tip_radius : int = 10):
+    """
+    Propose the germination frame and germination point of every seed of a box, from one pass over the stack.
+
+    The foreground area of the seed crop is flat until the radicle emerges and grows from then on. The
+    baseline is the median area of the first baseline_frames frames and its noise the scaled median absolute
+    deviation of the frame to frame change. The proposed frame is the first one from which the area stays
+    above the baseline by max(k_sigma * noise, min_growth) pixels for persistence frames. The candidates
+    are the skeleton endpoints at that frame, ordered by distance to the new foreground, i.e. foreground
+    that was not there in the baseline frames.
+
+    Confidence combines how far the rise clears the detection level, whether the area is still above it at
+    the end of the series, and whether an endpoint lies within tip_radius pixels of the new foreground.
+
+    A seed that germinates within the first baseline_frames frames cannot be detected, as its growth is
+    part of the baseline. When the area already rises by the detection level across the baseline frames,
+    no estimate is proposed, so the manual search takes over.
+
+    Parameters
+    ----------
+    images : FrameStore, VideoFrames or np.ndarray
+        the frame stack of the box
+    regions : list
+        (x1, x2, y1, y2) of each seed crop in frame pixels
+    threshold_multiplier : float
+        foreground threshold as a multiple of the frame median
+
+    Returns
+    -------
+    list
+        a GerminationEstimate per region
+    """
+    areas, baselines = foreground_areas(images, regions, threshold_multiplier, keep_frames=baseline_frames)
+    return [_estimate(images, region, area, baseline_crops, baseline_frames, threshold_multiplier, persistence, k_sigma,
+                      min_growth, tip_radius) for region, area, baseline_crops in zip(regions, areas, baselines)]
+
+
+def _estimate(images, region, area, baseline_crops, baseline_frames, threshold_multiplier, persistence, k_sigma, min_growth, tip_radius):
+    x1, x2, y1, y2 = region
+    no_estimate = GerminationEstimate(None, np.empty((0, 2), dtype=np.int64), 0.0, area)
+    if len(area) < baseline_frames + persistence:
+        return no_estimate
+
+    baseline = np.median(area[:baseline_frames])
+    noise = 1.4826 * np.median(np.abs(np.diff(area[:baseline_frames]) - np.median(np.diff(area[:baseline_frames]))))
+    level = baseline + max(k_sigma * noise, min_growth)
+    if np.median(area[baseline_frames - persistence:baseline_frames]) - np.median(area[:persistence]) >= level - baseline:
+        # already growing in the baseline frames, germination is earlier than this method can see
+        return no_estimate
+    above = area > level
+    runs = np.convolve(above.astype(np.int64), np.ones(persistence, dtype=np.int64), mode="valid")
+    starts = np.flatnonzero(runs == persistence)
+    if len(starts) == 0:
+        return no_estimate
+    frame = int(starts[0])
+
+    rise = np.median(area[frame:frame + persistence]) - baseline
+    confidence = 1 - (level - baseline) / rise
+    if np.median(area[-persistence:]) <= level:
+        # the growth did not last, more likely a lighting change or debris than a root
+        confidence *= 0.5
+
+    frame_image = np.asarray(images[frame])
+    threshold = np.median(frame_image) * threshold_multiplier
+    crop = frame_image[y1:y2, x1:x2]
+    locs = TipDetector().find_tips(crop, threshold)
+    baseline_crop = np.median(baseline_crops, axis=0)
+    growth = (crop > threshold) & ~(baseline_crop > threshold)
+    if len(locs) == 0 or not growth.any():
+        return GerminationEstimate(frame, locs, 0.0, area)
+
+    # distance of every pixel to the nearest new foreground pixel
+    distance = cv2.distanceTransform((~growth).astype(np.uint8), cv2.DIST_L2, 3)
+    distances = distance[locs[:, 0], locs[:, 1]]
+    candidates = locs[np.argsort(distances, kind="stable")]
+    if distances.min() > tip_radius:
+        confidence = 0.0
+    return GerminationEstimate(frame, candidates, float(np.clip(confidence, 0, 1)), area)
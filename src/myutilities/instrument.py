@@ -0,0 +1,173 @@
+"""
+Module for timing the stages of the tracking pipeline and writing them out as JSON lines
+
+"""
+
+import os
+import json
+import time
+import builtins
+import threading
+import contextlib
+
+
+class StageTimer:
+    """Per-stage wall time, CPU time, peak memory growth, frame counts and time spent waiting on input().
+
+    Each stage is a context manager that yields its record, a dict the caller can add fields to, such as
+    the number of frames processed. While any stage is open, builtins.input is wrapped so the time spent
+    waiting for the operator is recorded separately from compute. Stages can be nested; input wait counts
+    towards every open stage. Finished records are appended to a JSON lines file, one line per stage.
+
+    Record fields: the context given to the timer (e.g. qr_number), stage, started (unix time), wall_s,
+    cpu_s (process CPU time over all threads), input_wait_s, compute_s (wall_s - input_wait_s), frames,
+    peak_rss_mb (peak resident set size during the stage) and peak_rss_delta_mb (peak_rss_mb minus the
+    resident set size when the stage started).
+
+    The per-stage peak comes from Linux: the resident set high-water mark (VmHWM) is reset through
+    /proc/self/clear_refs when a stage starts, and folded into every open stage before each reset, so
+    nested stages keep their own peaks. Where it cannot be reset, peak_rss_mb and peak_rss_delta_mb are
+    None, as the process lifetime peak (ru_maxrss) says nothing about a single stage. Resetting VmHWM
+    also resets ru_maxrss.
+    """
+
+    def __init__(self, report_path : str = None, **context):
+        """
+        Attributes
+        ----------
+
+        report_path : str
+            argument. JSON lines file the records are appended to. None keeps them in records only
+        context : dict
+            argument. fields added to every record, e.g. qr_number
+        records : list
+            finished stage records, in the order the stages finished
+        """
+        self.report_path = report_path
+        self.context = context
+        self.records = []
+        self._open = []
+        self._lock = threading.Lock()
+        self._input = None
+        # per open record: [resident set size at its start, peak so far], in MB
+        self._rss = {}
+        self._resettable = _reset_peak_rss()
+
+    @contextlib.contextmanager
+    def stage(self, name : str, frames : int = 0):
+        """
+        Time a stage.
+
+        Parameters
+        ----------
+        name : str
+            stage name
+        frames : int
+            number of frames the stage processes. Can also be set later through record["frames"]
+        """
+        record = dict(self.context)
+        record.update({"stage": name, "started": time.time(), "frames": frames, "input_wait_s": 0.0})
+        cpu = time.process_time()
+        wall = time.perf_counter()
+        self._push(record)
+        try:
+            yield record
+        finally:
+            start_rss, peak = self._pop(record)
+            record["wall_s"] = time.perf_counter() - wall
+            record["cpu_s"] = time.process_time() - cpu
+            record["compute_s"] = record["wall_s"] - record["input_wait_s"]
+            record["peak_rss_mb"] = peak
+            record["peak_rss_delta_mb"] = None if peak is None or start_rss is None else peak - start_rss
+            self.records.append(record)
+            self.write(record)
+
+    def write(self, record : dict):
+        """Append one record to the report file."""
+        if self.report_path is None:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.report_path)), exist_ok=True)
+        with open(self.report_path, "a") as f:
+            f.write(json.dumps(record, default=str) + "\n")
+
+    def summary(self):
+        """:return: one line per stage with its wall time split into input wait and compute"""
+        return "\n".join("{:<16} {:8.1f} s wall {:8.1f} s input {:8.1f} s cpu {:>7} MB peak {:7d} frames".format(
+            r["stage"], r["wall_s"], r["input_wait_s"], r["cpu_s"],
+            "n/a" if r["peak_rss_delta_mb"] is None else "{:+.0f}".format(r["peak_rss_delta_mb"]), r["frames"]) for r in self.records)
+
+    def _push(self, record):
+        with self._lock:
+            if not self._open:
+                self._input = builtins.input
+                builtins.input = self._timed_input
+            self._fold_peak()
+            self._open.append(record)
+            rss = _status_mb("VmRSS")
+            self._rss[id(record)] = [rss, rss]
+            if self._resettable:
+                _reset_peak_rss()
+
+    def _pop(self, record):
+        """:return: (resident set size at the start of the stage, its peak), None where unknown"""
+        with self._lock:
+            self._fold_peak()
+            start_rss, peak = self._rss.pop(id(record))
+            # by identity, as two open records can compare equal
+            del self._open[next(i for i, r in enumerate(self._open) if r is record)]
+            if not self._open:
+                builtins.input = self._input
+                self._input = None
+        return start_rss, peak if self._resettable else None
+
+    def _fold_peak(self):
+        # the high-water mark since the last reset counts towards every open stage
+        if not self._resettable:
+            return
+        hwm = _status_mb("VmHWM")
+        if hwm is None:
+            return
+        for rss in self._rss.values():
+            rss[1] = hwm if rss[1] is None else max(rss[1], hwm)
+
+    def _timed_input(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return self._input(*args, **kwargs)
+        finally:
+            waited = time.perf_counter() - start
+            with self._lock:
+                for record in self._open:
+                    record["input_wait_s"] += waited
+
+
+@contextlib.contextmanager
+def maybe_stage(timer : StageTimer, name : str, frames : int = 0):
+    """timer.stage(name, frames) if timer is given, otherwise a stage that records nothing."""
+    if timer is None:
+        yield {}
+    else:
+        with timer.stage(name, frames) as record:
+            yield record
+
+
+def _status_mb(field):
+    """:return: a kB field of /proc/self/status, such as VmRSS or VmHWM, in MB, or None where there is none"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def _reset_peak_rss():
+    """Reset VmHWM to the current resident set size. :return: whether it could be reset"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        return False
+    return _status_mb("VmHWM") is not None
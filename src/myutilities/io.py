@@ -6,10 +6,17 @@ Module dealing with io bound tasks, reading and writing to disk, and conversions
 
 import os
 import cv2
+import glob
+import json
+import tempfile
 import subprocess
 import numpy as np
 from PIL import Image as Pillow
-from typing import List
+from typing import Iterable, List
+
+# file names of a raw frame stack: the frames as consecutive uint8 grayscale rasters, and a json sidecar with their shape
+STACK_FILENAME = "frames.u8"
+STACK_METADATA = "frames.json"
 
 
 def read_image_single_channel(path):
@@ -38,17 +45,263 @@ def save_image_from_array(image: np.ndarray, image_output_path : str):
         os.makedirs(root)
         image.save(image_output_path)
 
-def make_video_cv2(frames: List[np.ndarray], save_path:str, filename:str=""):
-    video = cv2.VideoWriter(save_path + filename, cv2.VideoWriter_fourcc(*'mp4v'), 15,
-                            (np.shape(frames[0])[1], np.shape(frames[0])[0]))
+def make_video_cv2(frames: Iterable[np.ndarray], save_path:str, filename:str=""):
+    """
+    Write BGR frames to an mp4v video at 15 fps. frames can be a list or any iterator, such as a generator
+    producing frames one at a time; each frame is written as soon as it is produced.
+    """
+    video = None
     for frame in frames:
+        if video is None:
+            video = cv2.VideoWriter(save_path + filename, cv2.VideoWriter_fourcc(*'mp4v'), 15,
+                                    (np.shape(frame)[1], np.shape(frame)[0]))
         video.write(frame)
-    video.release()
+    if video is not None:
+        video.release()
+
+def make_video_ffmpeg(save_path : str, **encoder_options):
+    """
+    Encode the PNGs of a directory, in name order, into save_path/outfile.mp4.
+
+    encoder_options are passed on to VideoEncoder.
+    """
+    paths = sorted(glob.glob(os.path.join(glob.escape(save_path), "*.png")))
+    encode_video((cv2.imread(path) for path in paths), os.path.join(save_path, "outfile.mp4"), **encoder_options)
+
+
+class VideoEncoder:
+    """A long-lived ffmpeg process that encodes raw frames written to its stdin.
+
+    Frames can be written one at a time with write(), typically inside a with block, or a whole iterable
+    can be passed to encode_video. The frame size and pixel format (gray or BGR) are taken from the first
+    frame, and odd frame sizes are padded to even ones as yuv420p requires. Because ffmpeg runs in its own
+    process, encoding overlaps with whatever produces the frames.
+    """
+
+    def __init__(self, path : str, fps : float = 15, codec : str = "libx264", crf : int = 23, preset : str = "veryfast",
+                 threads : int = None, pix_fmt : str = "yuv420p", gop : int = None):
+        """
+        Attributes
+        ----------
+
+        path : str
+            argument. output video file
+        fps : float
+            argument. frame rate. Default is 15, as for every QC video so far
+        codec : str
+            argument. ffmpeg video encoder
+        crf : int
+            argument. constant rate factor, lower is better quality. Ignored by encoders without one
+        preset : str
+            argument. encoder speed preset. Ignored by encoders without one
+        threads : int
+            argument. encoder threads. Default is ffmpeg's own choice
+        pix_fmt : str
+            argument. pixel format of the output
+        gop : int
+            argument. key frame interval in frames, with closed GOPs. splice_video can only copy a video up to a
+            key frame, so short intervals let it reuse more of a video it updates. Default is the encoder's own
+        frames : int
+            number of frames written so far
+        """
+        self.path = path
+        self.fps = fps
+        self.codec = codec
+        self.crf = crf
+        self.preset = preset
+        self.threads = threads
+        self.pix_fmt = pix_fmt
+        self.gop = gop
+        self.frames = 0
+        self._process = None
+        self._shape = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def command(self, width : int, height : int, input_pix_fmt : str):
+        """The ffmpeg command line for frames of the given size and pixel format."""
+        command = ["ffmpeg", "-y", "-loglevel", "error",
+                   "-f", "rawvideo", "-pix_fmt", input_pix_fmt, "-s", f"{width}x{height}", "-r", str(self.fps), "-i", "-",
+                   "-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2", "-c:v", self.codec, "-pix_fmt", self.pix_fmt]
+        if self.codec in ("libx264", "libx265"):
+            command += ["-crf", str(self.crf), "-preset", self.preset]
+        if self.gop:
+            command += ["-g", str(self.gop), "-flags", "+cgop"]
+        if self.threads:
+            command += ["-threads", str(self.threads)]
+        return command + [self.path]
+
+    def write(self, frame : np.ndarray):
+        """
+        Send one frame to the encoder. All frames must have the shape of the first.
+
+        :param frame: uint8 grayscale (h, w) or BGR (h, w, 3) frame
+        """
+        if self._process is None:
+            self._shape = frame.shape
+            input_pix_fmt = "gray" if frame.ndim == 2 else "bgr24"
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._process = subprocess.Popen(self.command(frame.shape[1], frame.shape[0], input_pix_fmt), stdin=subprocess.PIPE)
+        elif frame.shape != self._shape:
+            raise ValueError("Frame shape " + str(frame.shape) + " does not match the first frame " + str(self._shape))
+        self._process.stdin.write(np.ascontiguousarray(frame, dtype=np.uint8).data)
+        self.frames += 1
+
+    def close(self):
+        """Finish the video and wait for ffmpeg to exit."""
+        if self._process is None:
+            return
+        self._process.stdin.close()
+        returncode = self._process.wait()
+        self._process = None
+        if returncode != 0:
+            raise IOError("ffmpeg failed to encode " + self.path)
+
+
+def encode_video(frames : Iterable[np.ndarray], path : str, **encoder_options):
+    """
+    Encode an iterable of frames, such as a generator producing them one at a time, with a VideoEncoder.
 
-def make_video_ffmpeg(save_path : str):
-    os.chdir(save_path)
-    command = 'ffmpeg -framerate 15 -pattern_type glob -i \'*.png\' -pix_fmt yuv420p outfile.mp4'
-    subprocess.call(command, shell=True)
+    Parameters
+    ----------
+    frames : iterable
+        uint8 grayscale or BGR frames
+    path : str
+        output video file
+    encoder_options :
+        fps, codec, crf, preset, threads, pix_fmt or gop, see VideoEncoder
+
+    Returns
+    -------
+    int
+        number of frames written
+    """
+    with VideoEncoder(path, **encoder_options) as encoder:
+        for frame in frames:
+            encoder.write(frame)
+    return encoder.frames
 
 def save_plot(fig, save_path : str):
-    fig.savefig(save_path)
\ No newline at end of file
+    fig.savefig(save_path)
+
+def probe_video(path : str):
+    """
+    :param path: path of a video file
+    :return: (width, height) of the first video stream, as reported by ffprobe
+    """
+    command = ["ffprobe", "-v", "error", "-select_streams", "v:0", "-show_entries", "stream=width,height",
+               "-of", "csv=p=0:s=x", path]
+    output = subprocess.run(command, capture_output=True, text=True, check=True).stdout
+    width, height = output.strip().splitlines()[0].split("x")[:2]
+    return int(width), int(height)
+
+def probe_keyframes(path : str):
+    """
+    :param path: path of a video file
+    :return: indices of the key frames of the first video stream. With closed GOPs, as VideoEncoder writes, packet and frame order agree at key frames
+    """
+    command = ["ffprobe", "-v", "error", "-select_streams", "v:0", "-show_entries", "packet=flags", "-of", "csv=p=0", path]
+    output = subprocess.run(command, capture_output=True, text=True, check=True).stdout
+    return [index for index, flags in enumerate(output.split()) if "K" in flags]
+
+def keyframe_before(path : str, frame : int):
+    """:return: the last key frame of the video at or before frame, the furthest point splice_video can copy the video up to"""
+    return max((k for k in probe_keyframes(path) if k <= frame), default=0)
+
+def splice_video(frames : Iterable[np.ndarray], path : str, start : int, **encoder_options):
+    """
+    Replace the frames of an existing video from frame start on, copying the frames before it without re-encoding.
+
+    The first start frames are stream copied, the new frames are encoded with a VideoEncoder and the two
+    parts are joined with ffmpeg's concat demuxer, then the result replaces the video. start must be a key
+    frame (see keyframe_before) and encoder_options must match those the video was encoded with, so that
+    both parts have the same codec parameters.
+
+    Parameters
+    ----------
+    frames : iterable
+        the new frames, starting at frame start
+    path : str
+        the video to update
+    start : int
+        first frame to replace. 0 encodes the whole video again
+
+    Returns
+    -------
+    int
+        number of frames in the updated video
+    """
+    if start == 0:
+        return encode_video(frames, path, **encoder_options)
+    extension = os.path.splitext(path)[1]
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(path))) as tmp:
+        prefix = os.path.join(tmp, "prefix" + extension)
+        suffix = os.path.join(tmp, "suffix" + extension)
+        spliced = os.path.join(tmp, "spliced" + extension)
+        subprocess.run(["ffmpeg", "-y", "-loglevel", "error", "-i", path, "-map", "0:v:0", "-frames:v", str(start), "-c", "copy", prefix], check=True)
+        written = encode_video(frames, suffix, **encoder_options)
+        if written == 0:
+            os.replace(prefix, path)
+            return start
+        listing = os.path.join(tmp, "parts.txt")
+        with open(listing, "w") as f:
+            f.write(f"file '{prefix}'\nfile '{suffix}'\n")
+        subprocess.run(["ffmpeg", "-y", "-loglevel", "error", "-f", "concat", "-safe", "0", "-i", listing, "-c", "copy", spliced], check=True)
+        os.replace(spliced, path)
+    return start + written
+
+def is_stack(path : str):
+    """
+    :param path: directory path
+    :return: True if the directory holds a raw frame stack written by unspool_video_stack
+    """
+    return os.path.isfile(os.path.join(path, STACK_METADATA))
+
+def read_stack_metadata(path : str):
+    with open(os.path.join(path, STACK_METADATA)) as f:
+        return json.load(f)
+
+def write_stack_metadata(path : str, count : int, height : int, width : int):
+    with open(os.path.join(path, STACK_METADATA), "w") as f:
+        json.dump({"count": count, "height": height, "width": width, "dtype": "uint8"}, f)
+
+def unspool_video_stack(full_path : str, out_dir : str, rate : int = 15, threads : int = None):
+    """
+    Decode a video straight into a raw grayscale frame stack, without writing one PNG per frame.
+
+    ffmpeg writes rawvideo gray output into out_dir/frames.u8 and the frame shape is recorded in
+    out_dir/frames.json, so FrameStore can memory-map the result without decoding anything.
+
+    Parameters
+    ----------
+    full_path : str
+        full path of the movie file
+    out_dir : str
+        directory to place the stack in. It is created if it does not exist.
+    rate : int
+        output frame rate, as with the -r option of the PNG unspooling. Default is 15.
+    threads : int
+        maximum number of threads ffmpeg may use. Default is ffmpeg's own choice.
+
+    Returns
+    -------
+    int
+        number of frames in the stack
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    width, height = probe_video(full_path)
+    stack_path = os.path.join(out_dir, STACK_FILENAME)
+    thread_args = ["-threads", str(threads)] if threads else []
+    command = ["ffmpeg", "-y", "-loglevel", "error"] + thread_args + ["-i", full_path, "-r", str(rate)] + thread_args + \
+              ["-f", "rawvideo", "-pix_fmt", "gray", stack_path]
+    subprocess.run(command, check=True)
+    size = os.path.getsize(stack_path)
+    if size % (width * height) != 0:
+        raise IOError("Stack " + stack_path + " is not a whole number of " + str(width) + "x" + str(height) + " frames")
+    count = size // (width * height)
+    write_stack_metadata(out_dir, count, height, width)
+    return count
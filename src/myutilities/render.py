@@ -0,0 +1,120 @@
+"""
+Module for rendering tip trajectory overlays for the per-seed QC videos
+
+"""
+
+import cv2
+import numpy as np
+from src.myutilities.results import CURL_SENTINEL
+
+# x coordinate marking a point that must not be joined to the next one, the sentinel the CSV files use
+LINE_BREAK_SENTINEL = CURL_SENTINEL
+
+
+class TraceOverlay:
+    """Incremental renderer of a tip trajectory over the frames it was traced on.
+
+    The trajectory is drawn onto one persistent canvas cropped to the trajectory bounds (plus a margin),
+    one segment per frame, instead of redrawing every earlier segment on every frame. Source frames are
+    only read, never drawn on. Each output frame is the 5-panel BGR composite of the QC videos: the
+    cropped frame, a white separator, the frame with the trajectory burnt in, a separator and the
+    trajectory alone.
+    """
+
+    def __init__(self, tip_coords, margin : int = 50, color = (255, 0, 0), thickness : int = 3, bounds : tuple = None):
+        """
+        Attributes
+        ----------
+
+        tip_coords : np.ndarray
+            argument. (x, y) tip positions in full-frame coordinates, one per traced frame plus the germination point
+        bounds : tuple
+            argument. (x1, x2, y1, y2) of the rendered region, e.g. the region of an earlier video of the seed.
+            Default is the trajectory bounds plus margin
+        x1, x2, y1, y2 : int
+            crop boundaries of the rendered region in full-frame coordinates
+        last_frame : np.ndarray
+            copy of the last composite rendered, kept for QC
+        """
+        self.tip_coords = np.asarray(tip_coords)
+        self.color = color
+        self.thickness = thickness
+        x_tip_coords = self.tip_coords[0:, 0]
+        y_tip_coords = self.tip_coords[0:, 1]
+
+        # calculate crop boundaries for tip video
+        if bounds is None:
+            bounds = (max(int(min(x_tip_coords)) - margin, 0), max(int(max(x_tip_coords)) + margin, 0),
+                      max(int(min(y_tip_coords)) - margin, 0), max(int(max(y_tip_coords)) + margin, 0))
+        self.x1, self.x2, self.y1, self.y2 = (int(v) for v in bounds)
+
+        self.last_frame = None
+        self._canvas = None
+        self._composite = None
+        self._drawn = 0
+
+    @property
+    def bounds(self):
+        """(x1, x2, y1, y2) of the rendered region."""
+        return self.x1, self.x2, self.y1, self.y2
+
+    def contains(self, tip_coords):
+        """:return: whether every point of tip_coords lies inside the rendered region"""
+        coords = np.asarray(tip_coords).reshape(-1, 2)
+        return bool(((coords[:, 0] >= self.x1) & (coords[:, 0] < self.x2) & (coords[:, 1] >= self.y1) & (coords[:, 1] < self.y2)).all())
+
+    def draw_segments(self, count : int):
+        """
+        Draw the trajectory onto the canvas up to (not including) segment count.
+
+        Segment y joins tip y to tip y + 1 and is skipped when tip y carries the line break sentinel.
+        """
+        for y in range(self._drawn, count):
+            if self.tip_coords[y][0] != LINE_BREAK_SENTINEL:
+                cv2.line(self._canvas,
+                         (int(self.tip_coords[y][0]) - self.x1, int(self.tip_coords[y][1]) - self.y1),
+                         (int(self.tip_coords[y + 1][0]) - self.x1, int(self.tip_coords[y + 1][1]) - self.y1),
+                         self.color, self.thickness)
+        self._drawn = max(self._drawn, count)
+
+    def compose(self, frame : np.ndarray, x : int):
+        """
+        :param frame: full grayscale frame number x of the trace (0 is the germination frame). It is not modified
+        :param x: position of the frame in the trace. Segments 0 to x - 1 are shown
+        :return: the 5-panel BGR composite. The buffer is reused by the next call, copy it to keep it
+        """
+        crop = frame[self.y1:self.y2, self.x1:self.x2]
+        if self._canvas is None or self._canvas.shape != crop.shape:
+            self._allocate(crop.shape)
+        self.draw_segments(x)
+        h, w = crop.shape
+        out = self._composite
+        # lines are drawn at full intensity on the grayscale frame, so burning them in is a per-pixel max
+        out[:, 0:w] = crop[:, :, None]
+        out[:, w + 2:2 * w + 2] = cv2.max(crop, self._canvas)[:, :, None]
+        out[:, 2 * w + 4:3 * w + 4] = self._canvas[:, :, None]
+        return out
+
+    def render(self, frames, start : int = 0):
+        """
+        Composite a run of frames, yielding one BGR frame at a time so nothing accumulates in memory.
+
+        Parameters
+        ----------
+        frames : iterable
+            full grayscale frames of the trace, starting at trace position start
+        start : int
+            trace position of the first frame. Earlier segments are drawn before the first composite
+        """
+        composite = None
+        for x, frame in enumerate(frames, start):
+            composite = self.compose(frame, x)
+            yield composite
+        if composite is not None:
+            self.last_frame = composite.copy()
+
+    def _allocate(self, shape):
+        h, w = shape
+        self._canvas = np.zeros(shape, dtype=np.uint8)
+        self._drawn = 0
+        self._composite = np.full((h, 3 * w + 4, 3), 255, dtype=np.uint8)
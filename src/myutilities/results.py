@@ -0,0 +1,254 @@
+"""
+Module for the columnar, appendable store of tip trajectories
+
+"""
+
+import os
+import re
+import csv
+import json
+import fcntl
+import tempfile
+import contextlib
+import numpy as np
+
+# tip coordinates of the point at which a root starts curling in the per-seed CSV files
+CURL_SENTINEL = 100000
+
+# bits of the flags column
+GERMINATION = 1  # the germination point, the first point of every trajectory
+CURL = 2  # the root starts curling here, the trajectory is cut after this point
+LOST = 4  # the last point before the tracker lost the tip
+SKIPPED = 8  # change-detection skipping reused the previous tip
+RELATIVE_FRAME = 16  # frame is the point index, as the germination frame was not recorded (rows converted from CSV)
+
+COLUMNS = {"frame": np.int32, "x": np.float32, "y": np.float32, "flags": np.uint8}
+INDEX_FILENAME = "index.json"
+
+
+class TipStore:
+    """An appendable store of per-frame tip records, one column per file, indexed by experiment and seed.
+
+    The store is a directory like the raw frame stacks: one raw little-endian file per column (frame, x,
+    y, flags) and index.json, which holds the number of committed rows and, for every experiment (qr
+    number) and seed, the row range of its trajectory. Appending writes the new rows at the end of every
+    column file and then replaces index.json atomically, so rows written by an interrupted append are
+    never seen and are overwritten by the next one. Saving a seed again points its index entry at the new
+    rows, and compact() drops rows no entry points at. Appends from several processes are serialized with
+    a file lock.
+
+    Coordinates are full-frame pixels. Rows converted from CSV files whose point was replaced by the curl
+    sentinel have NaN coordinates.
+    """
+
+    def __init__(self, path : str = "/app/results/tip_store"):
+        """
+        Attributes
+        ----------
+
+        path : str
+            argument. directory of the store. Created if it does not exist
+        """
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def experiments(self):
+        """:return: qr numbers of the experiments in the store"""
+        return sorted(self._read_index()["experiments"])
+
+    def append(self, qr_number, seed_number : int, frame, x, y, flags = None):
+        """
+        Store the trajectory of one seed, replacing any earlier trajectory of the same seed.
+
+        Parameters
+        ----------
+        qr_number :
+            experiment the seed belongs to, kept as a string
+        seed_number : int
+            1-based number of the seed in its box
+        frame, x, y, flags : array-like
+            one value per point. flags default to 0
+        """
+        columns = {"frame": frame, "x": x, "y": y, "flags": np.zeros(len(frame)) if flags is None else flags}
+        columns = {name: np.asarray(values, dtype=COLUMNS[name]) for name, values in columns.items()}
+        count = len(columns["frame"])
+        if any(len(values) != count for values in columns.values()):
+            raise ValueError("frame, x, y and flags must have the same length")
+        with self._locked():
+            index = self._read_index()
+            start = index["rows"]
+            for name, values in columns.items():
+                with open(self._column_path(name), "r+b" if os.path.exists(self._column_path(name)) else "wb") as f:
+                    # drop rows of an interrupted append
+                    f.truncate(start * values.itemsize)
+                    f.seek(start * values.itemsize)
+                    f.write(values.astype(values.dtype.newbyteorder("<"), copy=False).tobytes())
+                    f.flush()
+                    os.fsync(f.fileno())
+            index["rows"] = start + count
+            index["experiments"].setdefault(str(qr_number), {})[str(int(seed_number))] = [start, count]
+            self._write_index(index)
+
+    def append_seed(self, seed, seed_number : int = None):
+        """
+        Store the trajectory of a tracked Seed, cut at its curling frame as Box.save_seed_tracking cuts it.
+
+        The first point is the germination point at the germination frame. Point i >= 1 is the tip found in
+        frame germination_frame + i - 1. A seed with no points left, because it has no trace or curls at or
+        before its germination frame, is stored as an empty trajectory with a warning.
+        """
+        seed_number = seed.seed_number if seed_number is None else seed_number
+        coords = np.array(seed.tip_coords_pcv, dtype=float).reshape(-1, 2)
+        count = len(coords)
+        flags = np.zeros(count, dtype=np.uint8)
+        skipped = np.asarray(seed.tip_skipped[:count], dtype=bool)
+        flags[:len(skipped)][skipped] |= SKIPPED
+        trace_length = getattr(seed, "trace_length", None)
+        if count and trace_length is not None and count - 1 < trace_length:
+            flags[-1] |= LOST
+        if seed.curling_start_frame is not None:
+            count = max(seed.curling_start_frame - seed.germination_frame, 0)
+            coords, flags = coords[:count], flags[:count]
+            if len(flags):
+                flags[-1] |= CURL
+        if len(flags):
+            flags[0] |= GERMINATION
+        else:
+            print(f"Warning: seed {seed_number} of {seed.qr_number} has no tip positions before its curling frame, storing an empty trajectory")
+        frame = seed.germination_frame + np.maximum(np.arange(len(coords)) - 1, 0)
+        self.append(seed.qr_number, seed_number, frame, coords[:, 0], coords[:, 1], flags)
+
+    def read(self, qr_numbers = None, seed_numbers = None):
+        """
+        Read the trajectories of many seeds in one call.
+
+        Parameters
+        ----------
+        qr_numbers : iterable
+            experiments to read. Default is every experiment
+        seed_numbers : iterable
+            seed numbers to read within each experiment. Default is every seed
+
+        Returns
+        -------
+        dict
+            column name to np.ndarray: qr_number, seed_number, frame, x, y and flags, one entry per point,
+            grouped by experiment and seed
+        """
+        index = self._read_index()
+        experiments = index["experiments"]
+        if qr_numbers is not None:
+            experiments = {str(q): experiments[str(q)] for q in qr_numbers if str(q) in experiments}
+        wanted = None if seed_numbers is None else {str(int(s)) for s in seed_numbers}
+        segments = [(qr, int(seed), start, count) for qr, seeds in sorted(experiments.items())
+                    for seed, (start, count) in sorted(seeds.items(), key=lambda item: int(item[0]))
+                    if wanted is None or seed in wanted]
+        rows = np.concatenate([np.arange(start, start + count) for _, _, start, count in segments]) if segments else np.empty(0, dtype=np.int64)
+        counts = [count for _, _, _, count in segments]
+        out = {"qr_number": np.repeat(np.array([qr for qr, _, _, _ in segments], dtype=object), counts),
+               "seed_number": np.repeat(np.array([seed for _, seed, _, _ in segments], dtype=np.int16), counts)}
+        for name, dtype in COLUMNS.items():
+            if index["rows"] == 0:
+                out[name] = np.empty(0, dtype=dtype)
+                continue
+            column = np.memmap(self._column_path(name), dtype=np.dtype(dtype).newbyteorder("<"), mode="r", shape=(index["rows"],))
+            out[name] = column[rows].astype(dtype)
+        return out
+
+    def read_dataframe(self, qr_numbers = None, seed_numbers = None):
+        """:return: read() as a pandas DataFrame"""
+        import pandas as pd
+        return pd.DataFrame(self.read(qr_numbers, seed_numbers))
+
+    def compact(self):
+        """Rewrite the column files without the rows of replaced trajectories."""
+        with self._locked():
+            data = self.read()
+            index = {"rows": 0, "experiments": {}}
+            tmp = tempfile.mkdtemp(dir=self.path)
+            start = 0
+            for qr, seed in dict.fromkeys(zip(data["qr_number"], data["seed_number"])):
+                count = int(np.count_nonzero((data["qr_number"] == qr) & (data["seed_number"] == seed)))
+                index["experiments"].setdefault(qr, {})[str(int(seed))] = [start, count]
+                start += count
+            index["rows"] = start
+            for name, dtype in COLUMNS.items():
+                data[name].astype(np.dtype(dtype).newbyteorder("<")).tofile(os.path.join(tmp, name))
+            for name in COLUMNS:
+                os.replace(os.path.join(tmp, name), self._column_path(name))
+            os.rmdir(tmp)
+            self._write_index(index)
+
+    def _column_path(self, name):
+        return os.path.join(self.path, name)
+
+    def _read_index(self):
+        try:
+            with open(os.path.join(self.path, INDEX_FILENAME)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"rows": 0, "experiments": {}}
+
+    def _write_index(self, index):
+        fd, tmp = tempfile.mkstemp(suffix=".json", dir=self.path)
+        with os.fdopen(fd, "w") as f:
+            json.dump(index, f)
+        os.replace(tmp, os.path.join(self.path, INDEX_FILENAME))
+
+    @contextlib.contextmanager
+    def _locked(self):
+        with open(os.path.join(self.path, ".lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def read_tip_csv(path : str):
+    """
+    Parse one trajectory file written by Box.save_seed_tracking.
+
+    :param path: path of {qr_number}_{count}.csv
+    :return: (x, y, flags). The point replaced by the curl sentinel gets NaN coordinates and the CURL flag
+    """
+    with open(path, newline="") as f:
+        row = next(csv.reader(f), [])
+    points = [[float(v) for v in re.findall(r"-?\d+(?:\.\d+)?", item)] for item in row]
+    coords = np.array([p[:2] for p in points], dtype=float).reshape(-1, 2)
+    flags = np.full(len(coords), RELATIVE_FRAME, dtype=np.uint8)
+    if len(coords):
+        flags[0] |= GERMINATION
+    curl = (coords == CURL_SENTINEL).all(axis=1)
+    flags[curl] |= CURL
+    coords[curl] = np.nan
+    skipped_path = path[:-len(".csv")] + "_skipped.csv"
+    if os.path.exists(skipped_path):
+        with open(skipped_path, newline="") as f:
+            skipped = np.array([int(v) for v in next(csv.reader(f), [])], dtype=bool)[:len(coords)]
+        flags[:len(skipped)][skipped] |= SKIPPED
+    return coords[:, 0], coords[:, 1], flags
+
+
+def convert_csv_dir(csv_dir : str, store : TipStore):
+    """
+    Copy every {qr_number}_{count}.csv trajectory file of a directory into a TipStore.
+
+    The CSV files do not record the germination frame, so the frame column of converted rows holds the
+    point index and the RELATIVE_FRAME flag is set.
+
+    Returns
+    -------
+    int
+        number of trajectories converted
+    """
+    pattern = re.compile(r"^(?P<qr>.+)_(?P<seed>\d+)\.csv$")
+    converted = 0
+    for name in sorted(os.listdir(csv_dir)):
+        match = pattern.match(name)
+        if match is None:
+            continue
+        x, y, flags = read_tip_csv(os.path.join(csv_dir, name))
+        store.append(match.group("qr"), int(match.group("seed")), np.arange(len(x)), x, y, flags)
+        converted += 1
+    return converted
@@ -0,0 +1,124 @@
+"""
+Module for generating synthetic time-lapse frame stacks of germinating seeds with known root tip positions
+
+"""
+
+import os
+import cv2
+import numpy as np
+from typing import NamedTuple, List
+import src.myutilities.io as io
+
+
+class SyntheticSeed(NamedTuple):
+    """Ground truth of one synthetic seed.
+
+    region is (x1, x2, y1, y2) of a crop around the seed, as init_seeds would set it. tips holds the (x, y)
+    root tip position in every frame, NaN before germination_frame.
+    """
+    center: tuple
+    region: tuple
+    germination_frame: int
+    tips: np.ndarray
+
+
+class SyntheticBox(NamedTuple):
+    """A synthetic experiment: uint8 frames of shape (frames, height, width) and the ground truth of every seed."""
+    images: np.ndarray
+    seeds: List[SyntheticSeed]
+
+
+def generate_box(frames : int = 300, height : int = 1000, width : int = 1500, seeds : int = 3, germination : tuple = (0.1, 0.3),
+                 growth : float = None, background : int = 40, noise : float = 4, seed_value : int = 200, root_value : int = 180,
+                 root_thickness : int = 3, random_state : int = 0):
+    """
+    Generate a box of seeds that germinate and grow curving, circumnutating roots.
+
+    Seeds are bright ellipses spread evenly across the upper third of the frame. Each germinates at a
+    random frame and its root then grows from the bottom of the seed by growth pixels per frame along a
+    path whose heading drifts and oscillates. Roots are drawn frame by frame onto a persistent canvas and
+    every frame gets gaussian noise from a small bank of precomputed noise images.
+
+    Parameters
+    ----------
+    frames, height, width : int
+        size of the stack
+    seeds : int
+        number of seeds
+    germination : tuple
+        range of germination frames as fractions of the stack length
+    growth : float
+        root growth in pixels per frame. Default fills about half the frame height by the last frame
+    background, seed_value, root_value : int
+        gray levels of the background, the seeds and the roots
+    noise : float
+        standard deviation of the gaussian noise in gray levels
+    root_thickness : int
+        root line thickness in pixels
+    random_state : int
+        seed of the random number generator, the same value gives the same box
+
+    Returns
+    -------
+    SyntheticBox
+    """
+    rng = np.random.default_rng(random_state)
+    if growth is None:
+        growth = 0.5 * height / frames
+    canvas = np.full((height, width), background, dtype=np.uint8)
+    truths = []
+    paths = []
+    for n in range(seeds):
+        cx = int((n + 0.5) * width / seeds + rng.uniform(-0.1, 0.1) * width / seeds)
+        cy = int(height * rng.uniform(0.2, 0.3))
+        axes = (int(rng.integers(12, 18)), int(rng.integers(18, 26)))
+        cv2.ellipse(canvas, (cx, cy), axes, 0, 0, 360, seed_value, -1)
+        g = int(frames * rng.uniform(*germination))
+        path = _root_path(rng, (cx, cy + axes[1] - 2), int(growth * (frames - g)) + 10, width, height)
+        # a few pixels of root at the germination frame, so there is a tip to start tracking from
+        lengths = np.full(frames, -1)
+        lengths[g:] = np.minimum(5 + (growth * np.arange(frames - g)).astype(int), len(path) - 1)
+        tips = np.full((frames, 2), np.nan)
+        tips[g:] = path[lengths[g:]]
+        region = (max(cx - 80, 0), min(cx + 80, width), max(cy - 50, 0), min(cy + 150, height))
+        truths.append(SyntheticSeed((cx, cy), region, g, tips))
+        paths.append((path, lengths))
+
+    bank = rng.normal(0, noise, size=(8, height, width)).astype(np.int16)
+    images = np.empty((frames, height, width), dtype=np.uint8)
+    drawn = [0] * seeds
+    for t in range(frames):
+        for n, (path, lengths) in enumerate(paths):
+            if lengths[t] > drawn[n]:
+                # the root only grows, so only the new part is drawn
+                points = np.round(path[max(drawn[n] - 1, 0):lengths[t] + 1]).astype(np.int32)
+                cv2.polylines(canvas, [points], False, root_value, root_thickness)
+                drawn[n] = lengths[t]
+        np.clip(canvas + bank[t % len(bank)], 0, 255, out=images[t], casting="unsafe")
+    return SyntheticBox(images, truths)
+
+
+def _root_path(rng, start, length, width, height):
+    """:return: (length + 1, 2) float (x, y) points one pixel apart along a downward root, kept inside the frame"""
+    s = np.arange(length)
+    heading = (np.pi / 2 + rng.uniform(-0.3, 0.3) + rng.uniform(-1, 1) * 1e-3 * s
+               + rng.uniform(0.1, 0.4) * np.sin(s / rng.uniform(15, 40) + rng.uniform(0, 2 * np.pi)))
+    steps = np.stack([np.cos(heading), np.sin(heading)], axis=1)
+    path = np.vstack([start, start + np.cumsum(steps, axis=0)])
+    path[:, 0] = path[:, 0].clip(5, width - 6)
+    path[:, 1] = path[:, 1].clip(5, height - 6)
+    return path
+
+
+def write_images(box : SyntheticBox, path : str):
+    """Write the frames as one PNG per frame, the layout of an unspooled experiment directory."""
+    os.makedirs(path, exist_ok=True)
+    for index, frame in enumerate(box.images):
+        cv2.imwrite(os.path.join(path, f"frame_{index:06d}.png"), frame)
+
+
+def write_stack(box : SyntheticBox, path : str):
+    """Write the frames as a raw frame stack directory, the layout io.unspool_video_stack writes."""
+    os.makedirs(path, exist_ok=True)
+    box.images.tofile(os.path.join(path, io.STACK_FILENAME))
+    io.write_stack_metadata(path, *box.images.shape)
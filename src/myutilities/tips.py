@@ -0,0 +1,145 @@
+"""
+Module for finding root tip candidates (skeleton endpoints) in small grayscale crops
+
+Two backends with the same semantics are provided: find_tips_plantcv, the original plantcv chain, and
+TipDetector, a fused OpenCV/NumPy version of it that works on preallocated buffers.
+
+"""
+
+import cv2
+import numpy as np
+
+BACKENDS = ("plantcv", "opencv")
+
+# hit-or-miss kernels plantcv.morphology.find_tips uses to find skeleton endpoints.
+# 1 lines up with skeleton pixels, -1 with background and 0 is don't care
+_ENDPOINT1 = np.array([[-1, -1, -1],
+                       [-1, 1, -1],
+                       [0, 1, 0]])
+_ENDPOINT2 = np.array([[-1, -1, -1],
+                       [-1, 1, 0],
+                       [-1, 0, 1]])
+ENDPOINT_KERNELS = [np.rot90(k, r) for r in range(4) for k in (_ENDPOINT1, _ENDPOINT2)]
+
+
+def find_tips_plantcv(image : np.ndarray, threshold : float, blur_ksize : int = 5, fill_size : int = 10):
+    """
+    Reference implementation: threshold, median blur, fill, skeletonize and find tips with plantcv.
+
+    Parameters
+    ----------
+    image : np.ndarray
+        grayscale crop
+    threshold : float
+        pixels brighter than this are foreground
+    blur_ksize : int
+        median blur kernel size
+    fill_size : int
+        objects smaller than this many pixels are removed
+
+    Returns
+    -------
+    np.ndarray
+        (row, column) of every skeleton endpoint, shape (N, 2)
+    """
+    from plantcv import plantcv as pcv
+    threshold_light = pcv.threshold.binary(gray_img=image, threshold=threshold, max_value=255, object_type='light')
+    binary_img = pcv.median_blur(gray_img=threshold_light, ksize=blur_ksize)
+    fill_image = pcv.fill(bin_img=binary_img, size=fill_size)
+    skeleton = pcv.morphology.skeletonize(mask=fill_image)
+    tips_img = pcv.morphology.find_tips(skel_img=skeleton, mask=fill_image)
+    return np.argwhere(tips_img > 0)
+
+
+def nearest(locs : np.ndarray, last):
+    """
+    :param locs: (row, column) candidates, shape (N, 2)
+    :param last: (row, column) of the previous tip
+    :return: the candidate closest to last, or None if there are no candidates
+    """
+    if len(locs) == 0:
+        return None
+    # squared distances select the same candidate as np.linalg.norm, including ties
+    distances = ((locs - np.asarray(last)) ** 2).sum(axis=1)
+    return locs[np.argmin(distances)]
+
+
+class TipDetector:
+    """Fused OpenCV/NumPy replacement for the plantcv tip finding chain.
+
+    It reproduces each plantcv step: a binary threshold, a median blur with scipy's reflect border, removal
+    of 4-connected objects smaller than fill_size, skimage skeletonization and the plantcv endpoint
+    hit-or-miss kernels. Intermediate images live in buffers that are reused for every crop of the same
+    shape, and none of plantcv's debug or parameter handling runs per frame. One detector should be used
+    per thread.
+    """
+
+    def __init__(self, blur_ksize : int = 5, fill_size : int = 10):
+        """
+        Attributes
+        ----------
+
+        blur_ksize : int
+            argument. median blur kernel size
+        fill_size : int
+            argument. objects smaller than this many pixels are removed
+        """
+        self.blur_ksize = blur_ksize
+        self.fill_size = fill_size
+        self._shape = None
+        from skimage.morphology import skeletonize
+        self._skeletonize = skeletonize
+
+    def _allocate(self, shape):
+        pad = self.blur_ksize // 2
+        self._shape = shape
+        self._binary = np.empty(shape, dtype=np.uint8)
+        self._padded = np.empty((shape[0] + 2 * pad, shape[1] + 2 * pad), dtype=np.uint8)
+        self._blurred = np.empty_like(self._padded)
+        self._skeleton = np.empty(shape, dtype=np.uint8)
+        self._hit = np.empty(shape, dtype=np.uint8)
+        self._tips = np.empty(shape, dtype=np.uint8)
+
+    def segment(self, image : np.ndarray, threshold : float):
+        """
+        :param image: grayscale crop
+        :param threshold: pixels brighter than this are foreground
+        :return: uint8 mask (0 or 255) of the cleaned foreground. The buffer is reused by the next call
+        """
+        if image.shape != self._shape:
+            self._allocate(image.shape)
+        pad = self.blur_ksize // 2
+        cv2.threshold(image, threshold, 255, cv2.THRESH_BINARY, dst=self._binary)
+        cv2.copyMakeBorder(self._binary, pad, pad, pad, pad, cv2.BORDER_REFLECT, dst=self._padded)
+        cv2.medianBlur(self._padded, self.blur_ksize, dst=self._blurred)
+        mask = self._blurred[pad:pad + image.shape[0], pad:pad + image.shape[1]]
+        count, labels, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=4)
+        keep = stats[:, cv2.CC_STAT_AREA] >= self.fill_size
+        keep[0] = False
+        mask[...] = np.where(keep, 255, 0).astype(np.uint8)[labels]
+        return mask
+
+    def find_tips(self, image : np.ndarray, threshold : float):
+        """
+        :param image: grayscale crop
+        :param threshold: pixels brighter than this are foreground
+        :return: (row, column) of every skeleton endpoint, shape (N, 2), ordered as find_tips_plantcv orders them
+        """
+        mask = self.segment(image, threshold)
+        self._skeleton[...] = self._skeletonize(mask > 0)
+        self._skeleton *= 255
+        self._tips.fill(0)
+        for kernel in ENDPOINT_KERNELS:
+            cv2.morphologyEx(self._skeleton, cv2.MORPH_HITMISS, kernel, dst=self._hit,
+                             borderType=cv2.BORDER_CONSTANT, borderValue=0)
+            cv2.bitwise_or(self._tips, self._hit, dst=self._tips)
+        return np.argwhere(self._tips > 0)
+
+    def nearest_tip(self, image : np.ndarray, threshold : float, last):
+        """
+        :param image: grayscale crop
+        :param threshold: pixels brighter than this are foreground
+        :param last: (row, column) of the previous tip within the crop
+        :return: (row, column) of the endpoint closest to last, or None if no endpoint was found
+        """
+        return nearest(self.find_tips(image, threshold), last)
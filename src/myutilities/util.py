@@ -1,4 +1,5 @@
 import subprocess
+import importlib
 import shutil
 import time
 import os
@@ -8,6 +9,31 @@ General purpose utility module for convenience functions
 
 """
 
+class LazyModule:
+    """
+    Stand-in for a module that is imported on first attribute access.
+
+    Used for heavy dependencies (keras_retinanet, plantcv, skimage, matplotlib) so that importing the package, unspooling
+    and the first prompts of tracking do not pay for them. For example ``plt = LazyModule("matplotlib.pyplot")``.
+    """
+
+    def __init__(self, name : str):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        # only called for attributes not found on the stand-in itself
+        if attr.startswith("__") or "_name" not in self.__dict__:
+            raise AttributeError(attr)
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+    def __repr__(self):
+        state = "loaded" if self._module is not None else "not loaded"
+        return f"<lazy module '{self._name}' ({state})>"
+
+
 def listdir_nohidden(path):
     """
     :param path: directory path
@@ -99,7 +125,7 @@ def check_input(prompt, type_=None, min_=None, max_=None, range_=None):
             return ui
         
             
-def unspool_video(full_path : str, out_dir : str, remove : bool = False):
+def unspool_video(full_path : str, out_dir : str, remove : bool = False, stack : bool = False, threads : int = None):
     """
     Function for unspooling images from videos. This would allow reanalysis of videos from prior experiments without saving the raw PNGs.
     
@@ -110,14 +136,27 @@ def unspool_video(full_path : str, out_dir : str, remove : bool = False):
     out_dir : str
         path of the directory to place images. Should be named the same as the experiment number for consistency.
     remove : bool
-        Whether to delete the video after unspooling. Default is false.
+        Whether to delete the video after unspooling. The video is only deleted if ffmpeg succeeded. Default is false.
+    stack : bool
+        Whether to write a single raw uint8 frame stack (frames.u8 and frames.json) instead of one PNG per frame. Box opens a stack without decoding anything. Default is false.
+    threads : int
+        Maximum number of threads ffmpeg may use for this video. Default is ffmpeg's own choice.
+
+    Raises
+    ------
+    subprocess.CalledProcessError
+        if ffmpeg fails. The video is kept in that case.
     """
     if (not os.path.isdir(out_dir)):
         os.mkdir(out_dir)
     
-    command = "ffmpeg -i " + full_path + " -r 15 " + out_dir + "/%08d.png"
-    subprocess.call(command,shell=True)
+    if stack:
+        import src.myutilities.io as io
+        io.unspool_video_stack(full_path, out_dir, threads=threads)
+    else:
+        thread_args = ["-threads", str(threads)] if threads else []
+        command = ["ffmpeg", "-y", "-loglevel", "error"] + thread_args + ["-i", full_path, "-r", "15"] + thread_args + [out_dir + "/%08d.png"]
+        subprocess.run(command, check=True)
     
     if (remove):
         os.remove(full_path)
-      
@@ -0,0 +1,244 @@
+"""
+Module for reading frames straight out of an experiment video, without unspooling it first
+
+"""
+
+import os
+import json
+import threading
+import subprocess
+from collections import OrderedDict
+import numpy as np
+
+VIDEO_EXTENSIONS = (".mp4", ".mov", ".avi", ".mkv")
+
+
+def is_video(path : str):
+    """
+    :param path: file path
+    :return: True if the path is a video file that VideoFrames can open
+    """
+    return os.path.isfile(path) and os.path.splitext(path)[1].lower() in VIDEO_EXTENSIONS
+
+
+class VideoFrames:
+    """A random-access grayscale frame source over a video file, used by Box in place of a FrameStore.
+
+    On first use the packets of the video are probed once with ffprobe and a keyframe index (frame number
+    and timestamp of every keyframe) is written next to the video, so later opens only read a small json
+    file. A single frame is served by seeking to the nearest keyframe at or before it and decoding forward.
+    The decoded frames of recent seeks are kept in a small least-recently-used cache, so the bisect loops,
+    which hit about log2(N) frames, and the crops around them stay cheap. Slices are lazy and decode
+    sequentially from a single keyframe when iterated, which suits tip tracing.
+
+    Frame numbers follow the frames of the video itself. unspool_video resamples to 15 fps, so frame
+    numbers recorded against an unspooled copy only match when the video was already 15 fps.
+
+    Frames handed out are read-only. Copy them before drawing on them.
+    """
+
+    def __init__(self, path : str, index_path : str = None, cache_frames : int = 64):
+        """
+        Attributes
+        ----------
+
+        shape : tuple
+            (number of frames, height, width) of the video
+        _path : str
+            argument. path of the video file
+        _index_path : str
+            argument. where the keyframe index is persisted. Defaults to the video path with .index.json appended
+        _cache_frames : int
+            argument. number of decoded frames kept in RAM
+        """
+        self._path = path
+        self._index_path = index_path if index_path is not None else path + ".index.json"
+        self._cache_frames = cache_frames
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        index = self._load_index()
+        self.shape = (index["count"], index["height"], index["width"])
+        self._keyframes = np.asarray(index["keyframes"], dtype=np.int64)
+        self._keyframe_times = index["keyframe_times"]
+        self._frame_interval = index["frame_interval"]
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return VideoSlice(self, range(*key.indices(len(self))))
+        index = self._normalize(key)
+        with self._lock:
+            frame = self._cache.get(index)
+            if frame is not None:
+                self._cache.move_to_end(index)
+                return frame
+        keyframe = self._keyframe_before(index)
+        # keep only the tail of the decoded group of pictures, the frames closest to the one requested
+        keep_from = max(keyframe, index - self._cache_frames + 1)
+        requested = None
+        for number, frame in self._decode(keyframe, index + 1):
+            if number >= keep_from:
+                self._remember(number, frame)
+            if number == index:
+                requested = frame
+        # not read back from the cache, another thread's decode may have evicted it already
+        if requested is None:
+            raise IOError("Could not decode frame " + str(index) + " of " + self._path)
+        return requested
+
+    def __iter__(self):
+        return iter(self[:])
+
+    def close(self):
+        """Drop the decoded frame cache."""
+        with self._lock:
+            self._cache.clear()
+
+    def iter_range(self, start : int, stop : int):
+        """
+        Decode frames start to stop - 1 sequentially, starting from the keyframe at or before start.
+
+        Parameters
+        ----------
+        start : int
+            first frame
+        stop : int
+            one past the last frame
+        """
+        if start >= stop:
+            return
+        for number, frame in self._decode(self._keyframe_before(start), stop):
+            if number >= start:
+                yield frame
+
+    def _remember(self, number, frame):
+        with self._lock:
+            self._cache[number] = frame
+            self._cache.move_to_end(number)
+            while len(self._cache) > self._cache_frames:
+                self._cache.popitem(last=False)
+
+    def _normalize(self, index):
+        index = int(index)
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("frame index out of range")
+        return index
+
+    def _keyframe_before(self, index):
+        position = np.searchsorted(self._keyframes, index, side="right") - 1
+        return int(self._keyframes[max(position, 0)])
+
+    def _decode(self, keyframe, stop):
+        """Yield (frame number, frame) from keyframe up to stop - 1 using one ffmpeg process."""
+        height, width = self.shape[1:]
+        frame_size = height * width
+        position = self._keyframe_times[int(np.searchsorted(self._keyframes, keyframe))]
+        # seek half a frame past the keyframe without accurate seeking, so ffmpeg starts exactly on it
+        command = ["ffmpeg", "-v", "error", "-noaccurate_seek", "-ss", "%.6f" % (position + self._frame_interval / 2),
+                   "-i", self._path, "-frames:v", str(stop - keyframe), "-f", "rawvideo", "-pix_fmt", "gray", "-"]
+        process = subprocess.Popen(command, stdout=subprocess.PIPE)
+        try:
+            number = keyframe
+            while number < stop:
+                buffer = process.stdout.read(frame_size)
+                if len(buffer) < frame_size:
+                    raise IOError("Could not decode frame " + str(number) + " of " + self._path)
+                frame = np.frombuffer(buffer, dtype=np.uint8).reshape(height, width)
+                yield number, frame
+                number += 1
+        finally:
+            process.stdout.close()
+            process.kill()
+            process.wait()
+
+    def _load_index(self):
+        stat = os.stat(self._path)
+        try:
+            with open(self._index_path) as f:
+                index = json.load(f)
+            if index["size"] == stat.st_size and index["mtime"] == stat.st_mtime:
+                return index
+        except (OSError, ValueError, KeyError):
+            pass
+        index = build_index(self._path)
+        index["size"] = stat.st_size
+        index["mtime"] = stat.st_mtime
+        try:
+            tmp = self._index_path + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump(index, f)
+            os.replace(tmp, self._index_path)
+        except OSError:
+            print("Could not save keyframe index to " + self._index_path + ". It will be rebuilt next time.")
+        return index
+
+
+class VideoSlice:
+    """A lazy, contiguous run of frames of a VideoFrames. Iterating it decodes the run in a single pass."""
+
+    def __init__(self, frames : VideoFrames, indices : range):
+        self._frames = frames
+        self._indices = indices
+
+    def __len__(self):
+        return len(self._indices)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return VideoSlice(self._frames, self._indices[key])
+        return self._frames[self._indices[key]]
+
+    def __iter__(self):
+        if self._indices.step == 1:
+            return self._frames.iter_range(self._indices.start, self._indices.stop)
+        return (self._frames[i] for i in self._indices)
+
+
+def build_index(path : str):
+    """
+    Probe every packet of the first video stream and build the keyframe index used by VideoFrames.
+
+    Parameters
+    ----------
+    path : str
+        path of the video file
+
+    Returns
+    -------
+    dict
+        count, height and width of the video, frame numbers and timestamps of the keyframes (relative to the
+        first frame), and the mean frame interval in seconds
+    """
+    command = ["ffprobe", "-v", "error", "-select_streams", "v:0", "-show_entries", "stream=width,height",
+               "-of", "csv=p=0:s=x", path]
+    width, height = subprocess.run(command, capture_output=True, text=True, check=True).stdout.strip().splitlines()[0].split("x")[:2]
+    command = ["ffprobe", "-v", "error", "-select_streams", "v:0", "-show_entries", "packet=pts_time,flags",
+               "-of", "csv=p=0", path]
+    output = subprocess.run(command, capture_output=True, text=True, check=True).stdout
+    packets = []
+    for line in output.splitlines():
+        fields = line.strip().split(",")
+        if len(fields) < 2 or fields[0] == "N/A":
+            continue
+        packets.append((float(fields[0]), "K" in fields[1]))
+    if len(packets) == 0:
+        raise IOError("No video frames found in " + path)
+    # packets come in decode order, frame numbers follow presentation order
+    packets.sort()
+    start = packets[0][0]
+    keyframes = [number for number, (pts, key) in enumerate(packets) if key]
+    if len(keyframes) == 0 or keyframes[0] != 0:
+        keyframes.insert(0, 0)
+    interval = (packets[-1][0] - start) / (len(packets) - 1) if len(packets) > 1 else 0.0
+    return {
+        "count": len(packets),
+        "height": int(height),
+        "width": int(width),
+        "keyframes": keyframes,
+        "keyframe_times": [packets[number][0] - start for number in keyframes],
+        "frame_interval": interval
+    }
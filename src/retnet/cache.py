@@ -0,0 +1,114 @@
+"""
+Module for caching model detections on disk, keyed on the input image and the model file
+
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+
+
+class DetectionCache:
+    """Content-addressed on-disk cache of raw RetinaNet detections.
+
+    The key is a hash of the image content (bytes, shape and dtype), the identity of the model file (path,
+    size and modification time) and any extra settings that change the model input. An entry stores every
+    detection the model returned, already divided by the resize scale, so the confidence cutoff is applied
+    when the entry is read and changing it does not invalidate the cache. A hit never touches the model.
+    """
+
+    def __init__(self, cache_dir : str = "/app/results/.detection_cache", enabled : bool = True):
+        """
+        Attributes
+        ----------
+
+        cache_dir : str
+            argument. directory holding one .npz file per entry. Created if it does not exist
+        enabled : bool
+            argument. when False every lookup misses and nothing is written, to bypass the cache
+        """
+        self.cache_dir = cache_dir
+        self.enabled = enabled
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def model_identity(model_path : str):
+        """
+        :param model_path: path of the model file
+        :return: dict identifying the model file by absolute path, size and modification time
+        """
+        stat = os.stat(model_path)
+        return {"path": os.path.abspath(model_path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+    def key(self, image : np.ndarray, model_path : str, **settings):
+        """
+        :param image: the image detection runs on
+        :param model_path: path of the model file
+        :param settings: anything else that changes the model input, such as the crop region or inference scale
+        :return: hex digest of the entry
+        """
+        digest = hashlib.blake2b(digest_size=20)
+        image = np.ascontiguousarray(image)
+        digest.update(f"{image.shape}|{image.dtype}".encode())
+        digest.update(image.data)
+        digest.update(json.dumps(self.model_identity(model_path), sort_keys=True).encode())
+        digest.update(json.dumps(settings, sort_keys=True, default=str).encode())
+        return digest.hexdigest()
+
+    def get(self, key : str):
+        """
+        :param key: entry key from key()
+        :return: (boxes, scores, labels) of the entry, or None on a miss
+        """
+        if not self.enabled:
+            return None
+        try:
+            with np.load(self._path(key)) as entry:
+                return entry["boxes"], entry["scores"], entry["labels"]
+        except (OSError, KeyError, ValueError):
+            return None
+
+    def put(self, key : str, boxes, scores, labels, **metadata):
+        """
+        Store the detections of one image atomically.
+
+        Parameters
+        ----------
+        key : str
+            entry key from key()
+        boxes, scores, labels :
+            model outputs for the image, boxes already divided by the resize scale
+        metadata :
+            recorded alongside for reference, e.g. the confidence cutoff and model identity
+        """
+        if not self.enabled:
+            return
+        fd, tmp = tempfile.mkstemp(suffix=".npz", dir=self.cache_dir)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez(f, boxes=np.asarray(boxes), scores=np.asarray(scores), labels=np.asarray(labels),
+                         metadata=np.array(json.dumps(metadata, sort_keys=True, default=str)))
+            os.replace(tmp, self._path(key))
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    def metadata(self, key : str):
+        """:return: the metadata dict stored with an entry, or None on a miss"""
+        try:
+            with np.load(self._path(key)) as entry:
+                return json.loads(str(entry["metadata"]))
+        except (OSError, KeyError, ValueError):
+            return None
+
+    def clear(self):
+        """Delete every entry."""
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + ".npz")
@@ -1,25 +1,43 @@
-from keras_retinanet import models
 import cv2
-from keras_retinanet.utils.image import preprocess_image, resize_image
 import time
+import concurrent.futures
 import numpy as np
 from src.myutilities.image import Image
+from src.myutilities.util import LazyModule
 import src.myutilities.io as io
+from src.retnet.cache import DetectionCache
 from abc import ABC, abstractmethod
 import os
-import skimage
-from skimage import morphology
+
+# heavy dependencies (TensorFlow through keras_retinanet) are imported on first use
+models = LazyModule("keras_retinanet.models")
+retinanet_image = LazyModule("keras_retinanet.utils.image")
+
+# luminance weights of skimage.color.rgb2gray
+RGB2GRAY = np.array([0.2125, 0.7154, 0.0721])
 
 class Model(ABC):
 
     def __init__(self, model_path: str, confidence_cutoff=0.5):
         self.model_path = model_path
-        print("Loading MODEL: {}".format(model_path))
-        self.model = models.load_model(model_path, backbone_name="resnet50")
+        self._model = None
         self.cutoff = confidence_cutoff
         model_name = os.path.normpath(model_path)
         self.model_name = os.path.split(model_name)[1]
 
+    @property
+    def model(self):
+        """The keras model, loaded from model_path the first time it is needed."""
+        if self._model is None:
+            self.load()
+        return self._model
+
+    def load(self):
+        """Load the keras model now rather than on first use."""
+        print("Loading MODEL: {}".format(self.model_path))
+        self._model = models.load_model(self.model_path, backbone_name="resnet50")
+        return self._model
+
 
     @abstractmethod
     def detect(self, **args):
@@ -65,19 +83,48 @@ class Model(ABC):
         return cv2.resize(image, dsize=(600, 600), interpolation=cv2.INTER_CUBIC)
 
     @staticmethod
-    def denoise(image):
-        # FutureWarning from skimage
-        # Test for retinanet_testing
-        grayscale = skimage.color.rgb2gray(image)
-        # print(grayscale)
-        binarized = np.where(grayscale > np.mean(grayscale), 1, 0)
-        processed = morphology.remove_small_objects(binarized.astype(bool), min_size=100, connectivity=1).astype(int)
-        # print(processed)
-        # black out pixels
-        mask_x, mask_y = np.where(processed == 0)
-        image[mask_x, mask_y] = 0
+    def denoise(image, min_size: int = 100):
+        """
+        Black out the background and the small objects of a frame, in place.
+
+        A pixel is kept if it is brighter than the frame mean and belongs to a 4-connected object of at least
+        min_size pixels. uint8 grayscale frames are thresholded and labelled in one connected components
+        pass without leaving uint8. Colour frames are thresholded on their luminance as
+        skimage.color.rgb2gray computes it. The output matches the earlier rgb2gray / remove_small_objects
+        implementation, see code/benchmark_denoise.py.
+
+        Returns
+        -------
+        np.ndarray
+            image, modified in place
+        """
+        if image.ndim == 2 and image.dtype == np.uint8:
+            # for integer pixels p > mean is p > floor(mean), which is how cv2.threshold rounds on uint8
+            _, binary = cv2.threshold(image, np.mean(image), 1, cv2.THRESH_BINARY)
+        else:
+            if image.ndim == 2:
+                grayscale = image
+            else:
+                grayscale = (image[..., :3] / 255.0 if image.dtype == np.uint8 else image[..., :3]) @ RGB2GRAY
+            binary = (grayscale > np.mean(grayscale)).astype(np.uint8)
+        count, labels, stats, _ = cv2.connectedComponentsWithStats(binary, connectivity=4)
+        keep = (stats[:, cv2.CC_STAT_AREA] >= min_size).astype(image.dtype)
+        keep[0] = 0
+        mask = keep[labels]
+        np.multiply(image, mask if image.ndim == 2 else mask[..., None], out=image)
         return image
 
+    @staticmethod
+    def denoise_stack(images: np.ndarray, min_size: int = 100):
+        """
+        Denoise every frame of a writable (frames, height, width) stack in place, see denoise.
+
+        For a FrameStore use framemap.map_frames(Model.denoise, ...), as Box.denoise_all does.
+        """
+        for frame in images:
+            Model.denoise(frame, min_size)
+        return images
+
 
 class QrModel(Model):
 
@@ -92,8 +139,8 @@ class QrModel(Model):
             mi = Image(cv2.imread(image_path))
         mi.set_crop(int(width[0] * np.shape(mi.image)[1]), int(width[1] * np.shape(mi.image)[1]), 0, np.shape(mi.image)[0])
 
-        image = preprocess_image(mi.crop)
-        image, scale = resize_image(image)
+        image = retinanet_image.preprocess_image(mi.crop)
+        image, scale = retinanet_image.resize_image(image)
 
         start = time.time()
         boxes, scores, labels = self.model.predict_on_batch(np.expand_dims(image, axis=0))
@@ -123,47 +170,207 @@ class QrModel(Model):
 
 class SeedModel(Model):
 
-    def detect(self, image_path: str=None, image_output_path=None, image_arr:np.ndarray=None, sort:bool=False):
-
+    # keras_retinanet.utils.image.resize_image defaults, scaled by inference_scale
+    MIN_SIDE = 800
+    MAX_SIDE = 1333
+
+    def __init__(self, model_path: str, confidence_cutoff=0.5, inference_scale: float = 1.0):
+        """
+        inference_scale : float
+            multiplies the min and max side the detection region is resized to before inference. Below 1 runs
+            the model on a smaller image, trading recall on small seeds for latency
+        """
+        super().__init__(model_path, confidence_cutoff)
+        self.inference_scale = inference_scale
+
+    def detect(self, image_path: str=None, image_output_path=None, image_arr:np.ndarray=None, sort:bool=False,
+               cache: DetectionCache=None, region: tuple=None):
+        """
+        Detect seeds in one image.
+
+        Parameters
+        ----------
+        cache : DetectionCache
+            optional. raw detections are looked up here first, keyed on the image and the model file, and
+            stored after inference on a miss. A hit does not load or run the model
+        region : tuple
+            optional (x1, x2, y1, y2) in image pixels. Only this crop is sent to the model and the seeds are
+            returned in full image coordinates. Default is the whole image
+        """
+        mi = self.load_image(image_path=image_path, image_arr=image_arr, region=region)
+
+        key = None
+        cached = None
+        if cache is not None:
+            key = cache.key(mi.crop, self.model_path, crop=(mi.x1, mi.x2, mi.y1, mi.y2),
+                            inference_scale=self.inference_scale)
+            cached = cache.get(key)
+
+        if cached is not None:
+            boxes, scores, labels = cached
+            print("SEED RETINANET detections loaded from cache")
+        else:
+            image, scale = self.preprocess(mi)
+
+            start = time.time()
+
+            # expects image array with 4 dimensions, so we must add one more dimension.
+            boxes, scores, labels = self.model.predict_on_batch(np.expand_dims(image, axis=0))
+            print("SEED RETINANET processing time: ", time.time() - start)
+
+            # correct for image scale
+            # equivalent to boxes = boxes/scale
+            boxes /= scale
+            boxes, scores, labels = boxes[0], scores[0], labels[0]
+
+            if cache is not None:
+                cache.put(key, boxes, scores, labels, confidence_cutoff=self._confidence_cutoff,
+                          model=DetectionCache.model_identity(self.model_path), scale=scale,
+                          inference_scale=self.inference_scale)
+
+        return self.collect(mi, boxes, scores, labels, image_output_path=image_output_path, sort=sort)
+
+    def detect_batch(self, images: list, batch_size: int = 8, workers: int = None, sort: bool = False,
+                     regions: list = None):
+        """
+        Run seed detection on many images, batch_size images per call to the RetinaNet model.
+
+        Images are loaded and preprocessed in a thread pool. Each is resized as detect would resize it, the
+        images are grouped by resized shape to minimise padding, and each batch is zero padded at the
+        bottom and right to a common shape, which leaves box coordinates unchanged. Boxes are mapped back
+        to each image through its crop coordinates exactly as in detect.
+
+        Parameters
+        ----------
+        images : list
+            image arrays or image paths, in any mix
+        batch_size : int
+            number of images per model call
+        workers : int
+            number of preprocessing threads. Default is the ThreadPoolExecutor default
+        sort : bool
+            sort the seeds of each image by x1, as in detect
+        regions : list
+            optional (x1, x2, y1, y2) detection region of each image, as in detect. None for the whole image
+
+        Returns
+        -------
+        list
+            one (seed_images, scores_list) tuple per input image, in input order
+        """
+        def prepare(item, region):
+            if isinstance(item, str):
+                return self.prepare(image_path=item, region=region)
+            return self.prepare(image_arr=item, region=region)
+
+        if regions is None:
+            regions = [None] * len(images)
+        start = time.time()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            prepared = list(executor.map(prepare, images, regions))
+
+        results = [None] * len(prepared)
+        order = sorted(range(len(prepared)), key=lambda i: prepared[i][1].shape)
+        for first in range(0, len(order), batch_size):
+            chunk = order[first:first + batch_size]
+            height = max(prepared[i][1].shape[0] for i in chunk)
+            width = max(prepared[i][1].shape[1] for i in chunk)
+            batch = np.zeros((len(chunk), height, width, 3), dtype=np.float32)
+            for j, i in enumerate(chunk):
+                image = prepared[i][1]
+                batch[j, :image.shape[0], :image.shape[1]] = image
+            boxes, scores, labels = self.model.predict_on_batch(batch)
+            for j, i in enumerate(chunk):
+                mi, _, scale = prepared[i]
+                results[i] = self.collect(mi, boxes[j] / scale, scores[j], labels[j], sort=sort)
+
+        elapsed = time.time() - start
+        print("SEED RETINANET batch of {} images: {:.2f} s, {:.2f} images/s".format(len(prepared), elapsed, len(prepared) / max(elapsed, 1e-9)))
+        return results
+
+    def warm_up(self, height: int = 800, width: int = 1067, batch_size: int = 1):
+        """
+        Run the model once on a blank batch so graph building and allocation are not paid by the first real call.
+
+        Returns
+        -------
+        float
+            seconds the warm-up call took
+        """
+        start = time.time()
+        self.model.predict_on_batch(np.zeros((batch_size, height, width, 3), dtype=np.float32))
+        elapsed = time.time() - start
+        print("SEED RETINANET warm-up time: ", elapsed)
+        return elapsed
+
+    def prepare(self, image_path: str=None, image_arr: np.ndarray=None, region: tuple=None):
+        """
+        Load an image, set its detection crop and preprocess and resize the crop for the model.
+
+        Returns
+        -------
+        tuple
+            (Image with the crop set, preprocessed model input, resize scale)
+        """
+        mi = self.load_image(image_path=image_path, image_arr=image_arr, region=region)
+        image, scale = self.preprocess(mi)
+        return mi, image, scale
+
+    def load_image(self, image_path: str=None, image_arr: np.ndarray=None, region: tuple=None):
+        """
+        :param region: (x1, x2, y1, y2) detection region in image pixels, clipped to the image. None for the whole image
+        :return: the image as an Image with its detection crop set
+        """
         if image_arr is not None:
             mi = Image(image_arr)
         else:
             mi = Image(cv2.imread(image_path))
 
-        # TODO change width to zero
-        height = [500 / 3000, 2000 / 3000]  # proportion of cropped height
-        width = [1 / 6, 5 / 6]  # proportion of cropped width
-        height = [0, 1]
-        width = [0, 1]
-
-        mi.set_crop(int(width[0] * np.shape(mi.image)[1]),
-                    int(width[1] * np.shape(mi.image)[1]),
-                    int(height[0] * np.shape(mi.image)[0]),
-                    int(height[1] * np.shape(mi.image)[0]))
-
+        height, width = np.shape(mi.image)[:2]
+        if region is None:
+            region = (0, width, 0, height)
+        x1, x2, y1, y2 = region
+        mi.set_crop(max(int(x1), 0), min(int(x2), width), max(int(y1), 0), min(int(y2), height))
+        return mi
+
+    def preprocess(self, mi: Image):
+        """:return: (model input for the crop of mi, resize scale)"""
+        crop = mi.crop
+        if crop.ndim == 2:
+            # grayscale frames are converted here, so only the detection region is converted
+            crop = cv2.cvtColor(crop, cv2.COLOR_GRAY2BGR)
+        image = retinanet_image.preprocess_image(crop)
+        return retinanet_image.resize_image(image,
+                                            min_side=int(self.MIN_SIDE * self.inference_scale),
+                                            max_side=int(self.MAX_SIDE * self.inference_scale))
+
+    def collect(self, mi: Image, boxes, scores, labels, image_output_path=None, sort:bool=False):
+        """
+        Turn the scaled detections of one image into seed Images and scores, dropping those below the confidence cutoff.
+
+        Parameters
+        ----------
+        mi : Image
+            the image with its detection crop set, from prepare
+        boxes, scores, labels :
+            model outputs for this image, with boxes already divided by the resize scale
+
+        Returns
+        -------
+        tuple
+            (list of seed Images cropped to their boxes, list of scores)
+        """
         # create copy to draw on
-        draw = mi.image.copy()
+        if image_output_path is not None:
+            draw = mi.image.copy() if mi.image.ndim == 3 else cv2.cvtColor(mi.image, cv2.COLOR_GRAY2BGR)
 
         # load label to names mapping for visualization purposes
         label_dictionary = {0: 'seed'}
 
-        image = preprocess_image(mi.crop)
-        image, scale = resize_image(image)
-
-        start = time.time()
-
-        # expects image array with 4 dimensions, so we must add one more dimension.
-        boxes, scores, labels = self.model.predict_on_batch(np.expand_dims(image, axis=0))
-        print("SEED RETINANET processing time: ", time.time() - start)
-
-        # correct for image scale
-        # equivalent to boxes = boxes/scale
-        boxes /= scale
-
         seed_images = []
         scores_list = []
 
-        for box, score, label in zip(boxes[0], scores[0], labels[0]):
+        for box, score, label in zip(boxes, scores, labels):
             # score values are sorted
             if score < self._confidence_cutoff:
                 break
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the modules import each other as src.myutilities..., as they do under /app in the container
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
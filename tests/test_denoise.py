@@ -0,0 +1,93 @@
+"""
+Model.denoise and Model.denoise_stack against the skimage implementation they replaced
+"""
+
+import os
+import importlib.util
+import pytest
+
+np = pytest.importorskip("numpy")
+cv2 = pytest.importorskip("cv2")
+pytest.importorskip("skimage")
+pytest.importorskip("PIL")
+
+from src.retnet.model import Model
+
+
+def load_benchmark():
+    path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "code", "benchmark_denoise.py")
+    spec = importlib.util.spec_from_file_location("benchmark_denoise", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+benchmark = load_benchmark()
+
+
+def blob_frame(sizes, shape=(80, 120), background=10, value=200):
+    """:return: a frame with one filled blob of each size in pixels, laid out on a grid so none touch"""
+    frame = np.full(shape, background, dtype=np.uint8)
+    for index, size in enumerate(sizes):
+        top, left = 2 + 25 * (index // 5), 2 + 22 * (index % 5)
+        rows, remainder = divmod(size, 15)
+        frame[top:top + rows, left:left + 15] = value
+        frame[top + rows, left:left + remainder] = value
+    return frame
+
+
+def diagonal_frame():
+    """:return: two 60 pixel squares touching only at a corner, one object under 8- but not 4-connectivity"""
+    frame = np.zeros((40, 40), dtype=np.uint8)
+    frame[5:11, 5:15] = 200
+    frame[11:17, 15:25] = 200
+    return frame
+
+
+def all_foreground_frame():
+    """:return: a frame brighter than its mean everywhere but one pixel"""
+    frame = np.full((50, 50), 200, dtype=np.uint8)
+    frame[0, 0] = 0
+    return frame
+
+
+FRAMES = {
+    "empty": np.full((50, 60), 37, dtype=np.uint8),
+    "zeros": np.zeros((30, 30), dtype=np.uint8),
+    "all_foreground": all_foreground_frame(),
+    "at_threshold": blob_frame([99, 100, 101]),
+    "many_sizes": blob_frame([1, 15, 50, 98, 99, 100, 101, 150, 300]),
+    "diagonal": diagonal_frame(),
+    "random": benchmark.generate_frames(1, 200, 300, seed=0)[0],
+    "random_other": benchmark.generate_frames(1, 151, 233, seed=7)[0],
+}
+
+
+@pytest.mark.parametrize("name", sorted(FRAMES))
+def test_denoise_matches_reference(name):
+    frame = FRAMES[name]
+    expected = benchmark.denoise_reference(frame.copy())
+    out = frame.copy()
+    result = Model.denoise(out)
+    assert result is out
+    np.testing.assert_array_equal(result, expected)
+
+
+def test_denoise_color_matches_reference():
+    frame = benchmark.generate_frames(1, 120, 160, color=True, seed=3)[0]
+    np.testing.assert_array_equal(Model.denoise(frame.copy()), benchmark.denoise_reference(frame.copy()))
+
+
+def test_denoise_min_size():
+    frame = blob_frame([49, 50, 51])
+    out = Model.denoise(frame.copy(), min_size=50)
+    kept = cv2.connectedComponentsWithStats((out > 0).astype(np.uint8), connectivity=4)[2][1:, cv2.CC_STAT_AREA]
+    assert sorted(kept) == [50, 51]
+
+
+def test_denoise_stack_matches_reference():
+    stack = np.stack([benchmark.generate_frames(1, 100, 140, seed=s)[0] for s in range(3)]
+                     + [blob_frame([99, 100], shape=(100, 140)), np.zeros((100, 140), dtype=np.uint8)])
+    expected = np.stack([benchmark.denoise_reference(frame.copy()) for frame in stack])
+    result = Model.denoise_stack(stack.copy())
+    np.testing.assert_array_equal(result, expected)
@@ -0,0 +1,55 @@
+"""
+Parity of tips.TipDetector with the plantcv chain it replaces, on synthetic root skeletons
+"""
+
+import pytest
+
+np = pytest.importorskip("numpy")
+cv2 = pytest.importorskip("cv2")
+pytest.importorskip("skimage")
+pytest.importorskip("plantcv.plantcv")
+
+from src.myutilities import tips
+
+
+def crop_with(shapes, size=(60, 60), background=40, value=200, noise=4, seed=0):
+    """:return: a grayscale crop with polylines drawn on a noisy background, each shape ((x, y) points, thickness)"""
+    rng = np.random.default_rng(seed)
+    image = np.full(size, background, dtype=np.uint8)
+    for points, thickness in shapes:
+        cv2.polylines(image, [np.array(points, dtype=np.int32)], False, value, thickness)
+    return np.clip(image + rng.normal(0, noise, size), 0, 255).astype(np.uint8)
+
+
+CROPS = {
+    "straight": crop_with([([(30, 5), (30, 50)], 3)]),
+    "curved": crop_with([([(10, 10), (20, 25), (35, 30), (45, 45), (40, 55)], 3)], seed=1),
+    "branching": crop_with([([(30, 5), (30, 35), (15, 55)], 3), ([(30, 35), (48, 52)], 3)], seed=2),
+    "touching_border": crop_with([([(0, 30), (40, 30), (59, 59)], 4)], seed=3),
+    "speck_and_root": crop_with([([(5, 5), (6, 6)], 1), ([(40, 10), (42, 50)], 3)], seed=4),
+    "empty": crop_with([], seed=5),
+    "rectangular": crop_with([([(5, 20), (70, 25), (90, 10)], 3)], size=(40, 100), seed=6),
+}
+
+
+@pytest.mark.parametrize("name", sorted(CROPS))
+def test_find_tips_matches_plantcv(name):
+    image = CROPS[name]
+    threshold = np.median(image) * 1.5
+    expected = tips.find_tips_plantcv(image, threshold)
+    found = tips.TipDetector().find_tips(image, threshold)
+    np.testing.assert_array_equal(found, expected)
+
+
+def test_detector_reuses_buffers_across_shapes():
+    detector = tips.TipDetector()
+    for name in ("straight", "rectangular", "curved"):
+        image = CROPS[name]
+        threshold = np.median(image) * 1.5
+        np.testing.assert_array_equal(detector.find_tips(image, threshold), tips.find_tips_plantcv(image, threshold))
+
+
+def test_nearest_picks_closest_candidate():
+    locs = np.array([[10, 10], [30, 30], [50, 5]])
+    np.testing.assert_array_equal(tips.nearest(locs, (28, 33)), [30, 30])
+    assert tips.nearest(np.empty((0, 2), dtype=int), (0, 0)) is None
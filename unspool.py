@@ -9,11 +9,25 @@ parser.add_argument('--input_dir', type=str, required=True, help='Path to input
 parser.add_argument('--output_dir', type=str, required=True, help='Path to output directory for unspooled images')
 parser.add_argument('--container', type=str, default='docker', choices=['docker', 'singularity'], 
                     help='Container runtime to use (docker or singularity)')
+parser.add_argument('--stack', action='store_true',
+                    help='Write each video as a single raw frame stack instead of one PNG per frame')
+parser.add_argument('--workers', type=int, default=1,
+                    help='Number of videos unspooled concurrently')
+parser.add_argument('--threads', type=int, default=None,
+                    help='Maximum number of threads for each ffmpeg job')
+parser.add_argument('--keep', action='store_true',
+                    help='Keep the source videos after unspooling')
 args = parser.parse_args()
 
 input_dir = args.input_dir
 output_dir = args.output_dir
 container_type = args.container
+extra_args = ["--stack"] if args.stack else []
+extra_args += ["--workers", str(args.workers)]
+if args.threads is not None:
+    extra_args += ["--threads", str(args.threads)]
+if args.keep:
+    extra_args += ["--keep"]
 
 # Ensure directories exist
 os.makedirs(input_dir, exist_ok=True)
@@ -41,7 +55,7 @@ if container_type == "docker":
         "python", "/app/code/unspool_core.py",
         "--input_path", "/app/input",
         "--output_path", "/app/output"
-    ]
+    ] + extra_args
 
 elif container_type == "singularity":
     # Pull the latest image from GitHub Container Registry
@@ -65,7 +79,7 @@ elif container_type == "singularity":
         "python", "/app/code/unspool_core.py",
         "--input_path", "/app/input",
         "--output_path", "/app/output"
-    ]
+    ] + extra_args
 
 print(f"Running unspool_core.py with input from {input_dir} and output to {output_dir}")
 subprocess.run(cmd)